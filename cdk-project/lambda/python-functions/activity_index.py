@@ -0,0 +1,36 @@
+import collections
+import urllib.parse
+
+import common
+import throttle
+
+ACTIVITY_BUCKET = "ACTIVITY_BUCKET"
+# the prefix notebooks.activity records CI activity under, as <region>/<type>/<name prefix>
+ACTIVITY_PREFIX = "ci_activity/"
+
+logger = common.get_logger()
+
+
+def recent_activity(bucket, since, prefix=ACTIVITY_PREFIX, client=None):
+    """Return the resource types CI started in each region since a time.
+
+    Args:
+        bucket (str): The bucket of the activity registry.
+        since (datetime.datetime): Only activity recorded after this time, timezone-aware.
+        prefix (str): The prefix of the registry in the bucket.
+        client: An S3 client.
+
+    Returns:
+        {str: {str}}: The resource types, by region.
+
+    """
+    client = client or throttle.client("s3")
+    activity = collections.defaultdict(set)
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for o in page.get("Contents", []):
+            parts = o["Key"][len(prefix) :].split("/")
+            if len(parts) < 3 or o["LastModified"] < since:
+                continue
+            activity[urllib.parse.unquote(parts[0])].add(urllib.parse.unquote(parts[1]))
+    return dict(activity)
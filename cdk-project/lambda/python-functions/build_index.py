@@ -0,0 +1,94 @@
+import collections
+import os
+import urllib.parse
+
+import common
+import throttle
+
+BUILD_INDEX_BUCKET = "BUILD_INDEX_BUCKET"
+DEFAULT_PREFIX = "build-index/"
+
+logger = common.get_logger()
+
+
+class InMemoryBuildIndex:
+    """In-flight builds kept in a dict, for tests and local runs"""
+
+    def __init__(self):
+        self.builds = collections.defaultdict(set)
+
+    def add(self, project_name, source_version, build_id):
+        self.builds[(project_name, source_version)].add(build_id)
+
+    def get(self, project_name, source_version):
+        return sorted(self.builds.get((project_name, source_version), ()))
+
+    def remove(self, project_name, source_version, build_id):
+        self.builds[(project_name, source_version)].discard(build_id)
+
+
+class S3BuildIndex:
+    """In-flight builds kept as one empty S3 object per build.
+
+    Keys are <prefix><project>/<source version>/<build id>, so finding the builds of a pull
+    request is a single ListObjectsV2 call, and concurrent webhooks never overwrite each other.
+    """
+
+    def __init__(self, bucket, prefix=DEFAULT_PREFIX, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or throttle.client("s3")
+
+    def _prefix(self, project_name, source_version):
+        return "{0}{1}/{2}/".format(
+            self.prefix,
+            urllib.parse.quote(project_name, safe=""),
+            urllib.parse.quote(source_version, safe=""),
+        )
+
+    def add(self, project_name, source_version, build_id):
+        key = self._prefix(project_name, source_version) + urllib.parse.quote(build_id, safe="")
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=b"")
+
+    def get(self, project_name, source_version):
+        prefix = self._prefix(project_name, source_version)
+        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=prefix)
+        return [urllib.parse.unquote(o["Key"][len(prefix) :]) for o in response.get("Contents", [])]
+
+    def remove(self, project_name, source_version, build_id):
+        key = self._prefix(project_name, source_version) + urllib.parse.quote(build_id, safe="")
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+def create_build_index():
+    """Return the S3 index in BUILD_INDEX_BUCKET, or an in-memory index if it isn't set"""
+    bucket = os.environ.get(BUILD_INDEX_BUCKET)
+    if bucket:
+        return S3BuildIndex(bucket)
+    logger.warning("%s is not set, in-flight builds are only indexed in memory", BUILD_INDEX_BUCKET)
+    return InMemoryBuildIndex()
+
+
+def handle_build_state_change(event, context, index=None):  # pylint: disable=unused-argument
+    """Remove a finished build from the index.
+
+    Invoked by an EventBridge rule on CodeBuild "Build State Change" events for finished builds.
+    """
+    index = index or create_build_index()
+    detail = event["detail"]
+    build_id = detail["build-id"].split("/")[-1]  # the event has the build ARN
+    source_version = detail.get("additional-information", {}).get("source-version")
+    if source_version is None:
+        builds = throttle.client("codebuild").batch_get_builds(ids=[build_id])["builds"]
+        if not builds:
+            return
+        source_version = builds[0]["sourceVersion"]
+
+    index.remove(detail["project-name"], source_version, build_id)
+    logger.info(
+        "removed %s build %s for %s:%s",
+        detail["build-status"],
+        build_id,
+        detail["project-name"],
+        source_version,
+    )
@@ -1,20 +1,76 @@
+import time
+
+MODULE_LOAD_START = time.time()
+
+# pylint: disable=wrong-import-position
 import datetime
+import functools
 import os
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import common
+import cursor_store
+import throttle
+from botocore.exceptions import ClientError
 
 logger = common.get_logger()
 
-# lambda sets these as environment variables
-MAXIMUM_LOG_GROUP_AGE = int(os.environ["MAX_LOG_GROUP_AGE_IN_MINUTES"])
-REGION = os.environ["AWS_REGION"]
+# the name of this function's continuation cursor, and the time left to save it in when an
+# invocation is about to time out
+CURSOR_NAME = "clean_cw_logs"
+TIME_MARGIN_SECONDS = 30
+# invocations chained in a row to finish a sweep, before leaving the rest to the next run
+MAX_CHAINED_INVOCATIONS = 4
+# the regions and log group prefixes to clean, as comma-separated lists, and their defaults:
+# the function's own region, and the log groups of endpoints, Processing and training jobs
+CLEANUP_REGIONS = "CLEANUP_REGIONS"
+LOG_GROUP_PREFIXES = "LOG_GROUP_PREFIXES"
+DEFAULT_LOG_GROUP_PREFIXES = (
+    "/aws/sagemaker/Endpoints",
+    "/aws/sagemaker/ProcessingJobs",
+    "/aws/sagemaker/TrainingJobs",
+)
+# every Processing and training job logs to a stream of the same log group, so these groups are
+# kept and only their old streams are deleted; endpoints have a log group each
+SHARED_LOG_GROUP_PREFIXES = ("/aws/sagemaker/ProcessingJobs", "/aws/sagemaker/TrainingJobs")
+MAX_REGION_WORKERS = 8
+# deletes made at the same time in a region, at the pace of the region's AIMD limiter
+MAX_DELETE_WORKERS = 8
+# describe_log_groups and describe_log_streams return at most 50 at a time
+LIST_LIMIT = 50
+# CloudWatch Logs only allows a few calls per second per account and region, so each region's
+# AIMD limiter starts, grows and tops out lower than the throttle module's defaults
+CALLS_PER_SECOND_PER_REGION = 5
+MAX_CALLS_PER_SECOND_PER_REGION = 50
+
+
+def env_list(name, default):
+    value = os.environ.get(name)
+    return [item.strip() for item in value.split(",") if item.strip()] if value else list(default)
+
+
+@functools.lru_cache(maxsize=None)
+def logs_client(region):
+    """Return the CloudWatch Logs client of a region, created on first use and reused after."""
+    return boto3.client("logs", region_name=region, config=throttle.no_retries())
+
+
+def is_shared(group_name):
+    return group_name.startswith(SHARED_LOG_GROUP_PREFIXES)
+
+
+def get_log_groups(client, prefix, next_token, max_age_millis):
+    """List a page of log groups with a prefix.
 
+    Returns:
+        ([str], [str], str): The log groups older than the maximum age, which can be deleted,
+            the shared log groups, whose old streams are deleted instead, whatever their age,
+            and the next token, or None after the last page.
 
-def get_log_groups(client, next_token, max_age_millis):
+    """
     current_time = time.time() * 1000
-    request = {"logGroupNamePrefix": "/aws/sagemaker/Endpoints", "limit": 50}
+    request = {"logGroupNamePrefix": prefix, "limit": LIST_LIMIT}
 
     if next_token:
         request["nextToken"] = next_token
@@ -23,35 +79,209 @@ def get_log_groups(client, next_token, max_age_millis):
     group_names = [
         lg["logGroupName"]
         for lg in response["logGroups"]
-        if current_time - lg["creationTime"] > max_age_millis
+        if not is_shared(lg["logGroupName"]) and current_time - lg["creationTime"] > max_age_millis
+    ]
+    shared_names = [
+        lg["logGroupName"] for lg in response["logGroups"] if is_shared(lg["logGroupName"])
     ]
 
     next_token = response.get("nextToken", None)
-    return group_names, next_token
+    return group_names, shared_names, next_token
 
 
-def delete_log_groups(client, group_names):
-    for group_name in group_names:
-        logger.info("Deleting %s", group_name)
-        client.delete_log_group(logGroupName=group_name)
-        logger.info("Deleted")
-        time.sleep(0.5)
+def get_old_log_streams(client, group_name, max_age_millis, budget):
+    """List the streams of a log group that have had no events for longer than the maximum age.
 
+    Streams are listed least recently written first, so listing stops at the first stream with
+    a recent event. Streams that never had an event go by their creation time. Raises OutOfTime
+    before listing a page if the budget has run out.
+    """
+    current_time = time.time() * 1000
+    request = {"logGroupName": group_name, "orderBy": "LastEventTime", "limit": LIST_LIMIT}
+    stream_names = []
+    while True:
+        budget.check()
+        response = client.describe_log_streams(**request)
+        for stream in response["logStreams"]:
+            if current_time - stream.get("lastEventTimestamp", 0) <= max_age_millis:
+                return stream_names
+            if current_time - stream["creationTime"] > max_age_millis:
+                stream_names.append(stream["logStreamName"])
+        if not response.get("nextToken"):
+            return stream_names
+        request["nextToken"] = response["nextToken"]
 
-def lambda_handler(event, context):  # pylint: disable=unused-argument
-    logger.info("Invoking log groups cleanup at %s...", event["time"])
-    logger.info("Searching for log groups older than %s minutes", MAXIMUM_LOG_GROUP_AGE)
-    max_age_millis = MAXIMUM_LOG_GROUP_AGE * 60 * 1000
 
+def delete_log_group(client, group_name):
+    logger.info("Deleting %s", group_name)
     try:
-        client = boto3.client("logs", region_name=REGION)
-        next_token = None
-        more = True
+        client.delete_log_group(logGroupName=group_name)
+    except client.exceptions.ResourceNotFoundException:
+        logger.info("%s was already deleted", group_name)
+
+
+def delete_log_stream(client, group_name, stream_name):
+    logger.info("Deleting %s in %s", stream_name, group_name)
+    try:
+        client.delete_log_stream(logGroupName=group_name, logStreamName=stream_name)
+    except client.exceptions.ResourceNotFoundException:
+        logger.info("%s was already deleted", stream_name)
+
+
+def sweep_log_groups(client, prefix, max_age_millis, cursor):
+    """Delete the old log groups with a prefix, and the old streams of the shared ones.
+
+    Log groups older than the maximum age are deleted, except the shared log groups of
+    Processing and training jobs, which would take the logs of running jobs with them: only
+    their streams that have had no events for longer than the maximum age are deleted.
+
+    The sweep starts from the cursor, which is advanced after every page. Raises OutOfTime
+    before listing a page if the cursor's time budget has run out; a page of log groups whose
+    streams were being swept is listed again on resumption.
+
+    Returns:
+        dict: The number of log groups and log streams deleted.
+
+    """
+    counts = {"groups": 0, "streams": 0}
+    next_token = cursor.next_token
+    more = not cursor.done
+    with ThreadPoolExecutor(max_workers=MAX_DELETE_WORKERS) as executor:
         while more:
-            group_names, next_token = get_log_groups(client, next_token, max_age_millis)
-            logger.info("Found %s items, deleting now", len(group_names))
-            delete_log_groups(client, group_names)
+            cursor.budget.check()
+            group_names, shared_names, next_token = get_log_groups(
+                client, prefix, next_token, max_age_millis
+            )
+            logger.info("Found %s %s log groups, deleting now", len(group_names), prefix)
+            list(executor.map(lambda g: delete_log_group(client, g), group_names))
+            counts["groups"] += len(group_names)
+            for group_name in shared_names:
+                stream_names = get_old_log_streams(
+                    client, group_name, max_age_millis, cursor.budget
+                )
+                logger.info(
+                    "Found %s old streams in %s, deleting now", len(stream_names), group_name
+                )
+                list(executor.map(lambda s: delete_log_stream(client, group_name, s), stream_names))
+                counts["streams"] += len(stream_names)
+            cursor.advance(next_token)
             more = next_token is not None
-            time.sleep(1)
-    finally:
-        logger.info("Finished at %s", str(datetime.datetime.now()))
+    return counts
+
+
+def clean_region(region, prefixes, max_age_millis, progress, budget):
+    """Delete the old log groups and shared log streams of a region, one prefix after the other.
+
+    Returns:
+        dict: A summary of the region: its name, the number of log groups and log streams
+            deleted for each prefix, how long it took, the rate the limiter settled at, the error that ended it
+            early, if any, and whether it ran out of time.
+
+    """
+    start = time.time()
+    limiter = throttle.AimdLimiter(
+        rate=CALLS_PER_SECOND_PER_REGION, max_rate=MAX_CALLS_PER_SECOND_PER_REGION, increase=1.0
+    )
+    client = throttle.ThrottledClient(logs_client(region), limiter)
+    counts = {}
+    error = None
+    out_of_time = False
+    try:
+        for prefix in prefixes:
+            cursor = cursor_store.SweepCursor(progress, prefix, budget)
+            counts[prefix] = sweep_log_groups(client, prefix, max_age_millis, cursor)
+    except common.OutOfTime:
+        out_of_time = True
+    except ClientError as e:
+        logger.debug("ERROR in region %s: %s", region, str(e))
+        error = str(e)
+        # don't come back to a region that fails until the next run
+        progress.update((prefix, cursor_store.DONE) for prefix in prefixes)
+
+    return {
+        "region": region,
+        "counts": counts,
+        "seconds": time.time() - start,
+        "rate": limiter.rate,
+        "error": error,
+        "out_of_time": out_of_time,
+    }
+
+
+def log_summary(summaries):
+    for summary in sorted(summaries, key=lambda s: s["seconds"], reverse=True):
+        counts = ", ".join(
+            "{}={} groups/{} streams".format(k, v["groups"], v["streams"])
+            for k, v in sorted(summary["counts"].items())
+        )
+        logger.info(
+            "%s: %.1fs at %.1f calls/s, %s%s%s",
+            summary["region"],
+            summary["seconds"],
+            summary["rate"],
+            counts or "nothing swept",
+            ", error: {}".format(summary["error"]) if summary["error"] else "",
+            ", out of time" if summary["out_of_time"] else "",
+        )
+
+
+def lambda_handler(event, context, store=None):
+    """Delete the log groups older than MAX_LOG_GROUP_AGE_IN_MINUTES in every configured region.
+
+    The log groups shared by all Processing and training jobs are kept, and only their streams
+    without events for longer than MAX_LOG_GROUP_AGE_IN_MINUTES are deleted.
+
+    Regions are cleaned at the same time, each deleting on a pool paced by its own AIMD limiter,
+    so that deletes speed up while the API keeps up and back off when it throttles.
+
+    When the invocation is about to time out, the next token of each sweep is saved in a
+    continuation cursor, and the function invokes itself to carry on from it, up to
+    MAX_CHAINED_INVOCATIONS times in a row, after which the next scheduled run carries on.
+    """
+    logger.info("Invoking log groups cleanup at %s...", event["time"])
+    budget = common.TimeBudget(context, TIME_MARGIN_SECONDS)
+    store = store or cursor_store.create_cursor_store()
+    cursor = store.load(CURSOR_NAME) or {}
+    if cursor:
+        logger.info("Resuming from the cursor saved at %s", cursor["saved_at"])
+    # lambda sets these as environment variables
+    maximum_log_group_age = int(os.environ["MAX_LOG_GROUP_AGE_IN_MINUTES"])
+    regions = env_list(CLEANUP_REGIONS, [os.environ["AWS_REGION"]])
+    prefixes = env_list(LOG_GROUP_PREFIXES, DEFAULT_LOG_GROUP_PREFIXES)
+    logger.info("Searching for log groups older than %s minutes", maximum_log_group_age)
+    max_age_millis = maximum_log_group_age * 60 * 1000
+
+    progress = cursor.get("regions", {})
+    regions = [
+        region
+        for region in regions
+        if any(progress.get(region, {}).get(prefix) != cursor_store.DONE for prefix in prefixes)
+    ]
+    with common.timed(logger, "Cleaning {} regions".format(len(regions))):
+        with ThreadPoolExecutor(max_workers=MAX_REGION_WORKERS) as executor:
+            summaries = list(
+                executor.map(
+                    lambda r: clean_region(
+                        r, prefixes, max_age_millis, progress.setdefault(r, {}), budget
+                    ),
+                    regions,
+                )
+            )
+    log_summary(summaries)
+    logger.info("Finished at %s", str(datetime.datetime.now()))
+
+    if not any(summary["out_of_time"] for summary in summaries):
+        store.clear(CURSOR_NAME)
+        return
+
+    store.save(CURSOR_NAME, {"regions": progress, "saved_at": str(datetime.datetime.now())})
+    chained = event.get("chained", 0)
+    if context and chained < MAX_CHAINED_INVOCATIONS:
+        logger.info("Ran out of time, carrying on in a new invocation")
+        common.invoke_self(context, dict(event, chained=chained + 1))
+    else:
+        logger.info("Ran out of time, the next run carries on from the cursor")
+
+
+# only runs on a cold start, the import is cached for later invocations
+logger.info("Cold start: loaded %s in %.2fs", __name__, time.time() - MODULE_LOAD_START)
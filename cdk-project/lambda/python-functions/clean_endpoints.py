@@ -1,46 +1,77 @@
-import datetime
-import os
-import subprocess
-import sys
 import time
 
-subprocess.check_call(["pip", "install", "--upgrade", "botocore", "--target", "/tmp/"])
-subprocess.check_call(["pip", "install", "--upgrade", "boto3", "--target", "/tmp/"])
-sys.path.insert(0, "/tmp/")
-import boto3
+MODULE_LOAD_START = time.time()
 
 # pylint: disable=wrong-import-position
+import datetime
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import activity_index
+import boto3
 import botocore
 import common
+import cursor_store
+import throttle
 from botocore.exceptions import ClientError
 
 logger = common.get_logger()
 
-DEFAULT_SLEEP_TIME_SECONDS = 10
 LIST_MAX_RESULT_COUNT = 100
-# lambda sets these as environment variables
-MAXIMUM_ENDPOINT_AGE = os.environ["MAX_ENDPOINT_AGE_IN_MINUTES"]
-REGION = os.environ["AWS_REGION"]
-
+# stop calls made at the same time, and how long to wait for the stopped resources to stop
+MAX_STOP_WORKERS = 10
+STOP_POLL_SECONDS = 5
+STOP_DEADLINE_SECONDS = 300
+# full listings of the running resources made while waiting for them to stop, until two in a
+# row agree
+MAX_RUNNING_PASSES = 3
+# calls made at the same time while tearing down an experiment
+MAX_EXPERIMENT_WORKERS = 10
+# the statuses of resources that are still running, by resource type
+RUNNING_STATUSES = {
+    "MonitoringSchedules": ("Pending", "Scheduled"),
+    "ProcessingJobs": ("InProgress", "Stopping"),
+}
+# regions cleaned at the same time, each with its own client and AIMD limiter, which starts
+# at this rate
+MAX_REGION_WORKERS = 8
+CALLS_PER_SECOND_PER_REGION = 10
 
-def retries(max_retry_count, exception_message_prefix, seconds_to_sleep=DEFAULT_SLEEP_TIME_SECONDS):
-    """Retries until max retry count is reached.
+# the name of this function's continuation cursor, and the time left to save it in when an
+# invocation is about to time out
+CURSOR_NAME = "clean_endpoints"
+TIME_MARGIN_SECONDS = 60
+# invocations chained in a row to finish a sweep, before leaving the rest to the next run
+MAX_CHAINED_INVOCATIONS = 4
+# only regions CI started Processing jobs in recently are swept, with a sweep of every region
+# at least this often in case the activity registry misses something; every sweep of a region
+# is needed, since the notebooks the jobs run may start any other resource
+ACTIVITY_WINDOW = datetime.timedelta(hours=24)
+FULL_SWEEP_INTERVAL = datetime.timedelta(hours=24)
+FULL_SWEEP_NAME = "clean_endpoints_full_sweep"
+# the errors of regions the account isn't enabled in, where there is nothing to clean
+REGION_DISABLED_CODES = ("UnrecognizedClientException", "InvalidClientTokenId")
 
-    Args:
-        max_retry_count (int): The retry count.
-        exception_message_prefix (str): The message to include in the exception on failure.
-        seconds_to_sleep (int): The number of seconds to sleep between executions.
+# the sweeps of a region, in order within each chain; the chains run at the same time
+# monitoring schedules start processing jobs, and can only be deleted once stopped, and an
+# endpoint can't be deleted while a monitoring schedule is still attached to it
+SWEEP_CHAINS = (
+    (
+        ("stop", "MonitoringSchedules"),
+        ("stop", "ProcessingJobs"),
+        ("delete", "MonitoringSchedules"),
+        ("delete", "Endpoints"),
+        ("delete", "EndpointConfigs"),
+    ),
+    (("delete", "Experiments"),),
+)
 
-    """
-    for i in range(max_retry_count):
-        yield i
-        time.sleep(seconds_to_sleep)
 
-    raise Exception(
-        "'{}' has reached the maximum retry count of {}".format(
-            exception_message_prefix, max_retry_count
-        )
-    )
+@functools.lru_cache(maxsize=None)
+def sagemaker_client(region):
+    """Return the SageMaker client of a region, created on first use and reused after."""
+    return boto3.Session(region_name=region).client("sagemaker", config=throttle.no_retries())
 
 
 def get_resources(client, next_token, before_timestamp, resource_type):
@@ -52,6 +83,8 @@ def get_resources(client, next_token, before_timestamp, resource_type):
         response = client.list_monitoring_schedules(**list_req)
         resource_type = "MonitoringScheduleSummaries"
     elif resource_type == "ProcessingJobs":
+        # finished jobs can't be stopped
+        list_req.update({"StatusEquals": "InProgress"})
         response = client.list_processing_jobs(**list_req)
         resource_type = "ProcessingJobSummaries"
     elif resource_type == "Endpoints":
@@ -60,122 +93,280 @@ def get_resources(client, next_token, before_timestamp, resource_type):
     elif resource_type == "EndpointConfigs":
         response = client.list_endpoint_configs(**list_req)
     elif resource_type == "Experiments":
-        response = client.list_experiments(
-            MaxResults=LIST_MAX_RESULT_COUNT, CreatedBefore=before_timestamp
-        )
+        list_req = {"MaxResults": LIST_MAX_RESULT_COUNT, "CreatedBefore": before_timestamp}
+        if next_token:
+            list_req.update({"NextToken": next_token})
+        response = client.list_experiments(**list_req)
         resource_type = "ExperimentSummaries"
     resources = response[resource_type]
     new_next = response.get("NextToken", None)
     return resources, new_next
 
 
-def stop_resources(client, resource_names, resource_type):
-    stopped_all_resources = True
-    for resource_name in resource_names:
+def list_running(client, resource_type):
+    """Return the names of all the resources of a type that are still running, in a region.
+
+    The listing is filtered by status, and resources leave that status while it is paged
+    through, which moves later ones up into pages already read. So the listing is repeated,
+    up to MAX_RUNNING_PASSES times, until two passes in a row agree, and every resource seen
+    running in any pass is returned.
+    """
+    if resource_type == "MonitoringSchedules":
+        list_method = client.list_monitoring_schedules
+        summaries_key, name_key = "MonitoringScheduleSummaries", "MonitoringScheduleName"
+    elif resource_type == "ProcessingJobs":
+        list_method = client.list_processing_jobs
+        summaries_key, name_key = "ProcessingJobSummaries", "ProcessingJobName"
+
+    def list_pass():
+        names = set()
+        for status in RUNNING_STATUSES[resource_type]:
+            list_req = {"MaxResults": LIST_MAX_RESULT_COUNT, "StatusEquals": status}
+            while True:
+                response = list_method(**list_req)
+                names.update(summary[name_key] for summary in response[summaries_key])
+                if not response.get("NextToken"):
+                    break
+                list_req["NextToken"] = response["NextToken"]
+        return names
+
+    seen = previous = list_pass()
+    for _ in range(MAX_RUNNING_PASSES - 1):
+        names = list_pass()
+        seen |= names
+        if names == previous:
+            break
+        previous = names
+    return seen
+
+
+def stop_resources(client, resource_names, resource_type, deadline=None):
+    """Stop resources all at once, then wait for them to stop.
+
+    Rather than describing each resource, the whole set is polled by listing the resources that
+    are still running, until none of them are or STOP_DEADLINE_SECONDS have passed, or the
+    deadline if it is sooner.
+
+    Returns:
+        [str]: The resources that were still running at the deadline.
+
+    """
+
+    def stop(resource_name):
         logger.info("Stopping %s", resource_name)
-        if resource_type == "MonitoringSchedules":
-            try:
+        try:
+            if resource_type == "MonitoringSchedules":
                 client.stop_monitoring_schedule(MonitoringScheduleName=resource_name)
-            except Exception:  # pylint: disable=broad-except
-                logger.exception("Unable to stop monitoring schedule")
-                stopped_all_resources = False
-            for _ in retries(60, "Waiting for Monitoring Schedules to stop", seconds_to_sleep=5):
-                status = client.describe_monitoring_schedule(MonitoringScheduleName=resource_name)[
-                    "MonitoringScheduleStatus"
-                ]
-                if status in {"Stopped", "Failed", "Completed"}:
-                    break
-        if resource_type == "ProcessingJobs":
-            try:
+            elif resource_type == "ProcessingJobs":
                 client.stop_processing_job(ProcessingJobName=resource_name)
-            except Exception:  # pylint: disable=broad-except
-                logger.exception("Unable to stop processing job")
-                stopped_all_resources = False
-            for _ in retries(60, "Waiting for Processing Jobs to stop", seconds_to_sleep=5):
-                status = client.describe_processing_job(ProcessingJobName=resource_name)[
-                    "ProcessingJobStatus"
-                ]
-                if status in {"Stopped", "Failed", "Completed"}:
-                    break
-        logger.info("Stopped %s", resource_name)
-        time.sleep(0.5)
-    return stopped_all_resources
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Unable to stop %s", resource_name)
+
+    with ThreadPoolExecutor(max_workers=MAX_STOP_WORKERS) as executor:
+        list(executor.map(stop, resource_names))
 
+    running = set(resource_names)
+    deadline = min(time.time() + STOP_DEADLINE_SECONDS, deadline or float("inf"))
+    while running:
+        running &= list_running(client, resource_type)
+        if not running or time.time() >= deadline:
+            break
+        time.sleep(STOP_POLL_SECONDS)
+
+    for resource_name in resource_names:
+        if resource_name not in running:
+            logger.info("Stopped %s", resource_name)
+    return sorted(running)
 
-def batch_stop_resources(client, before_timestamp, resource_type):
+
+def list_stoppable(client, before_timestamp, resource_type):
+    """Return the names of all the resources of a type created before a time, in a region."""
+    names = []
+    next_token = None
+    while True:
+        resources, next_token = get_resources(client, next_token, before_timestamp, resource_type)
+        if resource_type == "MonitoringSchedules":
+            names.extend(resource["MonitoringScheduleName"] for resource in resources)
+        elif resource_type == "ProcessingJobs":
+            names.extend(resource["ProcessingJobName"] for resource in resources)
+        if next_token is None:
+            return names
+
+
+def batch_stop_resources(client, before_timestamp, resource_type, cursor):
+    """Stop the resources of a type created before a time, and return how many were found.
+
+    Processing jobs are listed by status, which stopping them changes, so paging through the
+    list while stopping would skip the jobs that move up into pages already read. Instead the
+    whole list is collected before any resource is stopped, and passes are made from the first
+    page until one finds nothing new to stop. The cursor only records that the sweep is done:
+    a resumed sweep starts over from the first page, which no longer lists what was stopped.
+    Raises OutOfTime before a pass if the cursor's time budget has run out.
+    """
+    count = 0
+    attempted = set()
     try:
-        next_token = None
-        more = True
-        while more:
+        while not cursor.done:
+            cursor.budget.check()
             logger.info("Searching for %s from before: %s", resource_type.lower(), before_timestamp)
-            resources, next_token = get_resources(
-                client, next_token, before_timestamp, resource_type
+            resource_names = [
+                name
+                for name in list_stoppable(client, before_timestamp, resource_type)
+                if name not in attempted
+            ]
+            if not resource_names:
+                cursor.advance(None)
+                break
+            logger.info("Found %s items, stopping now", len(resource_names))
+            # resources that don't stop are reported, they don't hold up the rest
+            not_stopped = stop_resources(
+                client, resource_names, resource_type, cursor.budget.deadline
             )
-            logger.info("Found %s items, stopping now", len(resources))
-            if resource_type == "MonitoringSchedules":
-                resource_names = [resource["MonitoringScheduleName"] for resource in resources]
-            elif resource_type == "ProcessingJobs":
-                resource_names = [resource["ProcessingJobName"] for resource in resources]
-            stopped = stop_resources(client, resource_names, resource_type)
-            more = stopped and (next_token is not None)
-            time.sleep(1)
+            if not_stopped:
+                logger.warning(
+                    "%d %s did not stop within %ds: %s",
+                    len(not_stopped),
+                    resource_type.lower(),
+                    STOP_DEADLINE_SECONDS,
+                    ", ".join(not_stopped),
+                )
+            attempted.update(resource_names)
+            count += len(resource_names)
     finally:
         logger.info(
             "Finished cleaning %s at %s", resource_type.lower(), str(datetime.datetime.now())
         )
+    return count
+
+
+def paginate(client, operation, result_key, **kwargs):
+    """Return every item of a paginated list call, made page by page through the client.
+
+    Unlike a boto3 paginator, which calls the wrapped client directly, each page is paced and
+    retried by the throttled client.
+    """
+    items = []
+    while True:
+        response = getattr(client, operation)(**kwargs)
+        items.extend(response[result_key])
+        if not response.get("NextToken"):
+            return items
+        kwargs["NextToken"] = response["NextToken"]
+
+
+def is_linked_error(e):
+    # a trial component linked to a trial can't be deleted until it is disassociated
+    error = e.response["Error"]
+    return error["Code"] == "ValidationException" and "is linked to" in error["Message"]
 
 
 def delete_experiment(client, experiment_name):
-    trials = client.list_trials(ExperimentName=experiment_name)
-    for trial in trials["TrialSummaries"]:
-        trial_name = trial["TrialName"]
-        trial_components = client.list_trial_components(TrialName=trial_name)
-        for tc in trial_components["TrialComponentSummaries"]:
-            tc_name = tc["TrialComponentName"]
-            client.disassociate_trial_component(
-                TrialName=trial_name,
-                TrialComponentName=tc_name,
-            )
+    """Delete an experiment with its trials and their trial components.
 
-            try:
-                client.delete_trial_component(TrialComponentName=tc_name)
-            except botocore.exceptions.ClientError as e:
-                # If the trial component is still linked to another trial,
-                # ignore it for now. (It will get deleted once completely unlinked.)
-                linked_tc_msg = (
-                    "An error occurred (ValidationException) when calling the "
-                    "DeleteTrialComponent operation: TrialComponent %s is linked "
-                    "to 1 or more trials and cannot be deleted."
-                ) % tc_name
-                if linked_tc_msg in str(e):
-                    pass
-                else:
-                    raise
+    The experiment is torn down level by level, each level with up to MAX_EXPERIMENT_WORKERS
+    calls at a time: every trial component is disassociated from every trial, then deleted, then
+    the trials and the experiment are deleted. Every link to this experiment's trials is removed
+    before the first delete, so a component that is still linked is linked to a trial of another
+    experiment; waiting wouldn't change that, so it is skipped right away and left for the
+    deletion of that experiment.
+    """
+    trial_names = [
+        trial["TrialName"]
+        for trial in paginate(
+            client, "list_trials", "TrialSummaries", ExperimentName=experiment_name
+        )
+    ]
 
+    def list_links(trial_name):
+        components = paginate(
+            client,
+            "list_trial_components",
+            "TrialComponentSummaries",
+            TrialName=trial_name,
+        )
+        return [(trial_name, tc["TrialComponentName"]) for tc in components]
+
+    def disassociate(link):
+        client.disassociate_trial_component(TrialName=link[0], TrialComponentName=link[1])
+
+    def delete_component(tc_name):
+        try:
+            client.delete_trial_component(TrialComponentName=tc_name)
+        except botocore.exceptions.ClientError as e:
+            if not is_linked_error(e):
+                raise
+            return tc_name
+        return None
+
+    def delete_trial(trial_name):
         client.delete_trial(TrialName=trial_name)
+
+    with ThreadPoolExecutor(max_workers=MAX_EXPERIMENT_WORKERS) as executor:
+        links = [link for links in executor.map(list_links, trial_names) for link in links]
+        list(executor.map(disassociate, links))
+
+        components = sorted({tc_name for _, tc_name in links})
+        logger.info(
+            "Deleting %d trial components of %d trials of %s",
+            len(components),
+            len(trial_names),
+            experiment_name,
+        )
+        linked = [tc_name for tc_name in executor.map(delete_component, components) if tc_name]
+
+        list(executor.map(delete_trial, trial_names))
+
+    if linked:
+        # they're deleted with the experiments of the trials they're linked to
+        logger.info(
+            "Left %d trial components of %s linked to other trials: %s",
+            len(linked),
+            experiment_name,
+            ", ".join(linked),
+        )
     client.delete_experiment(ExperimentName=experiment_name)
 
 
-def delete_resources(client, resource_names, resource_type):
+def delete_resources(client, resource_names, resource_type, budget=None):
+    """Delete resources one after the other.
+
+    Raises OutOfTime before a resource if the budget has run out: a single experiment, with its
+    trials and trial components, can take longer than the margin left to save the cursor in.
+    """
     for resource_name in resource_names:
+        if budget:
+            budget.check()
         logger.info("Deleting %s", resource_name)
-        if resource_type == "MonitoringSchedules":
-            client.delete_monitoring_schedule(MonitoringScheduleName=resource_name)
-        elif resource_type == "Endpoints":
-            client.delete_endpoint(EndpointName=resource_name)
-        elif resource_type == "EndpointConfigs":
-            client.delete_endpoint_config(EndpointConfigName=resource_name)
-        elif resource_type == "Experiments":
-            delete_experiment(client, resource_name)
+        # one resource that can't be deleted, e.g. because it is still in use, doesn't hold up
+        # the rest; it is tried again on the next run
+        try:
+            if resource_type == "MonitoringSchedules":
+                client.delete_monitoring_schedule(MonitoringScheduleName=resource_name)
+            elif resource_type == "Endpoints":
+                client.delete_endpoint(EndpointName=resource_name)
+            elif resource_type == "EndpointConfigs":
+                client.delete_endpoint_config(EndpointConfigName=resource_name)
+            elif resource_type == "Experiments":
+                delete_experiment(client, resource_name)
+        except ClientError as e:
+            logger.warning("Unable to delete %s: %s", resource_name, e)
+            continue
         logger.info("Deleted %s", resource_name)
-        time.sleep(0.5)
 
 
-def batch_delete_resources(client, before_timestamp, resource_type):
+def batch_delete_resources(client, before_timestamp, resource_type, cursor):
+    """Delete the resources of a type created before a time, and return how many were found.
+
+    The sweep starts from the cursor, which is advanced after every page. Raises OutOfTime
+    before listing a page or deleting a resource if the cursor's time budget has run out; the
+    page is then listed again on resumption, without the resources already deleted.
+    """
+    count = 0
     try:
-        next_token = None
-        more = True
+        next_token = cursor.next_token
+        more = not cursor.done
         while more:
+            cursor.budget.check()
             logger.info("Searching for %s from before: %s", resource_type.lower(), before_timestamp)
             resources, next_token = get_resources(
                 client, next_token, before_timestamp, resource_type
@@ -189,35 +380,198 @@ def batch_delete_resources(client, before_timestamp, resource_type):
                 resource_names = [resource["EndpointConfigName"] for resource in resources]
             elif resource_type == "Experiments":
                 resource_names = [resource["ExperimentName"] for resource in resources]
-            delete_resources(client, resource_names, resource_type)
+            delete_resources(client, resource_names, resource_type, cursor.budget)
+            count += len(resource_names)
+            cursor.advance(next_token)
             more = next_token is not None
-            time.sleep(1)
     finally:
         logger.info(
             "Finished cleaning %s at %s", resource_type.lower(), str(datetime.datetime.now())
         )
+    return count
 
 
-def lambda_handler(event, context):  # pylint: disable=unused-argument
+def sweep_keys():
+    return [
+        "{} {}".format(action, resource_type)
+        for chain in SWEEP_CHAINS
+        for action, resource_type in chain
+    ]
+
+
+def clean_region(region, before_timestamp, progress, budget):
+    """Clean the resources of a region created before a time.
+
+    Args:
+        region (str): The region to clean.
+        before_timestamp (datetime.datetime): Resources created before this time are cleaned.
+        progress (dict): The next token of each sweep of the region, updated as it goes.
+        budget (common.TimeBudget): The time the sweeps have before they stop.
+
+    Returns:
+        dict: A summary of the region: its name, the number of resources found by each sweep,
+            how long it took, the rate the limiter settled at, the error that ended it early, if
+            any, and whether it ran out of time. A region the account isn't enabled in has
+            nothing to clean, so it has no error.
+
+    """
+    start = time.time()
+    # every call to the region is paced by one limiter, and retried when it is throttled
+    limiter = throttle.AimdLimiter(rate=CALLS_PER_SECOND_PER_REGION)
+    client = throttle.ThrottledClient(sagemaker_client(region), limiter)
+    sweeps = {"stop": batch_stop_resources, "delete": batch_delete_resources}
+    counts = {}
+
+    def run_chain(chain):
+        for action, resource_type in chain:
+            key = "{} {}".format(action, resource_type)
+            cursor = cursor_store.SweepCursor(progress, key, budget)
+            counts[key] = sweeps[action](client, before_timestamp, resource_type, cursor)
+
+    error = None
+    disabled = False
+    out_of_time = False
+    with ThreadPoolExecutor(max_workers=len(SWEEP_CHAINS)) as executor:
+        futures = [executor.submit(run_chain, chain) for chain in SWEEP_CHAINS]
+        for future in futures:
+            try:
+                future.result()
+            except common.OutOfTime:
+                out_of_time = True
+            except ClientError as e:
+                if e.response["Error"]["Code"] in REGION_DISABLED_CODES:
+                    logger.debug("Region %s is not enabled: %s", region, str(e))
+                    disabled = True
+                    continue
+                logger.debug("ERROR in region %s: %s", region, str(e))
+                error = error or str(e)
+
+    if (error or disabled) and not out_of_time:
+        # don't come back to a region that fails, e.g. because it isn't enabled, until next run
+        progress.update((key, cursor_store.DONE) for key in sweep_keys())
+
+    return {
+        "region": region,
+        "counts": counts,
+        "seconds": time.time() - start,
+        "rate": limiter.rate,
+        "error": error,
+        "out_of_time": out_of_time,
+    }
+
+
+def log_summary(summaries):
+    for summary in sorted(summaries, key=lambda s: s["seconds"], reverse=True):
+        counts = ", ".join("{}={}".format(k, v) for k, v in sorted(summary["counts"].items()))
+        logger.info(
+            "%s: %.1fs at %.1f calls/s, %s%s%s",
+            summary["region"],
+            summary["seconds"],
+            summary["rate"],
+            counts or "nothing swept",
+            ", error: {}".format(summary["error"]) if summary["error"] else "",
+            ", out of time" if summary["out_of_time"] else "",
+        )
+
+
+def plan_sweeps(regions, store, now):
+    """Return the progress of a new pass over the regions that need to be swept.
+
+    Returns:
+        (dict, bool): The progress of each region to sweep, and whether it is a full sweep.
+
+    """
+    last_full_sweep = (store.load(FULL_SWEEP_NAME) or {}).get("finished_at", 0)
+    bucket = os.environ.get(activity_index.ACTIVITY_BUCKET)
+    if not bucket or now.timestamp() - last_full_sweep > FULL_SWEEP_INTERVAL.total_seconds():
+        logger.info("Sweeping every region")
+        return {region: {} for region in regions}, True
+
+    try:
+        activity = activity_index.recent_activity(bucket, now - ACTIVITY_WINDOW)
+    except ClientError as e:
+        logger.info("Sweeping every region, could not read the activity registry: %s", e)
+        return {region: {} for region in regions}, True
+
+    active = sorted(region for region in activity if region in regions)
+    logger.info("Sweeping the regions with recent activity: %s", ", ".join(active) or "none")
+    return {region: {} for region in active}, False
+
+
+def lambda_handler(event, context, store=None):
+    """Clean the resources older than MAX_ENDPOINT_AGE_IN_MINUTES in every SageMaker region.
+
+    Only the regions that CI started Processing jobs in recently, according to the activity
+    registry in ACTIVITY_BUCKET, are swept, except for a full sweep once every
+    FULL_SWEEP_INTERVAL.
+
+    When the invocation is about to time out, the sweeps stop and the next token of each is
+    saved in a continuation cursor, with the creation time the resources are listed before: a
+    next token is only valid for the request it came from. The function then invokes itself to carry on from the
+    cursor, up to MAX_CHAINED_INVOCATIONS times in a row, after which the next scheduled run
+    carries on instead. The cursor is cleared once every region has been swept.
+    """
     logger.info("Invoking endpoint cleanup at %s...", event["time"])
-    before_timestamp = datetime.datetime.now() - datetime.timedelta(
-        minutes=int(MAXIMUM_ENDPOINT_AGE)
+    budget = common.TimeBudget(context, TIME_MARGIN_SECONDS)
+    store = store or cursor_store.create_cursor_store()
+    cursor = store.load(CURSOR_NAME) or {}
+    if cursor:
+        logger.info("Resuming from the cursor saved at %s", cursor["saved_at"])
+    # lambda sets this as an environment variable
+    maximum_endpoint_age = int(os.environ["MAX_ENDPOINT_AGE_IN_MINUTES"])
+    before_timestamp = datetime.datetime.now() - datetime.timedelta(minutes=maximum_endpoint_age)
+    if cursor.get("before_timestamp"):
+        before_timestamp = datetime.datetime.fromtimestamp(cursor["before_timestamp"])
+    # Plan a new pass over the regions available for SageMaker, or carry on with the cursor's.
+    if cursor:
+        progress, full_sweep = cursor["regions"], cursor["full_sweep"]
+    else:
+        regions = boto3.Session().get_available_regions("sagemaker")
+        progress, full_sweep = plan_sweeps(
+            regions, store, datetime.datetime.now(datetime.timezone.utc)
+        )
+    regions = [
+        region
+        for region in progress
+        if any(progress[region].get(key) != cursor_store.DONE for key in sweep_keys())
+    ]
+    # Clean up resources in all regions at once.
+    with common.timed(logger, "Cleaning {} regions".format(len(regions))):
+        with ThreadPoolExecutor(max_workers=MAX_REGION_WORKERS) as executor:
+            summaries = list(
+                executor.map(
+                    lambda r: clean_region(r, before_timestamp, progress[r], budget),
+                    regions,
+                )
+            )
+    log_summary(summaries)
+
+    if not any(summary["out_of_time"] for summary in summaries):
+        store.clear(CURSOR_NAME)
+        failed = [summary["region"] for summary in summaries if summary["error"]]
+        if full_sweep and failed:
+            # the next run sweeps every region again, rather than trusting the activity registry
+            logger.info("Full sweep not recorded, it failed in %s", ", ".join(sorted(failed)))
+        elif full_sweep:
+            store.save(FULL_SWEEP_NAME, {"finished_at": time.time()})
+        return
+
+    store.save(
+        CURSOR_NAME,
+        {
+            "regions": progress,
+            "full_sweep": full_sweep,
+            "before_timestamp": before_timestamp.timestamp(),
+            "saved_at": str(datetime.datetime.now()),
+        },
     )
-    # Get all regions available for SageMaker.
-    sagemaker_regions = boto3.Session().get_available_regions("sagemaker")
-    # Clean up resources in each region.
-    for region in sagemaker_regions:
-        try:
-            sm_client = boto3.Session(region_name=region).client("sagemaker")
-            # cleaning schedules
-            batch_stop_resources(sm_client, before_timestamp, "MonitoringSchedules")
-            batch_stop_resources(sm_client, before_timestamp, "ProcessingJobs")
-            batch_delete_resources(sm_client, before_timestamp, "MonitoringSchedules")
-            # cleaning endpoints
-            batch_delete_resources(sm_client, before_timestamp, "Endpoints")
-            # cleaning endpoint_configs
-            batch_delete_resources(sm_client, before_timestamp, "EndpointConfigs")
-            # cleaning trials and trial components
-            batch_delete_resources(sm_client, before_timestamp, "Experiments")
-        except ClientError as e:
-            logger.debug("ERROR in region %s: %s", region, str(e))
+    chained = event.get("chained", 0)
+    if context and chained < MAX_CHAINED_INVOCATIONS:
+        logger.info("Ran out of time, carrying on in a new invocation")
+        common.invoke_self(context, dict(event, chained=chained + 1))
+    else:
+        logger.info("Ran out of time, the next run carries on from the cursor")
+
+
+# only runs on a cold start, the import is cached for later invocations
+logger.info("Cold start: loaded %s in %.2fs", __name__, time.time() - MODULE_LOAD_START)
@@ -1,7 +1,10 @@
+import contextlib
+import json
 import logging
 import os
+import time
 
-import boto3
+import throttle
 
 CHANGE_CONTROL_TABLE = "CHANGE_CONTROL_TABLE"
 
@@ -25,3 +28,42 @@ def get_artifact_bucket():
 def get_github_oauth_token(secrets_client):
     secret_id = os.environ["OAUTH_SECRET_ID"]
     return secrets_client.get_secret_value(SecretId=secret_id)["SecretString"]
+
+
+@contextlib.contextmanager
+def timed(logger, phase):
+    """Log how long the body of the with statement took, as "<phase> took <seconds>s"."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        logger.info("%s took %.2fs", phase, time.time() - start)
+
+
+class OutOfTime(Exception):
+    """Raised when an invocation is about to time out, once its progress has been saved."""
+
+
+class TimeBudget:
+    """The time an invocation has left, less a margin to save its progress in before it times out"""
+
+    def __init__(self, context, margin_seconds):
+        # there's no context when the handler is run locally
+        remaining = context.get_remaining_time_in_millis() / 1000 if context else float("inf")
+        self.deadline = time.time() + remaining - margin_seconds
+
+    def expired(self):
+        return time.time() >= self.deadline
+
+    def check(self):
+        if self.expired():
+            raise OutOfTime()
+
+
+def invoke_self(context, event):
+    """Invoke the running function again, asynchronously, to carry on where it stopped."""
+    throttle.client("lambda").invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(event).encode("utf-8"),
+    )
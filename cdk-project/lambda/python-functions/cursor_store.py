@@ -0,0 +1,93 @@
+import json
+import os
+import urllib.parse
+
+import botocore
+import common
+import throttle
+
+CLEANUP_STATE_BUCKET = "CLEANUP_STATE_BUCKET"
+DEFAULT_PREFIX = "cleanup-cursors/"
+DONE = "done"
+
+logger = common.get_logger()
+
+
+class InMemoryCursorStore:
+    """Continuation cursors kept in a dict, for tests and local runs.
+
+    The dict outlives an invocation as long as the Lambda container stays warm.
+    """
+
+    def __init__(self):
+        self.cursors = {}
+
+    def load(self, name):
+        return self.cursors.get(name)
+
+    def save(self, name, cursor):
+        self.cursors[name] = cursor
+
+    def clear(self, name):
+        self.cursors.pop(name, None)
+
+
+class S3CursorStore:
+    """Continuation cursors kept as one JSON object per cleanup function in S3"""
+
+    def __init__(self, bucket, prefix=DEFAULT_PREFIX, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or throttle.client("s3")
+
+    def _key(self, name):
+        return self.prefix + urllib.parse.quote(name, safe="") + ".json"
+
+    def load(self, name):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(name))
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def save(self, name, cursor):
+        body = json.dumps(cursor, sort_keys=True)
+        self.client.put_object(Bucket=self.bucket, Key=self._key(name), Body=body.encode("utf-8"))
+
+    def clear(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+
+class SweepCursor:
+    """Where one sweep of a cleanup function is up to, saved in its continuation cursor.
+
+    The progress of a group of sweeps is a dict of the next token of each sweep, or DONE once a
+    sweep has listed its last page.
+    """
+
+    def __init__(self, progress, key, budget):
+        self.progress = progress
+        self.key = key
+        self.budget = budget
+
+    @property
+    def done(self):
+        return self.progress.get(self.key) == DONE
+
+    @property
+    def next_token(self):
+        return self.progress.get(self.key)
+
+    def advance(self, next_token):
+        self.progress[self.key] = DONE if next_token is None else next_token
+
+
+def create_cursor_store():
+    """Return the S3 store in CLEANUP_STATE_BUCKET, or an in-memory store if it isn't set"""
+    bucket = os.environ.get(CLEANUP_STATE_BUCKET)
+    if bucket:
+        return S3CursorStore(bucket)
+    logger.warning("%s is not set, cleanup cursors are only kept in memory", CLEANUP_STATE_BUCKET)
+    return InMemoryCursorStore()
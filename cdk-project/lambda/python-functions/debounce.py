@@ -0,0 +1,148 @@
+import heapq
+import json
+import os
+import time
+import urllib.parse
+
+import botocore
+import common
+import throttle
+
+DEBOUNCE_SECONDS = "DEBOUNCE_SECONDS"
+DISPATCH_QUEUE_URL = "DISPATCH_QUEUE_URL"
+PUSH_LEDGER_BUCKET = "PUSH_LEDGER_BUCKET"
+DEFAULT_PREFIX = "push-ledger/"
+# SQS can't delay a message for longer than 15 minutes
+MAX_DELAY_SECONDS = 900
+
+logger = common.get_logger()
+
+
+def debounce_seconds():
+    """Return how long a pull request must be quiet before it is built, 0 to build right away"""
+    return min(int(os.environ.get(DEBOUNCE_SECONDS, "0")), MAX_DELAY_SECONDS)
+
+
+def is_older(pushed_at, recorded_at):
+    """Return whether a push is older than the recorded one; times are ISO 8601 UTC strings"""
+    return bool(pushed_at and recorded_at) and pushed_at < recorded_at
+
+
+class InMemoryPushLedger:
+    """The latest push token of each pull request, kept in a dict, for tests and local runs"""
+
+    def __init__(self):
+        self.tokens = {}
+
+    def record(self, key, token, pushed_at=None):
+        recorded = self.tokens.get(key)
+        if recorded and is_older(pushed_at, recorded[1]):
+            return False
+        self.tokens[key] = (token, pushed_at)
+        return True
+
+    def latest(self, key):
+        recorded = self.tokens.get(key)
+        return recorded[0] if recorded else None
+
+
+class S3PushLedger:
+    """The latest push token of each pull request, kept as one small S3 object per pull request.
+
+    Each webhook overwrites the token of its pull request, so a delayed dispatch whose token is
+    no longer the latest knows that a newer push arrived during its debounce window. A webhook of
+    an older push than the recorded one, e.g. a redelivery, leaves the token alone.
+    """
+
+    def __init__(self, bucket, prefix=DEFAULT_PREFIX, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or throttle.client("s3")
+
+    def _key(self, key):
+        return self.prefix + "/".join(urllib.parse.quote(part, safe="") for part in key) + ".json"
+
+    def _get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def record(self, key, token, pushed_at=None):
+        """Record the token of a push, unless a newer push is already recorded.
+
+        Returns:
+            bool: Whether the token was recorded.
+        """
+        recorded = self._get(key)
+        if recorded and is_older(pushed_at, recorded.get("pushed_at")):
+            return False
+        body = json.dumps({"token": token, "pushed_at": pushed_at, "received_at": time.time()})
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=body.encode("utf-8"))
+        return True
+
+    def latest(self, key):
+        recorded = self._get(key)
+        return recorded["token"] if recorded else None
+
+
+class LocalDispatcher:
+    """Delayed messages kept in a heap until they are due, for tests and local runs.
+
+    Nothing consumes the messages on its own: pass receive() to the queue consumer to deliver them.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.sequence = 0
+
+    def schedule(self, message, delay_seconds):
+        self.sequence += 1
+        heapq.heappush(self.messages, (time.time() + delay_seconds, self.sequence, message))
+
+    def due(self, now=None):
+        """Remove and return the messages that are due, in the order they were scheduled"""
+        now = time.time() if now is None else now
+        due = []
+        while self.messages and self.messages[0][0] <= now:
+            due.append(heapq.heappop(self.messages)[2])
+        return due
+
+    def receive(self, now=None):
+        """Return the messages that are due as an SQS event, to invoke a queue consumer with"""
+        return {"Records": [{"body": json.dumps(message)} for message in self.due(now)]}
+
+
+class SqsDispatcher:
+    """Delayed messages sent to an SQS queue with a per-message delay"""
+
+    def __init__(self, queue_url, client=None):
+        self.queue_url = queue_url
+        self.client = client or throttle.client("sqs")
+
+    def schedule(self, message, delay_seconds):
+        self.client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps(message),
+            DelaySeconds=min(int(delay_seconds), MAX_DELAY_SECONDS),
+        )
+
+
+def create_push_ledger():
+    """Return the S3 ledger in PUSH_LEDGER_BUCKET, or an in-memory ledger if it isn't set"""
+    bucket = os.environ.get(PUSH_LEDGER_BUCKET)
+    if bucket:
+        return S3PushLedger(bucket)
+    return InMemoryPushLedger()
+
+
+def create_dispatcher():
+    """Return the SQS dispatcher for DISPATCH_QUEUE_URL, or a local dispatcher if it isn't set"""
+    queue_url = os.environ.get(DISPATCH_QUEUE_URL)
+    if queue_url:
+        return SqsDispatcher(queue_url)
+    logger.warning("%s is not set, webhooks are only queued in memory", DISPATCH_QUEUE_URL)
+    return LocalDispatcher()
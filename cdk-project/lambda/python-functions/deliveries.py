@@ -0,0 +1,63 @@
+import os
+import urllib.parse
+
+import botocore
+import common
+import throttle
+
+DELIVERY_LOG_BUCKET = "DELIVERY_LOG_BUCKET"
+DEFAULT_PREFIX = "webhook-deliveries/"
+
+logger = common.get_logger()
+
+
+class InMemoryDeliveryLog:
+    """The GitHub deliveries that have been handled, kept in a set, for tests and local runs"""
+
+    def __init__(self):
+        self.deliveries = set()
+
+    def seen(self, delivery_id):
+        return delivery_id in self.deliveries
+
+    def mark(self, delivery_id):
+        self.deliveries.add(delivery_id)
+
+
+class S3DeliveryLog:
+    """The GitHub deliveries that have been handled, kept as one empty S3 object per delivery.
+
+    GitHub redelivers a webhook with the same X-GitHub-Delivery id, so a redelivery of a webhook
+    that was already handled is found with a single HeadObject call.
+    """
+
+    def __init__(self, bucket, prefix=DEFAULT_PREFIX, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or throttle.client("s3")
+
+    def _key(self, delivery_id):
+        return self.prefix + urllib.parse.quote(delivery_id, safe="")
+
+    def seen(self, delivery_id):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(delivery_id))
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return False
+            raise
+        return True
+
+    def mark(self, delivery_id):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(delivery_id), Body=b"")
+
+
+def create_delivery_log():
+    """Return the S3 log in DELIVERY_LOG_BUCKET, or an in-memory log if it isn't set"""
+    bucket = os.environ.get(DELIVERY_LOG_BUCKET)
+    if bucket:
+        return S3DeliveryLog(bucket)
+    logger.warning(
+        "%s is not set, handled deliveries are only logged in memory", DELIVERY_LOG_BUCKET
+    )
+    return InMemoryDeliveryLog()
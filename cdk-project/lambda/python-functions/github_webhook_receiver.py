@@ -1,15 +1,36 @@
 import collections
-import datetime
 import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
+import botocore
+import build_index
 import common
+import debounce
+import deliveries
+import pr_files
+import throttle
 
 GitHubUser = collections.namedtuple("GitHubUser", "id, login")
-PullRequest = collections.namedtuple("PullRequest", "owner, repo, branch, commit, submitter")
+PullRequest = collections.namedtuple(
+    "PullRequest", "owner, repo, branch, commit, submitter, number, head, updated_at"
+)
+
+# Tags that run-pr-notebooks adds to every Processing job it starts. Pull request numbers repeat
+# across repositories, so jobs are matched on their CodeBuild project as well.
+PR_NUMBER_TAG = "pr-number"
+COMMIT_TAG = "commit"
+PROJECT_TAG = "codebuild-project"
+MAX_STOP_WORKERS = 10
 
 logger = common.get_logger()
-cb_client = boto3.client("codebuild")
+cb_client = throttle.client("codebuild")
+sm_client = throttle.client("sagemaker")
+tagging_client = throttle.client("resourcegroupstaggingapi")
+index = build_index.create_build_index()
+ledger = debounce.create_push_ledger()
+dispatcher = debounce.create_dispatcher()
+delivery_log = deliveries.create_delivery_log()
 
 
 def parse_event(body):
@@ -23,9 +44,14 @@ def parse_event(body):
             repo = body["pull_request"]["base"]["repo"]["name"]
             branch = body["pull_request"]["base"]["ref"]
             commit = "pr/{0}".format(body["number"])  # pr/xxx
+            head = body["pull_request"]["head"]["sha"]
+            # when the push happened, which a redelivered webhook keeps
+            updated_at = body["pull_request"].get("updated_at")
 
             submitter = GitHubUser(submitter_id, submitter_login)
-            return PullRequest(owner, repo, branch, commit, submitter)
+            return PullRequest(
+                owner, repo, branch, commit, submitter, body["number"], head, updated_at
+            )
 
     return None
 
@@ -47,72 +73,176 @@ def build_project_name(pr):
     return "-".join(parts)
 
 
-def list_builds(project_name, next_token):
-    kwargs = {"projectName": project_name, "sortOrder": "DESCENDING"}
+def find_stale_builds(project_name, source_version):
+    # builds are indexed when they are started and removed when they finish,
+    # so this is a single lookup however busy the project is
+    stale_builds = index.get(project_name, source_version)
+    logger.info("found %d stale builds for %s:%s", len(stale_builds), project_name, source_version)
+    return stale_builds
 
-    if next_token:
-        kwargs["nextToken"] = next_token
 
-    return cb_client.list_builds_for_project(**kwargs)
+def cancel_stale_builds(project_name, source_version):
+    stale_builds = find_stale_builds(project_name, source_version)
 
+    for build_id in stale_builds:
+        try:
+            cb_client.stop_build(id=build_id)
+            logger.info("stopped stale build %s for %s:%s", build_id, project_name, source_version)
+        except cb_client.exceptions.ResourceNotFoundException:
+            logger.info("stale build %s no longer exists", build_id)
+        index.remove(project_name, source_version, build_id)
+
+
+def find_superseded_jobs(project_name, pr_number, head):
+    """Return the ARNs of the in-progress Processing jobs of a pull request not testing its head"""
+    tagged = set()
+    paginator = tagging_client.get_paginator("get_resources")
+    for page in paginator.paginate(
+        TagFilters=[
+            {"Key": PROJECT_TAG, "Values": [project_name]},
+            {"Key": PR_NUMBER_TAG, "Values": [str(pr_number)]},
+        ],
+        ResourceTypeFilters=["sagemaker:processing-job"],
+    ):
+        for resource in page["ResourceTagMappingList"]:
+            tags = {tag["Key"]: tag["Value"] for tag in resource["Tags"]}
+            if tags.get(PROJECT_TAG) == project_name and tags.get(COMMIT_TAG) != head:
+                tagged.add(resource["ResourceARN"])
+
+    if not tagged:
+        return []
+
+    # the tags outlive the jobs, so only keep the ones that are still running
+    in_progress = set()
+    paginator = sm_client.get_paginator("list_processing_jobs")
+    for page in paginator.paginate(StatusEquals="InProgress"):
+        in_progress.update(job["ProcessingJobArn"] for job in page["ProcessingJobSummaries"])
+
+    return sorted(tagged & in_progress)
+
+
+def stop_superseded_jobs(project_name, pr_number, head):
+    job_arns = find_superseded_jobs(project_name, pr_number, head)
+
+    def stop(job_arn):
+        job_name = job_arn.split("/")[-1]
+        try:
+            sm_client.stop_processing_job(ProcessingJobName=job_name)
+            logger.info("stopped superseded job %s for %s:pr/%s", job_name, project_name, pr_number)
+        except botocore.exceptions.ClientError as e:
+            # the job finished between the listing and the stop call
+            logger.info("could not stop job %s: %s", job_name, e)
+
+    with ThreadPoolExecutor(max_workers=MAX_STOP_WORKERS) as executor:
+        list(executor.map(stop, job_arns))
+
+    logger.info("stopped %d superseded jobs for %s:pr/%s", len(job_arns), project_name, pr_number)
+
+
+def changes_notebooks(pr, token):
+    # fetched once per dispatch, so that pull requests without notebook changes don't pay for a
+    # build that only finds out that there's nothing to run
+    try:
+        files = pr_files.changed_files(pr.owner, pr.repo, pr.number, token)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("failed to list the files of %s, building it anyway", pr.commit)
+        return True
+
+    logger.info("%s changes %d files", pr.commit, len(files))
+    return pr_files.changes_notebooks(files)
+
+
+def build_pull_request(pr):
+    project_name = build_project_name(pr)
+
+    cancel_stale_builds(project_name, pr.commit)
+
+    token = pr_files.github_token()
+    if changes_notebooks(pr, token):
+        response = cb_client.start_build(projectName=project_name, sourceVersion=pr.commit)
+        build_id = response["build"]["id"]
+        index.add(project_name, pr.commit, build_id)
+        logger.info("started build %s for %s:%s", build_id, project_name, pr.commit)
+    else:
+        logger.info("skipped build for %s:%s, no notebooks changed", project_name, pr.commit)
+        # the status is only informational, so failing to post it must not fail the dispatch
+        description = "No notebooks changed, build skipped"
+        try:
+            pr_files.report_skipped(pr.owner, pr.repo, pr.head, project_name, description, token)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("failed to report the skipped build of %s", pr.commit)
+
+    # the new build doesn't depend on this, so a failure here must not fail the dispatch
+    try:
+        stop_superseded_jobs(project_name, pr.number, pr.head)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("failed to stop superseded jobs for %s", pr.commit)
 
-def find_stale_builds(project_name, source_version):
-    stale_builds = []
 
-    # only consider builds <= 1 day old
-    search_after = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)
+def delivery_id(event):
+    # API Gateway passes headers through as GitHub sent them, so look the header up in any case
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    return headers.get("x-github-delivery") or uuid.uuid4().hex
 
-    next_token = None
-    while True:
-        # get build ids, most recent first
-        response = list_builds(project_name, next_token)
-        build_ids = response["ids"]
-        next_token = response.get("nextToken")
 
-        # no builds? stop looking
-        if not build_ids:
-            break
+def enqueue_build(pr, delivery, delay_seconds):
+    # every push replaces the token of its pull request, and only the dispatch carrying the
+    # latest token builds, so a burst of pushes costs one build once the pull request is quiet
+    if not ledger.record((build_project_name(pr), pr.commit), delivery, pr.updated_at):
+        logger.info("ignored webhook of %s at %s, a newer push was recorded", pr.commit, pr.head)
+        return
+    message = {"pull_request": pr._asdict(), "delivery": delivery}
+    message["pull_request"]["submitter"] = pr.submitter._asdict()
+    dispatcher.schedule(message, delay_seconds)
+    logger.info("queued build of %s at %s in %d seconds", pr.commit, pr.head, delay_seconds)
 
-        builds = cb_client.batch_get_builds(ids=build_ids)["builds"]
 
-        for b in builds:
-            # if it's running, and for the same pr, add it to stale list
-            if b["buildStatus"] == "IN_PROGRESS" and b["sourceVersion"] == source_version:
-                stale_builds.append(b["id"])
+def dispatch(message):
+    fields = dict(message["pull_request"])
+    fields["submitter"] = GitHubUser(**fields["submitter"])
+    # queued before updated_at was part of the message
+    fields.setdefault("updated_at", None)
+    pr = PullRequest(**fields)
+    delivery = message["delivery"]
 
-            # if startTime < cutoff, stop looking
-            if b["startTime"] < search_after:
-                next_token = None
-                break
+    if delivery_log.seen(delivery):
+        logger.info("skipped delivery %s of %s, it was already handled", delivery, pr.commit)
+        return
 
-        if not next_token:
-            break
+    if ledger.latest((build_project_name(pr), pr.commit)) != delivery:
+        logger.info("skipped build of %s at %s, a newer push arrived", pr.commit, pr.head)
+    else:
+        build_pull_request(pr)
 
-    logger.info("found %d stale builds for %s:%s", len(stale_builds), project_name, source_version)
-    return stale_builds
+    # only marked once handled, so that a failed build is retried when SQS redelivers it
+    delivery_log.mark(delivery)
 
 
-def cancel_stale_builds(project_name, source_version):
-    stale_builds = find_stale_builds(project_name, source_version)
+def dispatch_handler(event, context):  # pylint: disable=unused-argument
+    """Build the pull requests of queued webhooks that weren't superseded by a newer push.
 
-    for build_id in stale_builds:
-        cb_client.stop_build(id=build_id)
-        logger.info("stopped stale build %s for %s:%s", build_id, project_name, source_version)
+    Invoked by the SQS dispatch queue; a failure is raised so that the message is retried.
+    """
+    for record in event["Records"]:
+        dispatch(json.loads(record["body"]))
 
 
 def handler(event, context):  # pylint: disable=unused-argument
+    """Validate a GitHub webhook and queue its build, so that GitHub gets its response right away.
+
+    The CodeBuild calls are left to dispatch_handler: done here, slow API calls made GitHub time
+    out and redeliver the webhook, which started duplicate builds.
+    """
     try:
         pr = parse_event(json.loads(event["body"]))
 
         if pr:
-            logger.info("received webhook: %s", pr)
-            project_name = build_project_name(pr)
-
-            cancel_stale_builds(project_name, pr.commit)
-
-            response = cb_client.start_build(projectName=project_name, sourceVersion=pr.commit)
-            build_id = response["build"]["id"]
-            logger.info("started build %s for %s:%s", build_id, project_name, pr.commit)
+            delivery = delivery_id(event)
+            logger.info("received webhook %s: %s", delivery, pr)
+            if delivery_log.seen(delivery):
+                logger.info("ignored redelivery %s", delivery)
+            else:
+                enqueue_build(pr, delivery, debounce.debounce_seconds())
 
         return {"statusCode": 200}
 
@@ -0,0 +1,76 @@
+import json
+import os
+import re
+import urllib.request
+
+import common
+import throttle
+
+GITHUB_API = "https://api.github.com"
+# GitHub returns at most 100 files per page, and at most 3000 files for a pull request
+FILES_PER_PAGE = 100
+# the files run-pr-notebooks runs: notebooks that the pull request adds or changes
+NOTEBOOK_PATTERN = re.compile(r"\.ipynb$")
+
+logger = common.get_logger()
+
+
+def _github_request(url, token=None, data=None):
+    headers = {"Accept": "application/vnd.github.v3+json"}
+    if token:
+        headers["Authorization"] = "token {0}".format(token)
+    body = None if data is None else json.dumps(data).encode("utf-8")
+    request = urllib.request.Request(url, data=body, headers=headers)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def github_token():
+    """Return the GitHub OAuth token, or None to make unauthenticated calls if it isn't set"""
+    if not os.environ.get("OAUTH_SECRET_ID"):
+        return None
+    return common.get_github_oauth_token(throttle.client("secretsmanager"))
+
+
+def changed_files(owner, repo, number, token=None):
+    """Return the files of a pull request as (filename, status) pairs.
+
+    Args:
+        owner (str): The owner of the repo.
+        repo (str): The name of the repo.
+        number (int): The pull request number.
+        token (str): A GitHub OAuth token, or None for an unauthenticated call.
+
+    Returns:
+        [(str, str)]: The files, with their status: added, modified, removed, renamed...
+
+    """
+    files = []
+    page = 1
+    while True:
+        url = "{0}/repos/{1}/{2}/pulls/{3}/files?per_page={4}&page={5}".format(
+            GITHUB_API, owner, repo, number, FILES_PER_PAGE, page
+        )
+        batch = _github_request(url, token)
+        files.extend((f["filename"], f["status"]) for f in batch)
+        if len(batch) < FILES_PER_PAGE:
+            return files
+        page += 1
+
+
+def changes_notebooks(files):
+    """Return whether any notebook that still exists after the pull request was changed"""
+    return any(NOTEBOOK_PATTERN.search(name) and status != "removed" for name, status in files)
+
+
+def report_skipped(owner, repo, head, project_name, description, token=None):
+    """Set a successful commit status for a build that was skipped.
+
+    The context is the one CodeBuild reports the build under, so a required status check on the
+    build is satisfied as if the build had run.
+    """
+    url = "{0}/repos/{1}/{2}/statuses/{3}".format(GITHUB_API, owner, repo, head)
+    context = "AWS CodeBuild {0} ({1})".format(os.environ.get("AWS_REGION"), project_name)
+    _github_request(
+        url, token, {"state": "success", "description": description, "context": context}
+    )
@@ -0,0 +1,44 @@
+"""The cleanup Lambdas import quickly, offline and outside Lambda, so cold starts stay cheap."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# generous for CI machines: importing both modules takes about 0.3s locally
+MAX_IMPORT_SECONDS = 3.0
+
+IMPORT_AND_TIME = """
+import time
+
+start = time.time()
+import {module}
+
+print(time.time() - start)
+"""
+
+
+@pytest.mark.parametrize("module", ["clean_endpoints", "clean_cw_logs"])
+def test_imports_offline_within_budget(module):
+    # no AWS region, credentials or Lambda variables, and a proxy that refuses every connection
+    env = {
+        "PATH": os.environ.get("PATH", ""),
+        "HTTP_PROXY": "http://127.0.0.1:9",
+        "HTTPS_PROXY": "http://127.0.0.1:9",
+        "AWS_EC2_METADATA_DISABLED": "true",
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_AND_TIME.format(module=module)],
+        cwd=FUNCTIONS_DIR,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        timeout=60,
+    )
+
+    assert result.returncode == 0, result.stderr
+    seconds = float(result.stdout.strip().splitlines()[-1])
+    assert seconds < MAX_IMPORT_SECONDS
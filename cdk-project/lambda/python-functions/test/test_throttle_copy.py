@@ -0,0 +1,30 @@
+"""The Lambda functions' throttle module stays a copy of notebooks.throttle in the CodeBuild image."""
+
+import ast
+import os
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NOTEBOOKS_DIR = os.path.join(
+    FUNCTIONS_DIR, "..", "..", "lib", "images", "codebuild-image", "python", "src", "notebooks"
+)
+# the Lambda copy creates its clients with boto3.client() rather than with a session
+LAMBDA_ONLY_LINES = {"import boto3"}
+
+
+def read_module(path):
+    """Return the docstring of a throttle module, and its code without client() and the header."""
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    docstring = ast.get_docstring(ast.parse(source))
+    code = source[source.index('"""', source.index('"""') + 3) + 3 : source.index("\ndef client(")]
+    lines = [line for line in code.splitlines() if line not in LAMBDA_ONLY_LINES]
+    return docstring, lines
+
+
+def test_lambda_copy_matches_notebooks_throttle():
+    lambda_docstring, lambda_code = read_module(os.path.join(FUNCTIONS_DIR, "throttle.py"))
+    notebooks_docstring, notebooks_code = read_module(os.path.join(NOTEBOOKS_DIR, "throttle.py"))
+
+    # the Lambda copy adds a paragraph saying it is a copy
+    assert lambda_docstring.startswith(notebooks_docstring)
+    assert lambda_code == notebooks_code
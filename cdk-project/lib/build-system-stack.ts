@@ -4,6 +4,10 @@ import iam = require("@aws-cdk/aws-iam");
 import s3 = require("@aws-cdk/aws-s3");
 import lambda = require("@aws-cdk/aws-lambda");
 import apig = require("@aws-cdk/aws-apigateway");
+import events = require("@aws-cdk/aws-events");
+import targets = require("@aws-cdk/aws-events-targets");
+import secretsmanager = require("@aws-cdk/aws-secretsmanager");
+import sqs = require("@aws-cdk/aws-sqs");
 
 import path = require("path");
 import common = require("./common");
@@ -28,41 +32,148 @@ export class BuildSystemStack extends cdk.Stack {
         this.pullRequestBuildRole = this.createPullRequestBuildRole();
         this.ec2TestRole = this.createEc2TestRole();
         this.pullRequestBuildEcrRepo = this.createPullRequestBuildEcrRepo();
-        this.gitHubWebhookLambda = this.createGitHubWebhookLambda();
+        this.gitHubWebhookLambda = this.createGitHubWebhookLambda(Duration.seconds(60));
+        this.createBuildIndexCleanerLambda();
 
         // Keep endpoints for 45 mins, logs for 3 days
-        common.createResourceCleaningLambdas(this, Duration.minutes(45), Duration.days(3));
+        common.createResourceCleaningLambdas(
+            this,
+            Duration.minutes(45),
+            Duration.days(3),
+            this.artifactBucket,
+        );
     }
 
     createArtifactBucket(): s3.Bucket {
-        return new s3.Bucket(this, "ArtifactBucket", {
+        const bucket = new s3.Bucket(this, "ArtifactBucket", {
             versioned: true,
         });
+        // GitHub only redelivers webhooks for a few days
+        bucket.addLifecycleRule({
+            prefix: "webhook-deliveries/",
+            expiration: Duration.days(7),
+            noncurrentVersionExpiration: Duration.days(1),
+        });
+        // the push ledger, build index and cleanup cursors are overwritten on every webhook, build
+        // or sweep, so their old versions are only clutter
+        for (const prefix of ["push-ledger/", "build-index/", "cleanup-cursors/"]) {
+            bucket.addLifecycleRule({
+                prefix: prefix,
+                noncurrentVersionExpiration: Duration.days(1),
+            });
+        }
+        return bucket;
     }
 
-    createGitHubWebhookLambda(): lambda.Function {
+    createGitHubWebhookLambda(debounce: Duration): lambda.Function {
+        // the receiver only queues a build and acks, the dispatcher starts it once the pull
+        // request has been quiet for the debounce window
+        // messages that keep failing, e.g. for a deleted CodeBuild project, end up here instead
+        // of being retried forever
+        const deadLetterQueue = new sqs.Queue(this, "GitHubWebhookDispatchDeadLetterQueue", {
+            retentionPeriod: Duration.days(14),
+        });
+        const dispatchQueue = new sqs.Queue(this, "GitHubWebhookDispatchQueue", {
+            visibilityTimeout: Duration.minutes(6),
+            deadLetterQueue: {
+                queue: deadLetterQueue,
+                maxReceiveCount: 3,
+            },
+        });
+        const environment = {
+            BUILD_INDEX_BUCKET: this.artifactBucket.bucketName,
+            PUSH_LEDGER_BUCKET: this.artifactBucket.bucketName,
+            DELIVERY_LOG_BUCKET: this.artifactBucket.bucketName,
+            DISPATCH_QUEUE_URL: dispatchQueue.queueUrl,
+            DEBOUNCE_SECONDS: debounce.toSeconds().toString(),
+            OAUTH_SECRET_ID: common.Constants.gitHubOAuthSecretId,
+        };
+
         const func = new lambda.Function(this, "GitHubWebhookLambda", {
-            description: "Receives pull request webhooks from GitHub and starts a CodeBuild job",
+            description: "Receives pull request webhooks from GitHub and queues a CodeBuild job",
             code: lambda.Code.fromAsset(path.join(__dirname, "../lambda/python-functions")),
             handler: "github_webhook_receiver.handler",
             runtime: lambda.Runtime.PYTHON_3_6,
+            timeout: Duration.seconds(30),
+            environment: environment,
+        });
+        this.artifactBucket.grantReadWrite(func);
+        dispatchQueue.grantSendMessages(func);
+
+        const dispatchFunc = new lambda.Function(this, "GitHubWebhookDispatchLambda", {
+            description: "Starts the CodeBuild job of a pull request once its pushes have settled",
+            code: lambda.Code.fromAsset(path.join(__dirname, "../lambda/python-functions")),
+            handler: "github_webhook_receiver.dispatch_handler",
+            runtime: lambda.Runtime.PYTHON_3_6,
             timeout: Duration.minutes(5),
+            environment: environment,
+        });
+        this.addWebhookPermissions(dispatchFunc);
+        dispatchQueue.grantConsumeMessages(dispatchFunc);
+        // lists the files of pull requests, and reports the builds it skips
+        secretsmanager.Secret.fromSecretNameV2(
+            this,
+            "GitHubOAuthSecret",
+            common.Constants.gitHubOAuthSecretId,
+        ).grantRead(dispatchFunc);
+
+        new lambda.EventSourceMapping(this, "GitHubWebhookDispatchMapping", {
+            target: dispatchFunc,
+            eventSourceArn: dispatchQueue.queueArn,
+            batchSize: 1,
+        });
+
+        new apig.LambdaRestApi(this, "GitHubWebhookApi", {
+            handler: func,
         });
 
+        return func;
+    }
+
+    addWebhookPermissions(func: lambda.Function): void {
         const policy = new iam.PolicyStatement();
         policy.addActions(
             "codebuild:StartBuild",
             "codebuild:StopBuild",
-            "codebuild:BatchGetBuilds",
-            "codebuild:ListBuildsForProject",
+            "sagemaker:ListProcessingJobs",
+            "sagemaker:StopProcessingJob",
+            "tag:GetResources",
         );
         policy.addResources("*");
 
         func.addToRolePolicy(policy);
+        this.artifactBucket.grantReadWrite(func);
+    }
 
-        new apig.LambdaRestApi(this, "GitHubWebhookApi", {
-            handler: func,
+    createBuildIndexCleanerLambda(): lambda.Function {
+        const func = new lambda.Function(this, "BuildIndexCleanerLambda", {
+            description: "Removes finished builds from the in-flight build index",
+            code: lambda.Code.fromAsset(path.join(__dirname, "../lambda/python-functions")),
+            handler: "build_index.handle_build_state_change",
+            runtime: lambda.Runtime.PYTHON_3_6,
+            timeout: Duration.minutes(1),
+            environment: {
+                BUILD_INDEX_BUCKET: this.artifactBucket.bucketName,
+            },
+        });
+
+        const policy = new iam.PolicyStatement();
+        policy.addActions("codebuild:BatchGetBuilds");
+        policy.addResources("*");
+
+        func.addToRolePolicy(policy);
+        this.artifactBucket.grantReadWrite(func);
+
+        const rule = new events.Rule(this, "BuildFinishedRule", {
+            eventPattern: {
+                source: ["aws.codebuild"],
+                detailType: ["CodeBuild Build State Change"],
+                detail: {
+                    "build-status": ["SUCCEEDED", "FAILED", "STOPPED"],
+                },
+            },
         });
+        rule.addTarget(new targets.LambdaFunction(func));
 
         return func;
     }
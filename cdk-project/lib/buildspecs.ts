@@ -81,13 +81,14 @@ export function createFullRepoScanBuildSpec(): codebuild.BuildSpec {
         env: {
             variables: {
                 INSTANCE_TYPE: "ml.m5.xlarge",
+                SHARD: "1/1",
             },
         },
         phases: {
             build: {
                 commands: [
                     `find reinforcement_learning/*/common -maxdepth 0 -type f | xargs -I R1 sh -c "cat R1 | xargs -I R2 ln -sf R2 R1"`,
-                    `run-all-notebooks --instance $INSTANCE_TYPE`,
+                    `run-all-notebooks --instance $INSTANCE_TYPE --shard $SHARD`,
                 ],
             },
         },
@@ -104,8 +105,13 @@ export function createRepoScanResultsBuildSpec(): codebuild.BuildSpec {
         phases: {
             build: {
                 commands: [
+                    // every release build shard contributes one CSV, in its own input artifact
+                    `SHARD_CSVS=$(for dir in $(env | sed -n "s/^CODEBUILD_SRC_DIR_ARTIFACT_[0-9]*=//p"); do ls $dir/*.csv; done)`,
                     "cd $CODEBUILD_SRC_DIR_ARTIFACT_1",
-                    "describe-notebook-jobs --csv *.csv",
+                    "SCAN_CSV=$(merge-notebook-scans $SHARD_CSVS)",
+                    "describe-notebook-jobs --csv $SCAN_CSV",
+                    "aggregate-notebook-timings --csv $SCAN_CSV",
+                    "recommend-instance-types --csv $SCAN_CSV",
                 ],
             },
         },
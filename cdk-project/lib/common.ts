@@ -5,6 +5,7 @@ import events = require("@aws-cdk/aws-events");
 import targets = require("@aws-cdk/aws-events-targets");
 import iam = require("@aws-cdk/aws-iam");
 import lambda = require("@aws-cdk/aws-lambda");
+import s3 = require("@aws-cdk/aws-s3");
 
 import path = require("path");
 import { ManagedPolicy } from "@aws-cdk/aws-iam";
@@ -84,6 +85,9 @@ interface ProjectProps {
     addSourceToReleasePipeline?: boolean;
     releasePipelineScheduleExpression?: string;
     additionalBuildProjects?: Build[];
+    // number of parallel release builds, each passed SHARD=i/N; the deploy action takes at most
+    // 5 input artifacts, so at most 4 shards (3 with addSourceToReleasePipeline)
+    releaseShards?: number;
 }
 
 interface BuildProps {
@@ -92,6 +96,8 @@ interface BuildProps {
     customImage?: codebuild.IBuildImage;
     timeout?: Duration;
     pullRequestBuildSpec: codebuild.BuildSpec;
+    // only build pull requests that change a file matching this regex (default: every PR)
+    filePathPattern?: string;
 }
 
 export class Build {
@@ -100,6 +106,7 @@ export class Build {
     readonly customImage?: codebuild.IBuildImage;
     readonly timeout: Duration;
     readonly pullRequestBuildSpec: codebuild.BuildSpec;
+    readonly filePathPattern?: string;
 
     constructor(props: BuildProps) {
         this.name = props.name;
@@ -107,6 +114,7 @@ export class Build {
         this.customImage = props.customImage;
         this.timeout = props.timeout === undefined ? Duration.hours(1) : props.timeout;
         this.pullRequestBuildSpec = props.pullRequestBuildSpec;
+        this.filePathPattern = props.filePathPattern;
     }
 }
 
@@ -128,6 +136,7 @@ export class Project {
     readonly releasePipelineScheduleExpression: string;
     readonly additionalBuildProjects: Build[];
     readonly enableAutomaticRelease: boolean;
+    readonly releaseShards: number;
 
     constructor(props: ProjectProps) {
         this.repo = props.repo;
@@ -162,6 +171,7 @@ export class Project {
             props.additionalBuildProjects === undefined ? [] : props.additionalBuildProjects;
         this.enableAutomaticRelease =
             props.enableAutomaticRelease === undefined ? true : props.enableAutomaticRelease;
+        this.releaseShards = props.releaseShards === undefined ? 1 : props.releaseShards;
 
         // default is 15h15 UTC, M-F (07h15 PDT, 08h15 PST)
         this.releasePipelineScheduleExpression =
@@ -255,20 +265,45 @@ export function enableSageMakerOperation(project: codebuild.Project): void {
     }
 }
 
+// the resource cleaning functions need a newer boto3 than the runtime has, so it is installed
+// into the asset when it is built rather than on every cold start
+function resourceCleaningCode(): lambda.Code {
+    return lambda.Code.fromAsset(path.join(__dirname, "../lambda/python-functions"), {
+        bundling: {
+            image: lambda.Runtime.PYTHON_3_6.bundlingDockerImage,
+            command: [
+                "bash",
+                "-c",
+                "pip install -r requirements.txt -t /asset-output && cp -au . /asset-output",
+            ],
+        },
+    });
+}
+
+// where the cleaning functions save how far they got when they run out of time; without a
+// bucket, they only remember it while their container stays warm
+function cleaningStateEnvironment(stateBucket?: s3.IBucket): { [key: string]: string } {
+    return stateBucket ? { CLEANUP_STATE_BUCKET: stateBucket.bucketName } : {};
+}
+
 function createEndpointCleaningLambda(
     stack: cdk.Stack,
     role: iam.IRole,
     maxEndpointAge: Duration,
+    stateBucket?: s3.IBucket,
 ): void {
     const func = new lambda.Function(stack, "EndpointCleaningLambda", {
         description: "Clean endpoints created by tests",
         role: role,
-        code: lambda.Code.fromAsset(path.join(__dirname, "../lambda/python-functions")),
+        code: resourceCleaningCode(),
         handler: "clean_endpoints.lambda_handler",
         runtime: lambda.Runtime.PYTHON_3_6,
         timeout: Duration.minutes(15),
         environment: {
             MAX_ENDPOINT_AGE_IN_MINUTES: maxEndpointAge.toMinutes().toString(),
+            // the default SageMaker bucket of CI, where its runs record their activity
+            ACTIVITY_BUCKET: `sagemaker-${stack.region}-${stack.account}`,
+            ...cleaningStateEnvironment(stateBucket),
         },
     });
 
@@ -282,16 +317,18 @@ function createLogCleaningLambda(
     stack: cdk.Stack,
     role: iam.IRole,
     maxLogGroupAge: Duration,
+    stateBucket?: s3.IBucket,
 ): void {
     const func = new lambda.Function(stack, "LogCleaningLambda", {
         description: "Clean logs created by tests",
         role: role,
-        code: lambda.Code.fromAsset(path.join(__dirname, "../lambda/python-functions")),
+        code: resourceCleaningCode(),
         handler: "clean_cw_logs.lambda_handler",
         runtime: lambda.Runtime.PYTHON_3_6,
         timeout: Duration.minutes(5),
         environment: {
             MAX_LOG_GROUP_AGE_IN_MINUTES: maxLogGroupAge.toMinutes().toString(),
+            ...cleaningStateEnvironment(stateBucket),
         },
     });
 
@@ -301,11 +338,27 @@ function createLogCleaningLambda(
     rule.addTarget(new targets.LambdaFunction(func));
 }
 
-function createResourceCleaningRole(stack: cdk.Stack): iam.Role {
+function createResourceCleaningRole(stack: cdk.Stack, stateBucket?: s3.IBucket): iam.Role {
     const role = new iam.Role(stack, "ResourceCleaningRole", {
         assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
     });
 
+    // the functions invoke themselves to carry on when they run out of time
+    const policy = new iam.PolicyStatement();
+    policy.addActions("lambda:InvokeFunction");
+    policy.addResources(
+        stack.formatArn({
+            service: "lambda",
+            resource: "function",
+            resourceName: "*",
+            sep: ":",
+        }),
+    );
+    role.addToPolicy(policy);
+    if (stateBucket) {
+        stateBucket.grantReadWrite(role);
+    }
+
     role.addManagedPolicy(ManagedPolicy.fromAwsManagedPolicyName("AmazonSageMakerFullAccess"));
     role.addManagedPolicy(ManagedPolicy.fromAwsManagedPolicyName("CloudWatchFullAccess"));
 
@@ -316,10 +369,11 @@ export function createResourceCleaningLambdas(
     stack: cdk.Stack,
     maxEndpointAge: Duration,
     maxLogGroupAge: Duration,
+    stateBucket?: s3.IBucket,
 ): void {
-    const role = createResourceCleaningRole(stack);
-    createEndpointCleaningLambda(stack, role, maxEndpointAge);
-    createLogCleaningLambda(stack, role, maxLogGroupAge);
+    const role = createResourceCleaningRole(stack, stateBucket);
+    createEndpointCleaningLambda(stack, role, maxEndpointAge, stateBucket);
+    createLogCleaningLambda(stack, role, maxLogGroupAge, stateBucket);
 }
 
 export function gitHubOAuthSecret(): cdk.SecretValue {
@@ -0,0 +1,70 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Record the regions and resource types CI starts work in, so that cleanup can skip the rest"""
+
+import logging
+import time
+
+import botocore
+from notebooks.utils import default_bucket, ensure_session, write_json
+
+# The registry is one small object per region, resource type and name prefix, under this
+# prefix of the default bucket; the cleanup Lambda finds recent activity with a single listing.
+ACTIVITY_PREFIX = "ci_activity"
+# A process records the same activity at most this often, since cleanup only needs to know
+# that a region was used recently, not every job started in it.
+RECORD_INTERVAL_SECONDS = 600
+
+_last_recorded = {}
+
+log = logging.getLogger(__name__)
+
+
+def activity_uri(region, resource_type, name_prefix, session=None):
+    """Return the S3 uri of the registry entry of an activity."""
+    return (
+        f"s3://{default_bucket(session)}/{ACTIVITY_PREFIX}/{region}/{resource_type}/{name_prefix}"
+    )
+
+
+def record_activity(resource_type, name_prefix, session=None):
+    """Record that CI started a resource in the session's region.
+
+    Failures are logged rather than raised: the registry only narrows down what cleanup sweeps,
+    and cleanup still sweeps everything from time to time.
+
+    Args:
+        resource_type (str): The type of the resource, as named by the cleanup Lambda, e.g.
+            "ProcessingJobs".
+        name_prefix (str): The prefix of the names of the resources CI starts.
+        session (boto3.Session): The session the resource was started with.
+
+    """
+    session = ensure_session(session)
+    region = session.region_name
+    now = time.time()
+    if now - _last_recorded.get((region, resource_type, name_prefix), 0) < RECORD_INTERVAL_SECONDS:
+        return
+
+    entry = {
+        "region": region,
+        "resource_type": resource_type,
+        "name_prefix": name_prefix,
+        "time": now,
+    }
+    try:
+        write_json(activity_uri(region, resource_type, name_prefix, session), entry, session)
+    except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+        log.warning("Could not record %s activity in %s: %s", resource_type, region, e)
+        return
+    _last_recorded[(region, resource_type, name_prefix)] = now
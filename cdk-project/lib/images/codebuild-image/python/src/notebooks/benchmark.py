@@ -0,0 +1,708 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Benchmark the CLIs offline, against in-process fakes of the AWS services they call.
+
+The fakes keep their state in memory and run on a simulated clock: API latency, throttling, job
+durations and the CLIs' own sleeps advance the clock instead of waiting, so that a scan of 1,000
+notebooks takes seconds. A benchmark reports the real time the orchestration code took, the
+simulated time it would have taken against AWS, and the calls it made to each operation.
+"""
+
+import collections
+import contextlib
+import datetime
+import hashlib
+import importlib
+import io
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import botocore
+from notebooks import activity, throttle
+from notebooks.run import STATUS_SIDECAR_SUFFIX, sidecar_uri, split_s3_uri
+
+DEFAULT_REGION = "us-west-2"
+DEFAULT_ACCOUNT = "123456789012"
+# The simulated seconds each API call takes, and the mean duration of a Processing job.
+DEFAULT_LATENCY = 0.05
+DEFAULT_JOB_DURATION = 600.0
+# Sustained calls per second past which the fakes throttle an operation, with a burst of one
+# second's worth of calls. Operations that aren't listed are never throttled.
+DEFAULT_RATE_LIMITS = {
+    "sagemaker.CreateProcessingJob": 1.0,
+    "sagemaker.DescribeProcessingJob": 10.0,
+    "sagemaker.ListProcessingJobs": 1.0,
+    "sts.GetCallerIdentity": 20.0,
+}
+# The kernels the synthetic notebooks cycle through, so that they use several kernel images.
+KERNELS = (
+    "Python 3 (Data Science)",
+    "conda_pytorch_p36",
+    "conda_mxnet_p36",
+    "conda_tensorflow2_p36",
+    "conda_tensorflow_p36",
+)
+# PyGithub lists the files of a pull request 30 at a time.
+GITHUB_PAGE_SIZE = 30
+DEFAULT_SIZES = (10, 100, 1000)
+# Wall time growth under this many seconds isn't a regression: small runs take a fraction of a
+# second, so any noise would be a large fraction of it.
+MIN_TIME_REGRESSION_SECONDS = 1.0
+# The CLIs that can be benchmarked, with their modules and the arguments they are run with.
+CLIS = {
+    "run-pr-notebooks": ("notebooks.cli.run_pr_notebooks", ["--pr", "1", "--commit", "benchmark"]),
+    "run-all-notebooks": ("notebooks.cli.run_all_notebooks", []),
+}
+
+_gmtime = time.gmtime
+
+
+def client_error(code, operation_name, message=""):
+    """Return the ClientError botocore raises for an error response."""
+    return botocore.exceptions.ClientError(
+        {"Error": {"Code": code, "Message": message}, "ResponseMetadata": {"HTTPStatusCode": 400}},
+        operation_name,
+    )
+
+
+class SimulatedClock:
+    """A clock that sleeping advances instead of waiting.
+
+    Sleeps from several threads add up, as if they ran one after the other.
+    """
+
+    def __init__(self, start=None):
+        self.now = time.time() if start is None else start
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += max(seconds, 0)
+
+    def gmtime(self, seconds=None):
+        return _gmtime(self.now if seconds is None else seconds)
+
+
+class FakeAws:
+    """The state of the fake services of a benchmark run, and the calls made to them.
+
+    Args:
+        clock (SimulatedClock): The clock calls and jobs take their time on.
+        latency (float): The simulated seconds each call takes.
+        job_duration (float): The mean simulated seconds a Processing job runs for. Each job
+            runs for 50% to 150% of it, times the number of rounds a batch job needs.
+        failure_rate (float): The fraction of Processing jobs that fail.
+        rate_limits (dict): The calls per second past which an operation, named as
+            "<service>.<Operation>", is throttled (default: DEFAULT_RATE_LIMITS).
+        region (str): The region of the sessions that don't name one.
+        account (str): The account the fake credentials belong to.
+        seed (int): The seed of the job durations and failures.
+
+    """
+
+    def __init__(
+        self,
+        clock,
+        latency=DEFAULT_LATENCY,
+        job_duration=DEFAULT_JOB_DURATION,
+        failure_rate=0.0,
+        rate_limits=None,
+        region=DEFAULT_REGION,
+        account=DEFAULT_ACCOUNT,
+        seed=0,
+    ):
+        self.clock = clock
+        self.latency = latency
+        self.job_duration = job_duration
+        self.failure_rate = failure_rate
+        self.rate_limits = DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits
+        self.region = region
+        self.account = account
+        self.random = random.Random(seed)
+        self.objects = {}
+        self.buckets = {}
+        self.jobs = {}
+        self.calls = collections.Counter()
+        self.throttled = collections.Counter()
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    def _take_token(self, operation):
+        rate = self.rate_limits.get(operation)
+        if not rate:
+            return True
+        now = self.clock.time()
+        tokens, updated = self.tokens.get(operation, (rate, now))
+        tokens = min(rate, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self.tokens[operation] = (tokens, now)
+            return False
+        self.tokens[operation] = (tokens - 1, now)
+        return True
+
+    def call(self, service, operation_name):
+        """Count a call and spend its latency, then raise a throttling error if over the limit."""
+        operation = f"{service}.{operation_name}"
+        with self.lock:
+            self.calls[operation] += 1
+            throttled = not self._take_token(operation)
+            if throttled:
+                self.throttled[operation] += 1
+        self.clock.sleep(self.latency)
+        if throttled:
+            code = "SlowDown" if service == "s3" else "ThrottlingException"
+            raise client_error(code, operation_name, "Rate exceeded")
+
+
+class FakeClient:
+    """The API methods of a fake service, with the meta a ThrottledClient wraps them by."""
+
+    SERVICE = None
+    # The API name of each method.
+    OPERATIONS = {}
+
+    def __init__(self, aws, region_name):
+        self.aws = aws
+        self.meta = SimpleNamespace(
+            region_name=region_name,
+            service_model=SimpleNamespace(service_name=self.SERVICE),
+            method_to_api_mapping=dict(self.OPERATIONS),
+        )
+        self.exceptions = SimpleNamespace(ClientError=botocore.exceptions.ClientError)
+
+    def _call(self, method):
+        self.aws.call(self.SERVICE, self.OPERATIONS[method])
+
+
+class FakeS3(FakeClient):
+    SERVICE = "s3"
+    OPERATIONS = {
+        "create_bucket": "CreateBucket",
+        "get_object": "GetObject",
+        "head_object": "HeadObject",
+        "list_buckets": "ListBuckets",
+        "put_object": "PutObject",
+    }
+
+    def create_bucket(self, Bucket, **kwargs):
+        self._call("create_bucket")
+        self.aws.buckets.setdefault(Bucket, datetime.datetime.fromtimestamp(self.aws.clock.time()))
+        return {"Location": f"/{Bucket}"}
+
+    def list_buckets(self):
+        self._call("list_buckets")
+        return {
+            "Buckets": [
+                {"Name": name, "CreationDate": created}
+                for name, created in self.aws.buckets.items()
+            ]
+        }
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call("get_object")
+        if (Bucket, Key) not in self.aws.objects:
+            raise client_error("NoSuchKey", "GetObject", "The specified key does not exist.")
+        body = self.aws.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call("head_object")
+        if (Bucket, Key) not in self.aws.objects:
+            raise client_error("404", "HeadObject", "Not Found")
+        return {"ContentLength": len(self.aws.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        self._call("put_object")
+        self.aws.objects[(Bucket, Key)] = Body.encode("utf-8") if isinstance(Body, str) else Body
+        return {}
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        # a managed transfer, which is a single PutObject for the small files the CLIs upload
+        with open(Filename, "rb") as f:
+            self.put_object(Bucket=Bucket, Key=Key, Body=f.read())
+
+
+class FakeBucket:
+    """The part of a boto3 S3 Bucket resource that default_bucket() uses."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    @property
+    def creation_date(self):
+        for bucket in self.client.list_buckets()["Buckets"]:
+            if bucket["Name"] == self.name:
+                return bucket["CreationDate"]
+        return None
+
+
+class FakeS3Resource:
+    def __init__(self, client):
+        self.client = client
+
+    def Bucket(self, name):  # pylint: disable=invalid-name
+        return FakeBucket(self.client, name)
+
+    def create_bucket(self, **kwargs):
+        return self.client.create_bucket(**kwargs)
+
+
+class FakeSageMaker(FakeClient):
+    SERVICE = "sagemaker"
+    OPERATIONS = {
+        "create_processing_job": "CreateProcessingJob",
+        "describe_processing_job": "DescribeProcessingJob",
+        "list_processing_jobs": "ListProcessingJobs",
+    }
+
+    def _arn(self, job_name):
+        return (
+            f"arn:aws:sagemaker:{self.meta.region_name}:{self.aws.account}:"
+            f"processing-job/{job_name.lower()}"
+        )
+
+    def create_processing_job(self, ProcessingJobName, **request):
+        self._call("create_processing_job")
+        if ProcessingJobName in self.aws.jobs:
+            raise client_error(
+                "ValidationException", "CreateProcessingJob", "Job name must be unique"
+            )
+        environment = request.get("Environment", {})
+        batch_size = len(environment.get("PAPERMILL_NOTEBOOK_NAME", "").split(","))
+        rounds = math.ceil(batch_size / int(environment.get("PAPERMILL_CONCURRENCY", 1)))
+        duration = self.aws.job_duration * self.aws.random.uniform(0.5, 1.5) * rounds
+        fails = self.aws.random.random() < self.aws.failure_rate
+        self.aws.jobs[ProcessingJobName] = {
+            "request": dict(request, ProcessingJobName=ProcessingJobName),
+            "created": self.aws.clock.time(),
+            "duration": duration,
+            "fails": fails,
+        }
+        if fails and "PAPERMILL_OUTPUT" in environment:
+            # execute.py writes a status sidecar next to the output notebook of a failed run
+            prefix = request["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]
+            output = f"{prefix}/{os.path.basename(environment['PAPERMILL_OUTPUT'])}"
+            exception = {
+                "class": "RuntimeError",
+                "message": "Simulated failure",
+                "cell_index": 1,
+                "source": "raise RuntimeError('Simulated failure')",
+                "traceback": ["RuntimeError: Simulated failure"],
+            }
+            sidecar = json.dumps({"status": "Failed", "exception": exception})
+            self.aws.objects[split_s3_uri(sidecar_uri(output, STATUS_SIDECAR_SUFFIX))] = (
+                sidecar.encode("utf-8")
+            )
+        return {"ProcessingJobArn": self._arn(ProcessingJobName)}
+
+    def _status(self, job):
+        if self.aws.clock.time() < job["created"] + job["duration"]:
+            return "InProgress"
+        return "Failed" if job["fails"] else "Completed"
+
+    def describe_processing_job(self, ProcessingJobName):
+        self._call("describe_processing_job")
+        job = self.aws.jobs.get(ProcessingJobName)
+        if job is None:
+            raise client_error("ValidationException", "DescribeProcessingJob", "Could not find job")
+        status = self._status(job)
+        desc = {key: value for key, value in job["request"].items() if key != "Tags"}
+        desc.update(
+            {
+                "ProcessingJobArn": self._arn(ProcessingJobName),
+                "ProcessingJobStatus": status,
+                "CreationTime": datetime.datetime.fromtimestamp(job["created"]),
+                "ProcessingStartTime": datetime.datetime.fromtimestamp(job["created"]),
+            }
+        )
+        if status != "InProgress":
+            end = job["created"] + job["duration"]
+            desc["ProcessingEndTime"] = datetime.datetime.fromtimestamp(end)
+        if status == "Failed":
+            desc["ExitMessage"] = "RuntimeError: Simulated failure"
+        return desc
+
+    def list_processing_jobs(self, MaxResults=10, NextToken=None, StatusEquals=None, **kwargs):
+        self._call("list_processing_jobs")
+        names = sorted(
+            (name for name, job in self.aws.jobs.items()),
+            key=lambda name: self.aws.jobs[name]["created"],
+            reverse=True,
+        )
+        summaries = [
+            {
+                "ProcessingJobName": name,
+                "ProcessingJobArn": self._arn(name),
+                "ProcessingJobStatus": self._status(self.aws.jobs[name]),
+                "CreationTime": datetime.datetime.fromtimestamp(self.aws.jobs[name]["created"]),
+            }
+            for name in names
+            if kwargs.get("NameContains", "") in name
+        ]
+        if StatusEquals:
+            summaries = [s for s in summaries if s["ProcessingJobStatus"] == StatusEquals]
+        start = int(NextToken or 0)
+        response = {"ProcessingJobSummaries": summaries[start : start + MaxResults]}
+        if start + MaxResults < len(summaries):
+            response["NextToken"] = str(start + MaxResults)
+        return response
+
+
+class FakeSts(FakeClient):
+    SERVICE = "sts"
+    OPERATIONS = {"get_caller_identity": "GetCallerIdentity"}
+
+    def get_caller_identity(self):
+        self._call("get_caller_identity")
+        return {
+            "Account": self.aws.account,
+            "Arn": f"arn:aws:sts::{self.aws.account}:assumed-role/SageMakerRole/benchmark",
+            "UserId": "AROAEXAMPLE:benchmark",
+        }
+
+
+class FakeIam(FakeClient):
+    SERVICE = "iam"
+    OPERATIONS = {"get_role": "GetRole"}
+
+    def get_role(self, RoleName):
+        self._call("get_role")
+        return {
+            "Role": {
+                "RoleName": RoleName,
+                "Arn": f"arn:aws:iam::{self.aws.account}:role/{RoleName}",
+            }
+        }
+
+
+class FakeKms(FakeClient):
+    SERVICE = "kms"
+    OPERATIONS = {"describe_key": "DescribeKey"}
+
+    def describe_key(self, KeyId):
+        self._call("describe_key")
+        key_id = hashlib.md5(KeyId.encode("utf-8")).hexdigest()
+        return {
+            "KeyMetadata": {
+                "KeyId": key_id,
+                "Arn": f"arn:aws:kms:{self.meta.region_name}:{self.aws.account}:key/{key_id}",
+            }
+        }
+
+
+class FakeEcr(FakeClient):
+    SERVICE = "ecr"
+    OPERATIONS = {"describe_images": "DescribeImages"}
+
+    def describe_images(self, repositoryName, **kwargs):
+        self._call("describe_images")
+        digest = hashlib.sha256(repositoryName.encode("utf-8")).hexdigest()
+        pushed = datetime.datetime.fromtimestamp(self.aws.clock.time())
+        return {"imageDetails": [{"imageDigest": f"sha256:{digest}", "imagePushedAt": pushed}]}
+
+
+class FakeSecretsManager(FakeClient):
+    SERVICE = "secretsmanager"
+    OPERATIONS = {"get_secret_value": "GetSecretValue"}
+
+    def get_secret_value(self, SecretId):
+        self._call("get_secret_value")
+        return {"Name": SecretId, "SecretString": "benchmark-token"}
+
+
+class FakeSession:
+    """Stands in for boto3.session.Session, handing out fake clients."""
+
+    CLIENTS = {
+        "ecr": FakeEcr,
+        "iam": FakeIam,
+        "kms": FakeKms,
+        "s3": FakeS3,
+        "sagemaker": FakeSageMaker,
+        "secretsmanager": FakeSecretsManager,
+        "sts": FakeSts,
+    }
+
+    def __init__(self, aws, region_name=None, **kwargs):
+        self.aws = aws
+        self.region_name = region_name or aws.region
+
+    def client(self, service_name, region_name=None, **kwargs):
+        if service_name not in self.CLIENTS:
+            raise ValueError(f"There is no fake of the {service_name} service")
+        return self.CLIENTS[service_name](self.aws, region_name or self.region_name)
+
+    def resource(self, service_name, region_name=None, **kwargs):
+        if service_name != "s3":
+            raise ValueError(f"There is no fake of the {service_name} resources")
+        return FakeS3Resource(self.client("s3", region_name))
+
+
+class FakeGitHub:
+    """Stands in for github.Github, with a pull request that changes every notebook of a tree."""
+
+    def __init__(self, aws, filenames):
+        self.aws = aws
+        self.filenames = filenames
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def get_repo(self, name):
+        return self
+
+    def get_pull(self, number):
+        return self
+
+    def get_files(self):
+        for _ in range(max(1, math.ceil(len(self.filenames) / GITHUB_PAGE_SIZE))):
+            self.aws.call("github", "ListPullRequestFiles")
+        return [SimpleNamespace(filename=name, status="modified") for name in self.filenames]
+
+
+@contextlib.contextmanager
+def installed(aws, filenames=()):
+    """Route boto3, the time module and GitHub to the fakes of a run, within the with statement.
+
+    Args:
+        aws (FakeAws): The fake services.
+        filenames ([str]): The notebooks the fake pull request changes.
+
+    """
+
+    def session(*args, **kwargs):
+        return FakeSession(aws, **kwargs)
+
+    def client(service_name, **kwargs):
+        return FakeSession(aws).client(service_name, **kwargs)
+
+    patches = [
+        mock.patch("boto3.session.Session", session),
+        mock.patch("boto3.Session", session),
+        mock.patch("boto3.client", client),
+        mock.patch("time.time", aws.clock.time),
+        mock.patch("time.sleep", aws.clock.sleep),
+        mock.patch("time.gmtime", aws.clock.gmtime),
+        mock.patch("notebooks.utils._default_bucket", None),
+        mock.patch("notebooks.parse.Github", FakeGitHub(aws, list(filenames))),
+    ]
+    with contextlib.ExitStack() as stack:
+        for patch in patches:
+            stack.enter_context(patch)
+        yield
+
+
+def _start_process(seed):
+    """Reset the module state that a CLI starts without, since each CLI run is a new process."""
+    throttle._limiters.clear()  # pylint: disable=protected-access
+    activity._last_recorded.clear()  # pylint: disable=protected-access
+    random.seed(seed)
+    # kernels looks up the latest kernel images when it is imported
+    if "notebooks.kernels" in sys.modules:
+        importlib.reload(sys.modules["notebooks.kernels"])
+
+
+def make_tree(root, count, notebooks_per_directory=1):
+    """Write a tree of synthetic notebooks that cycle through KERNELS.
+
+    Args:
+        root (str): The directory to write the notebooks under.
+        count (int): The number of notebooks.
+        notebooks_per_directory (int): The number of notebooks that share a directory, and so
+            are uploaded together.
+
+    Returns:
+        [str]: The filenames of the notebooks, relative to root.
+
+    """
+    filenames = []
+    for index in range(count):
+        directory = os.path.join("benchmark", f"directory-{index // notebooks_per_directory:04d}")
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+        filename = os.path.join(directory, f"notebook-{index:04d}.ipynb")
+        notebook = {
+            "cells": [
+                {"cell_type": "markdown", "metadata": {}, "source": [f"# Notebook {index}"]},
+                {
+                    "cell_type": "code",
+                    "execution_count": None,
+                    "metadata": {},
+                    "outputs": [],
+                    "source": ["import sagemaker\n", f"print({index})"],
+                },
+            ],
+            "metadata": {
+                "kernelspec": {
+                    "display_name": KERNELS[index % len(KERNELS)],
+                    "language": "python",
+                    "name": "python3",
+                }
+            },
+            "nbformat": 4,
+            "nbformat_minor": 4,
+        }
+        with open(os.path.join(root, filename), "w") as f:
+            json.dump(notebook, f)
+        filenames.append(filename)
+    return filenames
+
+
+def run_benchmark(
+    cli,
+    count,
+    cli_args=(),
+    notebooks_per_directory=1,
+    latency=DEFAULT_LATENCY,
+    job_duration=DEFAULT_JOB_DURATION,
+    failure_rate=0.0,
+    rate_limits=None,
+    seed=0,
+):
+    """Run a CLI over a tree of synthetic notebooks against the fakes, and measure the run.
+
+    Args:
+        cli (str): The name of the CLI, one of CLIS.
+        count (int): The number of notebooks in the tree.
+        cli_args ([str]): More arguments to run the CLI with.
+        notebooks_per_directory (int): The number of notebooks that share a directory.
+        latency (float): The simulated seconds each call takes.
+        job_duration (float): The mean simulated seconds a Processing job runs for.
+        failure_rate (float): The fraction of Processing jobs that fail.
+        rate_limits (dict): The calls per second past which each operation is throttled.
+        seed (int): The seed of the job durations, failures and retry jitter.
+
+    Returns:
+        dict: The CLI, the number of notebooks, the real and the simulated seconds the run
+            took, the error it ended with, if any, and the calls and throttled calls to each
+            operation.
+
+    """
+    module_name, default_args = CLIS[cli]
+    aws = FakeAws(
+        SimulatedClock(),
+        latency=latency,
+        job_duration=job_duration,
+        failure_rate=failure_rate,
+        rate_limits=rate_limits,
+        seed=seed,
+    )
+    error = None
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        filenames = make_tree(root, count, notebooks_per_directory)
+        started = aws.clock.time()
+        start = time.perf_counter()
+        try:
+            os.chdir(root)
+            with installed(aws, filenames), mock.patch.object(
+                sys, "argv", [cli, *default_args, *cli_args]
+            ), contextlib.redirect_stdout(io.StringIO()):
+                _start_process(seed)
+                importlib.import_module(module_name).main()
+        except Exception as e:  # pylint: disable=broad-except
+            # a failed run is reported with the rest, it doesn't stop the benchmark
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            os.chdir(cwd)
+        wall_seconds = time.perf_counter() - start
+
+    return {
+        "cli": cli,
+        "notebooks": count,
+        "wall_seconds": wall_seconds,
+        "simulated_seconds": aws.clock.time() - started,
+        "calls": sum(aws.calls.values()),
+        "throttled": sum(aws.throttled.values()),
+        "operations": {
+            operation: {"calls": calls, "throttled": aws.throttled[operation]}
+            for operation, calls in sorted(aws.calls.items())
+        },
+        "error": error,
+    }
+
+
+def format_results(results):
+    """Return a table of benchmark results, with the calls to each operation under each run."""
+    lines = [
+        f"{'cli':<20} {'notebooks':>9} {'wall s':>9} {'simulated s':>12} "
+        f"{'calls':>8} {'throttled':>9}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['cli']:<20} {result['notebooks']:>9} {result['wall_seconds']:>9.2f} "
+            f"{result['simulated_seconds']:>12.0f} {result['calls']:>8} {result['throttled']:>9}"
+        )
+        for operation, counts in result["operations"].items():
+            lines.append(f"    {operation:<45} {counts['calls']:>8} {counts['throttled']:>9}")
+        if result["error"]:
+            lines.append(f"    error: {result['error']}")
+    return "\n".join(lines)
+
+
+def compare_results(results, baseline, tolerance=0.1, time_tolerance=0.5):
+    """Compare benchmark results with a baseline of earlier results.
+
+    Call counts and simulated time are deterministic for a seed, so they get a tight tolerance;
+    wall time depends on the machine, so it gets a looser one, and growth under
+    MIN_TIME_REGRESSION_SECONDS is ignored.
+
+    Args:
+        results ([dict]): The results of run_benchmark().
+        baseline ([dict]): Earlier results, matched to these by CLI and number of notebooks.
+        tolerance (float): The fraction by which calls and simulated time may grow before it is a
+            regression.
+        time_tolerance (float): The fraction by which wall time may grow.
+
+    Returns:
+        [str]: A description of each regression.
+
+    """
+    earlier = {(result["cli"], result["notebooks"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = earlier.get((result["cli"], result["notebooks"]))
+        if base is None:
+            continue
+        name = f"{result['cli']} ({result['notebooks']} notebooks)"
+        if result["calls"] > base["calls"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['calls']} calls, up from {base['calls']}")
+        for operation, counts in result["operations"].items():
+            before = base["operations"].get(operation, {}).get("calls", 0)
+            if counts["calls"] > before * (1 + tolerance):
+                regressions.append(f"{name}: {counts['calls']} {operation} calls, up from {before}")
+        if result["simulated_seconds"] > base["simulated_seconds"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: took {result['simulated_seconds']:.0f}s of simulated time, "
+                f"up from {base['simulated_seconds']:.0f}s"
+            )
+        wall_limit = max(
+            base["wall_seconds"] * (1 + time_tolerance),
+            base["wall_seconds"] + MIN_TIME_REGRESSION_SECONDS,
+        )
+        if result["wall_seconds"] > wall_limit:
+            regressions.append(
+                f"{name}: took {result['wall_seconds']:.2f}s, up from {base['wall_seconds']:.2f}s"
+            )
+    return regressions
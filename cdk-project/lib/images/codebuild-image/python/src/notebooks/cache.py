@@ -0,0 +1,131 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Cache notebook execution results by the content of their inputs"""
+
+import functools
+import hashlib
+import json
+import os
+import time
+
+from notebooks.utils import default_bucket, ensure_session, read_json, write_json
+
+DEFAULT_MAX_AGE_HOURS = 24
+CHUNK_SIZE = 1024 * 1024
+
+
+def default_cache_uri(session=None):
+    """Return the S3 prefix of the result cache in the Python SDK default bucket."""
+    return f"s3://{default_bucket(session)}/full_repo_scan/result-cache"
+
+
+def input_digest(notebook):
+    """Hash the directory that upload_notebook uploads for a notebook.
+
+    Args:
+        notebook (str): The notebook filename.
+
+    Returns:
+        str: The SHA-256 hex digest of the relative path and content of every file.
+
+    """
+    directory = os.path.dirname(notebook)
+    digest = hashlib.sha256()
+    paths = []
+    for root, _, files in os.walk(directory, followlinks=True):
+        paths.extend(os.path.join(root, filename) for filename in files)
+
+    for path in sorted(paths):
+        digest.update(os.path.relpath(path, directory).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(functools.partial(f.read, CHUNK_SIZE), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def cache_key(notebook, image, parameters):
+    """Return the cache key of a notebook run.
+
+    Args:
+        notebook (str): The notebook filename.
+        image (str): The kernel image the notebook runs in, pinned to a digest.
+        parameters (dict): The papermill parameters.
+
+    Returns:
+        str: A SHA-256 hex digest of the input directory, the image and the parameters.
+
+    """
+    digest = hashlib.sha256()
+    digest.update(input_digest(notebook).encode("utf-8"))
+    digest.update(image.encode("utf-8"))
+    digest.update(json.dumps(parameters, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """The outcome of notebook runs, keyed by cache_key.
+
+    Each entry is a small JSON document named after its key, under an S3 prefix by default or
+    under a local directory, which is handy for local runs and for experiments.
+    """
+
+    def __init__(self, uri=None, session=None):
+        self.session = ensure_session(session)
+        self.uri = (uri or default_cache_uri(self.session)).rstrip("/")
+
+    def entry_uri(self, key):
+        return f"{self.uri}/{key}.json"
+
+    def lookup(self, key, max_age_hours=DEFAULT_MAX_AGE_HOURS):
+        """Return the cached result for a key if it passed recently enough to be reused.
+
+        Args:
+            key (str): The cache key.
+            max_age_hours (float): The age past which a result is not reused.
+
+        Returns:
+            dict: The cache entry, or None if there is no recent passing result.
+
+        """
+        if max_age_hours <= 0:
+            return None
+        entry = read_json(self.entry_uri(key), self.session)
+        if not entry or entry["status"] != "Completed":
+            return None
+        if time.time() - entry["recorded_at"] > max_age_hours * 3600:
+            return None
+        return entry
+
+    def record(self, key, notebook, status, output, job_name):
+        """Record the outcome of a notebook run.
+
+        Args:
+            key (str): The cache key.
+            notebook (str): The notebook filename.
+            status (str): The final status of the run, e.g. "Completed" or "Failed".
+            output (str): The S3 uri of the output notebook.
+            job_name (str): The name of the Processing job that ran the notebook.
+
+        """
+        write_json(
+            self.entry_uri(key),
+            {
+                "notebook": str(notebook),
+                "status": status,
+                "output": output,
+                "job_name": job_name,
+                "recorded_at": time.time(),
+            },
+            self.session,
+        )
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from notebooks.run import get_status_sidecar, get_timings_sidecar
+from notebooks.utils import ensure_session, save_csv_to_s3
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(os.path.basename(__file__))
+    parser.set_defaults(func=lambda x: parser.print_usage())
+    parser.add_argument(
+        "--csv", help="CSV file written by describe-notebook-jobs", type=str, required=True
+    )
+    parser.add_argument(
+        "--top", default=20, help="Number of rows in each table", type=int, required=False
+    )
+    parser.add_argument(
+        "--max-workers",
+        default=DEFAULT_MAX_WORKERS,
+        help="Maximum number of concurrent profile downloads",
+        type=int,
+        required=False,
+    )
+
+    parsed = parser.parse_args(args)
+
+    return parsed
+
+
+def load_timings(scan, session, max_workers=DEFAULT_MAX_WORKERS):
+    """Download the per-cell timing profiles of every executed notebook in a scan.
+
+    Args:
+        scan (pandas.DataFrame): The describe-notebook-jobs results, with "filename" and "output"
+            columns.
+        session (boto3.Session): The boto3 session to use.
+        max_workers (int): The maximum number of concurrent downloads.
+
+    Returns:
+        pandas.DataFrame: The concatenated profiles, with a "filename" column identifying the
+            notebook each cell belongs to.
+
+    """
+    executed = scan[scan["output"].notna() & (scan["output"] != "None")]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        profiles = list(
+            executor.map(lambda uri: get_timings_sidecar(uri, session), executed["output"])
+        )
+
+    frames = [
+        profile.assign(filename=filename)
+        for filename, profile in zip(executed["filename"], profiles)
+        if profile is not None
+    ]
+    if not frames:
+        return pd.DataFrame(
+            {
+                "filename": pd.Series(dtype=str),
+                "cell_index": pd.Series(dtype=int),
+                "duration": pd.Series(dtype=float),
+                "sagemaker_wait": pd.Series(dtype=int),
+                "source": pd.Series(dtype=str),
+            }
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_startups(scan, session, max_workers=DEFAULT_MAX_WORKERS):
+    """Download the container startup timestamps of every executed notebook in a scan.
+
+    Args:
+        scan (pandas.DataFrame): The describe-notebook-jobs results, with "filename" and "output"
+            columns.
+        session (boto3.Session): The boto3 session to use.
+        max_workers (int): The maximum number of concurrent downloads.
+
+    Returns:
+        pandas.DataFrame: The time to first cell and the end of each startup phase, in seconds
+            since the container started, one row per notebook that recorded them.
+
+    """
+    executed = scan[scan["output"].notna() & (scan["output"] != "None")]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        statuses = list(
+            executor.map(lambda uri: get_status_sidecar(uri, session), executed["output"])
+        )
+
+    rows = [
+        {
+            "filename": filename,
+            "time_to_first_cell": status["startup"]["time_to_first_cell"],
+            **status["startup"]["events"],
+        }
+        for filename, status in zip(executed["filename"], statuses)
+        if status and status.get("startup")
+    ]
+    if not rows:
+        return pd.DataFrame(
+            {"filename": pd.Series(dtype=str), "time_to_first_cell": pd.Series(dtype=float)}
+        )
+    startups = pd.DataFrame(rows)
+    startups["time_to_first_cell"] = pd.to_numeric(startups["time_to_first_cell"])
+    return startups
+
+
+def slowest_cells(timings, top):
+    """Return the longest running cells across the scan."""
+    columns = ["filename", "cell_index", "duration", "sagemaker_wait", "source"]
+    return timings.nlargest(top, "duration")[columns]
+
+
+def slowest_notebooks(timings, top):
+    """Return the notebooks with the most total cell execution time."""
+    timings = timings.assign(sagemaker_seconds=timings["duration"] * timings["sagemaker_wait"])
+    notebooks = timings.groupby("filename").agg(
+        cells=("cell_index", "count"),
+        total_seconds=("duration", "sum"),
+        slowest_cell_seconds=("duration", "max"),
+        sagemaker_seconds=("sagemaker_seconds", "sum"),
+    )
+    notebooks["sagemaker_share"] = notebooks["sagemaker_seconds"] / notebooks["total_seconds"]
+    return notebooks.nlargest(top, "total_seconds").reset_index()
+
+
+def sagemaker_wait(timings, top):
+    """Return the notebooks that spend the most time blocked on SageMaker jobs and endpoints."""
+    waiting = timings[timings["sagemaker_wait"] == 1]
+    notebooks = waiting.groupby("filename").agg(
+        cells=("cell_index", "count"),
+        sagemaker_seconds=("duration", "sum"),
+    )
+    return notebooks.nlargest(top, "sagemaker_seconds").reset_index()
+
+
+def print_table(title, table):
+    print("\n" * 2)
+    print(f"* {title} " + "*" * (97 - len(title)))
+    print()
+    print(table.to_string(index=False))
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+
+    session = ensure_session()
+
+    scan = pd.read_csv(args.csv, index_col=False)
+    timings = load_timings(scan, session, max_workers=args.max_workers)
+
+    total = timings["duration"].sum()
+    waiting = (timings["duration"] * timings["sagemaker_wait"]).sum()
+    print(f"Profiles found for {timings['filename'].nunique()} of {len(scan)} notebooks")
+    print(f"Total cell execution time: {total:.0f} s, waiting on SageMaker: {waiting:.0f} s")
+
+    startups = load_startups(scan, session, max_workers=args.max_workers)
+    first_cell = startups["time_to_first_cell"].dropna()
+    if not first_cell.empty:
+        print(
+            f"Time to first cell: median {first_cell.median():.1f} s, "
+            f"p95 {first_cell.quantile(0.95):.1f} s, max {first_cell.max():.1f} s"
+        )
+
+    base, _ = os.path.splitext(os.path.basename(args.csv))
+    tables = {
+        "slowest-cells": slowest_cells(timings, args.top),
+        "slowest-notebooks": slowest_notebooks(timings, args.top),
+        "sagemaker-wait": sagemaker_wait(timings, args.top),
+        "slowest-startups": startups.nlargest(args.top, "time_to_first_cell"),
+    }
+    for name, table in tables.items():
+        print_table(name, table)
+
+    print("\n" * 2)
+    print("-" * 100)
+    print("\n" * 2)
+    for name, table in tables.items():
+        print(save_csv_to_s3(table, f"{base}-{name}.csv", session))
+
+
+if __name__ == "__main__":
+    main()
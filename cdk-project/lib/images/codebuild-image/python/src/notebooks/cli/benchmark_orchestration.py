@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+
+from notebooks.benchmark import (
+    CLIS,
+    DEFAULT_JOB_DURATION,
+    DEFAULT_LATENCY,
+    DEFAULT_RATE_LIMITS,
+    DEFAULT_SIZES,
+    compare_results,
+    format_results,
+    run_benchmark,
+)
+
+
+def parse_rate_limit(value):
+    operation, _, rate = value.partition("=")
+    try:
+        return operation, float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected <service>.<Operation>=<rate>, got {value}")
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(os.path.basename(__file__))
+    parser.set_defaults(func=lambda x: parser.print_usage())
+    parser.add_argument(
+        "--clis",
+        default=list(CLIS),
+        choices=list(CLIS),
+        help="CLIs to benchmark (default: all of them)",
+        type=str,
+        nargs="+",
+        required=False,
+    )
+    parser.add_argument(
+        "--sizes",
+        default=list(DEFAULT_SIZES),
+        help="Numbers of notebooks in the synthetic trees the CLIs run over",
+        type=int,
+        nargs="+",
+        required=False,
+    )
+    parser.add_argument(
+        "--notebooks-per-directory",
+        default=1,
+        help="Number of notebooks that share a directory in the synthetic trees",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--latency",
+        default=DEFAULT_LATENCY,
+        help="Simulated seconds each API call takes",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--job-duration",
+        default=DEFAULT_JOB_DURATION,
+        help="Mean simulated seconds a Processing job runs for",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--failure-rate",
+        default=0.0,
+        help="Fraction of Processing jobs that fail",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--rate-limit",
+        default=[],
+        help="Calls per second past which an operation is throttled, as "
+        "<service>.<Operation>=<rate>, e.g. sagemaker.CreateProcessingJob=2 (0 never throttles; "
+        "may be repeated)",
+        type=parse_rate_limit,
+        action="append",
+        required=False,
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        help="Seed of the job durations, failures and retry jitter",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--output", help="JSON file to write the results to", type=str, required=False
+    )
+    parser.add_argument(
+        "--baseline",
+        help="JSON results of an earlier run; exit with an error if calls or time regressed",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--tolerance",
+        default=0.1,
+        help="Fraction by which calls and simulated time may grow over the baseline",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--time-tolerance",
+        default=0.5,
+        help="Fraction by which wall time may grow over the baseline, once it has grown by at "
+        "least a second",
+        type=float,
+        required=False,
+    )
+
+    parsed = parser.parse_args(args)
+
+    return parsed
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    rate_limits = dict(DEFAULT_RATE_LIMITS, **dict(args.rate_limit))
+
+    results = []
+    for cli in args.clis:
+        for size in args.sizes:
+            print(f"Running {cli} over {size} notebooks...")
+            results.append(
+                run_benchmark(
+                    cli,
+                    size,
+                    notebooks_per_directory=args.notebooks_per_directory,
+                    latency=args.latency,
+                    job_duration=args.job_duration,
+                    failure_rate=args.failure_rate,
+                    rate_limits=rate_limits,
+                    seed=args.seed,
+                )
+            )
+
+    print()
+    print(format_results(results))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    # failed jobs make run-pr-notebooks exit with an error, so errors are only expected then
+    errors = [result for result in results if result["error"]]
+    if errors and not args.failure_rate:
+        print(f"\n{len(errors)} runs ended with an error")
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_results(
+                results, json.load(f), args.tolerance, args.time_tolerance
+            )
+        if regressions:
+            print("\nRegressions against " + args.baseline + ":")
+            print("\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
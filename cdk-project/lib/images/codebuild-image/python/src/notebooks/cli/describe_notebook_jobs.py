@@ -1,38 +1,189 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import re
 import sys
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 import pandas as pd
-from notebooks.run import execute_notebook, get_output_notebook, get_output_prefix, upload_notebook
-from notebooks.utils import default_bucket, ensure_session
+from notebooks import throttle
+from notebooks.cache import ResultCache
+from notebooks.history import RuntimeHistory
+from notebooks.run import batch_outputs, get_status_sidecar, is_batch, output_notebook_for
+from notebooks.utils import ensure_session, save_csv_to_s3
+
+DEFAULT_MAX_WORKERS = 8
+FINISHED_STATUSES = ("Completed", "Failed", "Stopped")
+
+# Matches the last line of an exit message that names an error type, e.g. "ValueError: bad input".
+ERROR_LINE_PATTERN = re.compile(
+    r"(?s)^.*(?:^|\n)(?P<line>[^\n]*(?:Exception|Error|InvalidArn|NotFound|InUse):[^\n]*)"
+)
 
 
 def parse_args(args):
     parser = argparse.ArgumentParser(os.path.basename(__file__))
     parser.set_defaults(func=lambda x: parser.print_usage())
     parser.add_argument("--csv", help="CSV file with Processing job names", type=str, required=True)
+    parser.add_argument(
+        "--max-workers",
+        default=DEFAULT_MAX_WORKERS,
+        help="Maximum number of concurrent DescribeProcessingJob calls",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--history",
+        help="Runtime history to add the completed jobs to "
+        "(default: runtime-history.json in the SageMaker default bucket)",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--cache",
+        help="Result cache to record the finished jobs in "
+        "(default: result-cache/ in the SageMaker default bucket)",
+        type=str,
+        required=False,
+    )
 
     parsed = parser.parse_args(args)
 
     return parsed
 
 
-def save_csv_to_s3(df, csv_name):
-    session = ensure_session()
+def describe_jobs(job_names, session, max_workers=DEFAULT_MAX_WORKERS):
+    """Describe each Processing job exactly once, with bounded concurrency.
+
+    Throttled calls are retried by the throttle module, which also slows the calls down to the
+    rate the API is accepting.
+
+    Args:
+        job_names ([str]): The Processing job names. Skipped notebooks have no job name.
+        session (boto3.Session): The boto3 session to use.
+        max_workers (int): The maximum number of concurrent describe calls.
+
+    Returns:
+        [dict]: The job descriptions, in the same order as the job names. Skipped notebooks
+            have an empty description.
+
+    """
+    client = throttle.client(session, "sagemaker")
+
+    def describe(job_name):
+        if not job_name:
+            return {}
+        return client.describe_processing_job(ProcessingJobName=job_name)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(describe, job_names))
 
-    df.to_csv(csv_name, index=False)
 
-    s3 = session.client("s3")
-    bucket = default_bucket(session)
-    prefix = "full_repo_scan"
+def fetch_status_sidecars(output_uris, session, max_workers=DEFAULT_MAX_WORKERS):
+    """Fetch the status sidecars for the given output notebooks, with bounded concurrency.
 
-    s3_path = os.path.join(prefix, csv_name)
-    s3.upload_file(csv_name, bucket, s3_path)
+    Args:
+        output_uris ([str]): The S3 uris of the output notebooks.
+        session (boto3.Session): The boto3 session to use.
+        max_workers (int): The maximum number of concurrent GET calls.
 
-    return f"s3://{bucket}/{prefix}/{csv_name}"
+    Returns:
+        [dict]: The status records, in the same order as the output notebooks. Jobs that did
+            not write a sidecar have None.
+
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda uri: get_status_sidecar(uri, session), output_uris))
+
+
+def output_notebooks_for(filenames, job_names, descriptions, session):
+    """Find the output notebook of each row of a scan.
+
+    Batch jobs write one output notebook per notebook, listed in the batch manifest, which is
+    read once per batch job.
+
+    Args:
+        filenames ([str]): The notebook filenames.
+        job_names ([str]): The Processing job names.
+        descriptions ([dict]): The job descriptions returned by describe_jobs.
+        session (boto3.Session): The boto3 session to use.
+
+    Returns:
+        [str]: The S3 uri of each output notebook, or "None" for skipped notebooks.
+
+    """
+    manifests = {}
+    outputs = []
+    for filename, job_name, desc in zip(filenames, job_names, descriptions):
+        if not desc:
+            outputs.append("None")
+        elif is_batch(desc):
+            if job_name not in manifests:
+                manifests[job_name] = batch_outputs(desc, session)
+            outputs.append(manifests[job_name].get(filename, "None"))
+        else:
+            outputs.append(output_notebook_for(desc)[1])
+    return outputs
+
+
+def record_results(cache, results, cache_keys, max_workers=DEFAULT_MAX_WORKERS):
+    """Record the outcome of every finished job that has a cache key in the result cache.
+
+    Args:
+        cache (notebooks.cache.ResultCache): The result cache.
+        results (pandas.DataFrame): The describe-notebook-jobs results.
+        cache_keys (pandas.Series): The cache key of each row; rows without one are not recorded.
+        max_workers (int): The maximum number of concurrent PUT calls.
+
+    """
+    finished = results[cache_keys.notna() & results["status"].isin(FINISHED_STATUSES)]
+    rows = zip(
+        cache_keys[finished.index],
+        finished["filename"],
+        finished["status"],
+        finished["output"],
+        finished["processing-job-name"],
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda row: cache.record(*row), rows))
+
+
+def classify_errors(messages, statuses):
+    """Categorize Processing job exit messages into an error type and an error detail.
+
+    The error type is taken from the last line of the exit message that names an error, split at
+    its first colon; messages without such a line are "Uncategorized".
+
+    Args:
+        messages (pandas.Series): The ExitMessage of each job.
+        statuses (pandas.Series): The ProcessingJobStatus of each job.
+
+    Returns:
+        (pandas.Series, pandas.Series): The error type and the error detail of each job.
+
+    """
+    has_message = messages.notna() & (messages != "")
+    # .str needs strings, and a column with no ExitMessage at all is read as floats
+    lines = messages.fillna("").astype(str).str.extract(ERROR_LINE_PATTERN)["line"]
+    parts = lines.astype(object).str.split(":", n=1, expand=True).reindex(columns=[0, 1])
+
+    errors = parts[0].astype(object).where(lines.notna(), "Uncategorized").where(has_message, None)
+    details = parts[1].astype(object).where(lines.notna() & has_message, None)
+
+    kernel_died = messages == "Kernel died"
+    errors = errors.mask(kernel_died, "KernelDied")
+    details = details.mask(kernel_died, "kernel died")
+
+    timed_out = statuses == "Stopped"
+    errors = errors.mask(timed_out, "TimedOut")
+    details = details.mask(timed_out, "Notebook execution timed out")
+
+    for line in lines[lines.notna() & has_message]:
+        print("The following error was encountered while executing the notebook")
+        print(line)
+
+    return errors, details
 
 
 def main():
@@ -43,75 +194,77 @@ def main():
     csv_filename = args.csv
     dataframe = pd.read_csv(csv_filename, index_col=False)
 
-    output_notebooks = []
-    runtimes = []
-    statuses = []
-    errors = []
-    dates = []
-    error_details= []
-
-    sagemaker = session.client("sagemaker")
-    for index, row in dataframe.iterrows():
-        job_name = row["processing-job-name"]
-        detail = None
-        if job_name == "None":
-            uri = "None"
-            runtime = 0
-            status = "Skipped"
-            error = None
-            date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        else:
-            response = sagemaker.describe_processing_job(ProcessingJobName=job_name)
-            date = response.get("ProcessingEndTime", datetime.now(timezone.utc)).strftime(
-                "%Y-%m-%d"
-            )
-            notebook, uri = get_output_notebook(job_name, session)
-            status = response.get("ProcessingJobStatus")
-
-            runtime = (
-                response.get("ProcessingEndTime", datetime.now(timezone.utc))
-                - response.get("ProcessingStartTime", datetime.now(timezone.utc))
-            ).total_seconds()
-            if runtime < 0:
-                runtime = 0
-
-            error = response.get("ExitMessage")
-            if error == "Kernel died":
-                error = "KernelDied"
-                detail = "kernel died"
-            elif error:
-                found_error_type = False
-                valid_error_types = ("Exception:", "Error:", "InvalidArn:", "NotFound:", "InUse:")
-                lines = error.splitlines()
-                for line in reversed(lines):
-                    if any(error_type in line for error_type in valid_error_types):
-                        error_parsed = line.split(":", 1)
-                        print("The following error was encountered while executing the notebook")
-                        print(line)
-                        error = error_parsed[0]
-                        detail = error_parsed[1]
-                        found_error_type = True
-                        break
-                if not found_error_type:
-                    error = "Uncategorized"
-
-            if status == "Stopped":
-                error = "TimedOut"
-                detail = "Notebook execution timed out"
-
-        output_notebooks.append(uri)
-        runtimes.append(runtime)
-        statuses.append(status)
-        errors.append(error)
-        dates.append(date)
-        error_details.append(detail)
-
-        print(job_name)
-        time.sleep(1)
+    job_names = dataframe["processing-job-name"]
+    # Scans written before the result cache have neither column.
+    cache_keys = dataframe.get("cache-key", pd.Series(None, index=dataframe.index, dtype=object))
+    cached = dataframe.get("cached", pd.Series(False, index=dataframe.index)).fillna(False)
+    cached = cached.astype(bool)
+    skipped = job_names.isna() | (job_names == "None")
+    descriptions = describe_jobs(
+        [None if skip else name for name, skip in zip(job_names, skipped)],
+        session,
+        max_workers=args.max_workers,
+    )
+    jobs = pd.DataFrame.from_records(
+        descriptions,
+        columns=[
+            "ProcessingJobStatus",
+            "ProcessingStartTime",
+            "ProcessingEndTime",
+            "ExitMessage",
+        ],
+        index=dataframe.index,
+    )
+
+    now = pd.Timestamp(datetime.now(timezone.utc))
+    start_times = pd.to_datetime(jobs["ProcessingStartTime"], utc=True).fillna(now)
+    end_times = pd.to_datetime(jobs["ProcessingEndTime"], utc=True).fillna(now)
+    runtimes = (end_times - start_times).dt.total_seconds().clip(lower=0).mask(skipped, 0)
+    statuses = jobs["ProcessingJobStatus"].mask(skipped, "Skipped")
+    messages = jobs["ExitMessage"].copy()
+    output_notebooks = output_notebooks_for(dataframe["filename"], job_names, descriptions, session)
+
+    # The job status of a batch covers all of its notebooks, so each notebook's own status and
+    # runtime come from its status sidecar. Notebooks that never got to write one keep the job's.
+    sidecars = {}
+    batched = statuses.index[[bool(desc) and is_batch(desc) for desc in descriptions]]
+    sidecars.update(
+        zip(
+            batched,
+            fetch_status_sidecars(
+                [output_notebooks[i] for i in batched], session, max_workers=args.max_workers
+            ),
+        )
+    )
+    for index in batched:
+        sidecar = sidecars[index]
+        if sidecar:
+            statuses[index] = sidecar["status"]
+            runtimes[index] = round(sum(sidecar["phases"].values()), 1)
+            messages[index] = None
+
+    errors, error_details = classify_errors(messages, statuses)
+
+    # Failed jobs report their real exception in the status sidecar; the exit message
+    # classification is only the fallback for jobs that didn't write one.
+    failed = statuses.index[(statuses == "Failed") & ~statuses.index.isin(batched)]
+    sidecars.update(
+        zip(
+            failed,
+            fetch_status_sidecars(
+                [output_notebooks[i] for i in failed], session, max_workers=args.max_workers
+            ),
+        )
+    )
+    for index in statuses.index[statuses == "Failed"]:
+        exception = (sidecars.get(index) or {}).get("exception")
+        if exception:
+            errors[index] = exception["class"]
+            error_details[index] = exception["message"]
 
     new_dataframe = pd.DataFrame(
         {
-            "date": dates,
+            "date": end_times.dt.strftime("%Y-%m-%d"),
             "filename": dataframe["filename"],
             "processing-job-name": dataframe["processing-job-name"],
             "kernel": dataframe["kernel"],
@@ -119,14 +272,32 @@ def main():
             "runtime": runtimes,
             "status": statuses,
             "error": errors,
-            "error_detail": error_details
+            "error_detail": error_details,
+            "cached": cached,
         }
     )
 
+    # Cached rows point at the job that produced the reused result, which is already recorded.
+    # Batched notebooks share their job's limit, so only single-notebook jobs can hit their own.
+    max_runtimes = pd.Series(
+        [desc.get("StoppingCondition", {}).get("MaxRuntimeInSeconds") for desc in descriptions],
+        index=dataframe.index,
+        dtype=float,
+    ).drop(batched)
+    history = RuntimeHistory(args.history, session)
+    history.record_scan(new_dataframe[~cached], max_runtimes)
+    history.save()
+    record_results(
+        ResultCache(args.cache, session),
+        new_dataframe,
+        cache_keys.where(~cached),
+        max_workers=args.max_workers,
+    )
+
     print("\n" * 2)
     print("-" * 100)
     print("\n" * 2)
-    print(save_csv_to_s3(new_dataframe, csv_filename))
+    print(save_csv_to_s3(new_dataframe, csv_filename, session))
 
 
 if __name__ == "__main__":
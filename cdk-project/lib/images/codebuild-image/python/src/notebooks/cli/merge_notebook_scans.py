@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import re
+import sys
+
+import pandas as pd
+from notebooks.utils import save_csv_to_s3
+
+# The suffix run-all-notebooks adds to the CSV name of each shard of a scan.
+SHARD_SUFFIX_PATTERN = re.compile(r"-shard-\d+-of-\d+(?=\.csv$)")
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(os.path.basename(__file__))
+    parser.set_defaults(func=lambda x: parser.print_usage())
+    parser.add_argument(
+        "csvs", help="CSV files written by the shards of run-all-notebooks", type=str, nargs="+"
+    )
+    parser.add_argument(
+        "--output",
+        help="Name of the merged CSV file (default: the earliest shard name without its suffix)",
+        type=str,
+        required=False,
+    )
+
+    parsed = parser.parse_args(args)
+
+    return parsed
+
+
+def merged_name(csvs):
+    """Return the name of the merged scan, taken from the earliest shard."""
+    earliest = min(os.path.basename(csv) for csv in csvs)
+    return SHARD_SUFFIX_PATTERN.sub("", earliest)
+
+
+def merge_scans(frames):
+    """Combine the shard CSVs of a scan into one frame.
+
+    Args:
+        frames ([pandas.DataFrame]): The CSVs written by each shard.
+
+    Returns:
+        pandas.DataFrame: The rows of every shard. A notebook that shows up in more than one
+            shard, e.g. because the shards saw different history, is only kept once.
+
+    """
+    merged = pd.concat(frames, ignore_index=True)
+    duplicated = merged["filename"].duplicated()
+    for filename in merged["filename"][duplicated]:
+        print(f"{filename} was scanned by more than one shard, keeping the first", file=sys.stderr)
+    return merged[~duplicated].reset_index(drop=True)
+
+
+def main():
+    """Merge the shard CSVs and print the name of the merged CSV, for use in build scripts."""
+    args = parse_args(sys.argv[1:])
+
+    merged = merge_scans([pd.read_csv(csv, index_col=False) for csv in args.csvs])
+    csv_name = args.output or merged_name(args.csvs)
+
+    print(f"Merged {len(args.csvs)} shards with {len(merged)} notebooks", file=sys.stderr)
+    print(save_csv_to_s3(merged, csv_name), file=sys.stderr)
+    print(csv_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import argparse
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from notebooks.run import get_resources_sidecar
+from notebooks.utils import ensure_session, save_csv_to_s3
+
+DEFAULT_MAX_WORKERS = 8
+GIB = 1024**3
+
+# Processing instance types considered for notebook jobs, as (name, vCPUs, memory in GiB), in
+# ascending order of on-demand price. The first one that fits a notebook's usage is recommended.
+INSTANCE_TYPES = [
+    ("ml.t3.medium", 2, 4),
+    ("ml.m5.large", 2, 8),
+    ("ml.r5.large", 2, 16),
+    ("ml.c5.xlarge", 4, 8),
+    ("ml.m5.xlarge", 4, 16),
+    ("ml.r5.xlarge", 4, 32),
+    ("ml.c5.2xlarge", 8, 16),
+    ("ml.m5.2xlarge", 8, 32),
+    ("ml.r5.2xlarge", 8, 64),
+    ("ml.m5.4xlarge", 16, 64),
+    ("ml.r5.4xlarge", 16, 128),
+]
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(os.path.basename(__file__))
+    parser.set_defaults(func=lambda x: parser.print_usage())
+    parser.add_argument(
+        "--csv", help="CSV file written by describe-notebook-jobs", type=str, required=True
+    )
+    parser.add_argument(
+        "--memory-headroom",
+        default=1.25,
+        help="Factor applied to the peak memory usage before matching an instance type",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--cpu-percentile",
+        default=95,
+        help="Percentile of the CPU usage samples that the instance must cover",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--max-workers",
+        default=DEFAULT_MAX_WORKERS,
+        help="Maximum number of concurrent profile downloads",
+        type=int,
+        required=False,
+    )
+
+    parsed = parser.parse_args(args)
+
+    return parsed
+
+
+def summarize_usage(profile, cpu_percentile=95):
+    """Reduce a resource usage profile to the figures that drive instance selection.
+
+    Args:
+        profile (pandas.DataFrame): The samples returned by get_resources_sidecar.
+        cpu_percentile (float): The percentile of the CPU samples to report.
+
+    Returns:
+        dict: The number of samples, the peak memory used on the instance and by the kernel
+            process tree (in GiB), the CPU usage percentile (in CPUs) and the CPUs available.
+
+    """
+    cores = profile["cpu_percent"] / 100 * profile["cpu_count"]
+    return {
+        "samples": len(profile),
+        "peak_memory_gib": profile["memory_used_bytes"].max() / GIB,
+        "peak_kernel_memory_gib": profile["kernel_rss_bytes"].max() / GIB,
+        "cpu_cores": cores.quantile(cpu_percentile / 100),
+        "cpu_count": profile["cpu_count"].max(),
+    }
+
+
+def recommend_instance_type(peak_memory_gib, cpu_cores, memory_headroom=1.25):
+    """Pick the cheapest instance type that fits the given usage.
+
+    Args:
+        peak_memory_gib (float): The peak memory used on the instance, in GiB.
+        cpu_cores (float): The number of CPUs the notebook keeps busy.
+        memory_headroom (float): The factor applied to the peak memory usage.
+
+    Returns:
+        str: The recommended instance type, or the largest one considered if nothing fits.
+
+    """
+    memory = peak_memory_gib * memory_headroom
+    cpus = max(math.ceil(cpu_cores), 1)
+    for name, vcpus, memory_gib in INSTANCE_TYPES:
+        if vcpus >= cpus and memory_gib >= memory:
+            return name
+    return INSTANCE_TYPES[-1][0]
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+
+    session = ensure_session()
+
+    scan = pd.read_csv(args.csv, index_col=False)
+    executed = scan[scan["output"].notna() & (scan["output"] != "None")]
+
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        profiles = list(
+            executor.map(lambda uri: get_resources_sidecar(uri, session), executed["output"])
+        )
+
+    rows = []
+    for filename, profile in zip(executed["filename"], profiles):
+        if profile is None or profile.empty:
+            continue
+        usage = summarize_usage(profile, args.cpu_percentile)
+        usage["recommended_instance"] = recommend_instance_type(
+            usage["peak_memory_gib"], usage["cpu_cores"], args.memory_headroom
+        )
+        rows.append({"filename": filename, **usage})
+
+    recommendations = pd.DataFrame(
+        rows,
+        columns=[
+            "filename",
+            "samples",
+            "peak_memory_gib",
+            "peak_kernel_memory_gib",
+            "cpu_cores",
+            "cpu_count",
+            "recommended_instance",
+        ],
+    )
+
+    print(f"Profiles found for {len(recommendations)} of {len(scan)} notebooks")
+    print()
+    print(recommendations["recommended_instance"].value_counts().to_string())
+    print()
+    print(recommendations.to_string(index=False))
+
+    base, _ = os.path.splitext(os.path.basename(args.csv))
+    print("\n" * 2)
+    print("-" * 100)
+    print("\n" * 2)
+    print(save_csv_to_s3(recommendations, f"{base}-instance-types.csv", session))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,22 @@ import argparse
 import os
 import sys
 import time
+from collections import defaultdict
 
 import pandas as pd
-from notebooks import kernels, parse
-from notebooks.run import execute_notebook, get_output_prefix, upload_notebook
+from notebooks import kernels, parse, throttle
+from notebooks.cache import DEFAULT_MAX_AGE_HOURS, ResultCache, cache_key
+from notebooks.history import DEFAULT_MAX_RUNTIME, RuntimeHistory
+from notebooks.journal import SubmissionJournal, default_journal_uri
+from notebooks.run import (
+    DEFAULT_BATCH_CONCURRENCY,
+    MAX_BATCH_SIZE,
+    execute_notebook,
+    execute_notebook_batch,
+    get_output_prefix,
+    upload_notebook,
+)
+from notebooks.shard import STRATEGIES, parse_shard, select_shard
 from notebooks.utils import default_bucket, ensure_session, kms_key
 
 
@@ -36,20 +48,122 @@ def parse_args(args):
         type=bool,
         required=False,
     )
+    parser.add_argument(
+        "--history",
+        help="Runtime history used to order jobs and set their timeouts "
+        "(default: runtime-history.json in the SageMaker default bucket)",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--shard",
+        default="1/1",
+        help="Run only shard i of N of the scan, as i/N; merge the shard CSVs with "
+        "merge-notebook-scans",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--shard-strategy",
+        default="auto",
+        choices=STRATEGIES,
+        help="Assign notebooks to shards by filename hash, by runtime history, or by runtime "
+        "history when there is any",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--journal",
+        help="Journal of the submitted jobs, written as each job is submitted "
+        "(default: today's journal for the shard in the SageMaker default bucket)",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--resume",
+        default=False,
+        help="Only submit the notebooks that the journal doesn't list yet",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--cache",
+        help="Result cache to reuse passing runs from "
+        "(default: result-cache/ in the SageMaker default bucket)",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--max-cache-age",
+        default=DEFAULT_MAX_AGE_HOURS,
+        help="Age in hours past which a cached passing result is not reused (0 disables reuse)",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--force-rerun",
+        default=False,
+        help="Run every notebook, even if a recent passing result is cached",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=1,
+        help=f"Run up to this many short notebooks that share a kernel image in one job "
+        f"(at most {MAX_BATCH_SIZE}; 1 disables batching)",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--batch-max-runtime",
+        default=300,
+        help="Expected runtime in seconds under which a notebook counts as short",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--batch-all",
+        default=False,
+        help="Batch every notebook, whether or not its history says it is short",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--batch-concurrency",
+        default=DEFAULT_BATCH_CONCURRENCY,
+        help="Number of notebooks a batch job executes at the same time",
+        type=int,
+        required=False,
+    )
     parsed = parser.parse_args(args)
+    try:
+        parse_shard(parsed.shard)
+    except ValueError as e:
+        parser.error(str(e))
 
     return parsed
 
 
-def save_csv_to_s3(notebooks, job_names, kernels):
+def save_csv_to_s3(notebooks, job_names, kernel_types, cache_keys, cached, shard="1/1"):
     session = ensure_session()
 
-    df = pd.DataFrame({"filename": notebooks, "processing-job-name": job_names, "kernel": kernels})
+    df = pd.DataFrame(
+        {
+            "filename": notebooks,
+            "processing-job-name": job_names,
+            "kernel": kernel_types,
+            "cache-key": cache_keys,
+            "cached": cached,
+        }
+    )
 
-    csv_name = f"{time.strftime('%Y-%m-%d-%H-%M-%S', time.gmtime())}.csv"
+    index, count = parse_shard(shard)
+    suffix = f"-shard-{index}-of-{count}" if count > 1 else ""
+    csv_name = f"{time.strftime('%Y-%m-%d-%H-%M-%S', time.gmtime())}{suffix}.csv"
     df.to_csv(csv_name, index=False)
 
-    s3 = session.client("s3")
+    s3 = throttle.client(session, "s3")
     bucket = default_bucket(session)
     prefix = "full_repo_scan"
 
@@ -62,6 +176,45 @@ def save_csv_to_s3(notebooks, job_names, kernels):
     return f"s3://{bucket}/{prefix}/{csv_name}"
 
 
+def is_short(notebook, history, args):
+    """Return whether a notebook should run as part of a batch job."""
+    if args.batch_all:
+        return True
+    expected = history.expected_runtime(notebook)
+    return expected is not None and expected <= args.batch_max_runtime
+
+
+def submit_notebook(image, notebook, parameters, history, args, session):
+    """Upload a notebook and run it in its own Processing job."""
+    return execute_notebook(
+        image=image,
+        input_path=upload_notebook(notebook, session),
+        notebook=notebook,
+        instance_type=args.instance or "ml.m5.xlarge",
+        session=session,
+        output_prefix=get_output_prefix(),
+        parameters=parameters,
+        max_runtime_in_seconds=history.max_runtime_for(notebook),
+    )
+
+
+def submit_batch(image, notebooks, parameters, history, args, session):
+    """Upload a group of notebooks and run them in a single Processing job."""
+    max_runtime = min(
+        sum(history.max_runtime_for(notebook) for notebook in notebooks), DEFAULT_MAX_RUNTIME
+    )
+    return execute_notebook_batch(
+        image=image,
+        notebooks=[(notebook, upload_notebook(notebook, session)) for notebook in notebooks],
+        instance_type=args.instance or "ml.m5.xlarge",
+        session=session,
+        output_prefix=get_output_prefix(),
+        parameters=parameters,
+        concurrency=args.batch_concurrency,
+        max_runtime_in_seconds=max_runtime,
+    )
+
+
 def main():
     args = parse_args(sys.argv[1:])
     skip_args = {
@@ -69,38 +222,90 @@ def main():
         "local_mode": args.skip_local,
         "fsx_esx": args.skip_filesystem
     }
+    batch_size = min(max(args.batch_size, 1), MAX_BATCH_SIZE)
 
-    notebook_names = parse.all_notebook_filenames()
-    job_names = []
-    kernel_names = []
     session = ensure_session()
-    instance_type = args.instance or "ml.m5.xlarge"
+    history = RuntimeHistory(args.history, session)
+    cache = ResultCache(args.cache, session)
+    max_cache_age = 0 if args.force_rerun else args.max_cache_age
+    parameters = {"kms_key": kms_key()}
+    shard = select_shard(
+        parse.all_notebook_filenames(), args.shard, history, strategy=args.shard_strategy
+    )
+    notebook_names = history.longest_first(shard)
+    print(f"Shard {args.shard}: {len(notebook_names)} notebooks")
+
+    journal = SubmissionJournal(
+        args.journal or default_journal_uri(args.shard, session), session, resume=args.resume
+    )
+    submitted = journal.submitted()
+    if args.resume:
+        print(f"Resuming from {journal.uri}: {len(submitted)} notebooks already submitted")
+
+    cache_keys = {}
+    pending = defaultdict(list)
+
+    def record(notebooks, job_name, cached=False):
+        journal.record(
+            {
+                "notebook": notebook,
+                "job_name": job_name,
+                "cache_key": cache_keys.get(notebook),
+                "cached": cached,
+            }
+            for notebook in notebooks
+        )
+
     for notebook in notebook_names:
+        if notebook in submitted:
+            continue
         if parse.is_notebook_skipped(notebook, skip_args):
-            job_name = None
+            record([notebook], None)
+            continue
+
+        image = kernels.kernel_image_for(notebook)
+        cache_keys[notebook] = cache_key(notebook, image, parameters)
+        hit = cache.lookup(cache_keys[notebook], max_cache_age)
+        if hit:
+            print(f"{notebook}: reusing the passing result of {hit['job_name']}")
+            record([notebook], hit["job_name"], cached=True)
+            continue
+
+        if batch_size > 1 and is_short(notebook, history, args):
+            # Longest first means the short notebooks come last, so batches fill up quickly.
+            pending[image].append(notebook)
+            if len(pending[image]) < batch_size:
+                continue
+            batch = pending.pop(image)
+            job_name = submit_batch(image, batch, parameters, history, args, session)
+            record(batch, job_name)
         else:
-            image = kernels.kernel_image_for(notebook)
-            s3path = upload_notebook(notebook, session)
-            parameters = {"kms_key": kms_key()}
-            job_name = execute_notebook(
-                image=image,
-                input_path=s3path,
-                notebook=notebook,
-                instance_type=instance_type,
-                session=session,
-                output_prefix=get_output_prefix(),
-                parameters=parameters,
-            )
-            time.sleep(1)
+            job_name = submit_notebook(image, notebook, parameters, history, args, session)
+            record([notebook], job_name)
+        print(job_name)
 
+    for image, batch in pending.items():
+        if len(batch) == 1:
+            job_name = submit_notebook(image, batch[0], parameters, history, args, session)
+        else:
+            job_name = submit_batch(image, batch, parameters, history, args, session)
+        record(batch, job_name)
         print(job_name)
-        job_names.append(str(job_name))
-        kernel_names.append(kernels.kernel_type_for(notebook))
 
+    submitted = journal.submitted()
     print("\n" * 2)
     print("-" * 100)
     print("\n" * 2)
-    print(save_csv_to_s3(notebook_names, job_names, kernel_names))
+    print(
+        save_csv_to_s3(
+            notebook_names,
+            [str(submitted[notebook]["job_name"]) for notebook in notebook_names],
+            [kernels.kernel_type_for(notebook) for notebook in notebook_names],
+            [submitted[notebook]["cache_key"] for notebook in notebook_names],
+            [submitted[notebook]["cached"] for notebook in notebook_names],
+            shard=args.shard,
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -5,9 +5,17 @@ import sys
 import time
 
 from notebooks import kernels, parse
+from notebooks.cache import DEFAULT_MAX_AGE_HOURS, ResultCache, cache_key
+from notebooks.history import RuntimeHistory
 from notebooks.run import (
+    BUILD_ID_TAG,
+    COMMIT_TAG,
+    PR_NUMBER_TAG,
+    PROJECT_TAG,
     execute_notebook,
+    get_output_notebook,
     get_output_prefix,
+    get_status_sidecar,
     is_running,
     upload_notebook,
     wait_for_complete,
@@ -20,6 +28,14 @@ def parse_args(args):
     parser.set_defaults(func=lambda x: parser.print_usage())
     parser.add_argument("--pr", help="Pull request number", type=int, required=True)
     parser.add_argument("--instance", help="Instance type", type=str, required=False)
+    parser.add_argument(
+        "--commit",
+        default=os.environ.get("CODEBUILD_RESOLVED_SOURCE_VERSION"),
+        help="Commit under test, used to tag the Processing jobs "
+        "(default: the commit CodeBuild checked out)",
+        type=str,
+        required=False,
+    )
     parser.add_argument(
         "--skip-docker",
         default=True,
@@ -42,6 +58,34 @@ def parse_args(args):
         type=bool,
         required=False,
     )
+    parser.add_argument(
+        "--history",
+        help="Runtime history used to order jobs and set their timeouts "
+        "(default: runtime-history.json in the SageMaker default bucket)",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--cache",
+        help="Result cache to reuse passing runs from and record runs in "
+        "(default: result-cache/ in the SageMaker default bucket)",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--max-cache-age",
+        default=DEFAULT_MAX_AGE_HOURS,
+        help="Age in hours past which a cached passing result is not reused (0 disables reuse)",
+        type=float,
+        required=False,
+    )
+    parser.add_argument(
+        "--force-rerun",
+        default=False,
+        help="Run every notebook, even if a recent passing result is cached",
+        action="store_true",
+        required=False,
+    )
     parsed = parser.parse_args(args)
     if not parsed.pr:
         parser.error("--pr required")
@@ -49,6 +93,23 @@ def parse_args(args):
     return parsed
 
 
+def print_failure_details(job_name, session):
+    """Print the failing cell and traceback recorded in the job's status sidecar, if any."""
+    _, uri = get_output_notebook(job_name, session)
+    exception = (get_status_sidecar(uri, session) or {}).get("exception")
+    if not exception:
+        return
+
+    print(f"* {'exception':>11}: {exception['class']}: {exception['message']}")
+    print("*")
+    if exception["cell_index"] is not None:
+        print(f"* {'cell':>11}: {exception['cell_index']}")
+        print("*")
+        print(exception["source"])
+        print()
+    print("\n".join(line.rstrip("\n") for line in exception["traceback"]))
+
+
 def main():
     args = parse_args(sys.argv[1:])
     skip_args = {
@@ -57,15 +118,33 @@ def main():
         "fsx_esx": args.skip_filesystem
     }
     jobs = {}
+    cache_keys = {}
+    cached = set()
     session = ensure_session()
+    history = RuntimeHistory(args.history, session)
+    cache = ResultCache(args.cache, session)
+    max_cache_age = 0 if args.force_rerun else args.max_cache_age
+    parameters = {"kms_key": kms_key()}
     instance_type = args.instance or "ml.m5.xlarge"
-    for notebook in parse.pr_notebook_filenames(args.pr):
+    # The webhook receiver stops the jobs of superseded commits of the pull request by these tags.
+    tags = {PR_NUMBER_TAG: args.pr, COMMIT_TAG: args.commit or "unknown"}
+    if os.environ.get("CODEBUILD_BUILD_ID"):
+        # build ids are <project name>:<uuid>
+        tags[BUILD_ID_TAG] = os.environ["CODEBUILD_BUILD_ID"]
+        tags[PROJECT_TAG] = os.environ["CODEBUILD_BUILD_ID"].split(":")[0]
+    for notebook in history.longest_first(parse.pr_notebook_filenames(args.pr)):
         if parse.is_notebook_skipped(notebook, skip_args):
             job_name = None
         else:
             image = kernels.kernel_image_for(notebook)
+            cache_keys[notebook] = cache_key(notebook, image, parameters)
+            hit = cache.lookup(cache_keys[notebook], max_cache_age)
+            if hit:
+                print(f"{notebook}: reusing the passing result of {hit['job_name']}")
+                jobs[notebook] = hit["job_name"]
+                cached.add(notebook)
+                continue
             s3path = upload_notebook(notebook, session)
-            parameters = {"kms_key": kms_key()}
             job_name = execute_notebook(
                 image=image,
                 input_path=s3path,
@@ -75,8 +154,9 @@ def main():
                 session=session,
                 output_prefix=get_output_prefix(),
                 parameters=parameters,
+                max_runtime_in_seconds=history.max_runtime_for(notebook),
+                tags=tags,
             )
-            time.sleep(1)
 
         jobs[notebook] = job_name
 
@@ -106,10 +186,17 @@ def main():
                 print("*")
                 print(f"* {'status':>11}: {status:<11}")
                 print("*")
+                if notebook in cached:
+                    print(f"* {'cached':>11}: {'reused a recent passing run':<11}")
+                    print("*")
+                elif job_name:
+                    _, uri = get_output_notebook(job_name, session)
+                    cache.record(cache_keys[notebook], notebook, status, uri, job_name)
                 if status != "Completed":
                     print(failure_reason)
                     if status != "Skipped":
                         failures[notebook] = failure_reason
+                        print_failure_details(job_name, session)
                 jobs.pop(notebook)
             time.sleep(10)
 
@@ -4,6 +4,7 @@ import subprocess
 import urllib
 
 import boto3
+from notebooks import throttle
 
 
 def check_call_quiet(cmd, cwd=None):
@@ -32,7 +33,7 @@ class Git:
     @property
     def oauth_token(self):
         if self._oauth_token is None:
-            secrets_client = boto3.client("secretsmanager")
+            secrets_client = throttle.client(boto3.session.Session(), "secretsmanager")
             self._oauth_token = secrets_client.get_secret_value(SecretId=Git._OAUTH_SECRET_ID)[
                 "SecretString"
             ]
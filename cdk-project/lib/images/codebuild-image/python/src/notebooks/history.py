@@ -0,0 +1,151 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Keep per-notebook runtime history to order notebook jobs and size their timeouts"""
+
+import math
+
+from notebooks.utils import default_bucket, ensure_session, read_json, write_json
+
+# The StoppingCondition every notebook job got before there was any history.
+DEFAULT_MAX_RUNTIME = 7200
+# The shortest MaxRuntimeInSeconds derived from history, so that a notebook that usually runs in
+# a minute isn't killed by a slow instance start or a throttled API.
+MIN_MAX_RUNTIME = 1800
+DEFAULT_HEADROOM = 1.5
+# Number of most recent runtimes kept per notebook.
+MAX_SAMPLES = 20
+# Number of runtimes needed before the history is trusted for a notebook.
+MIN_SAMPLES = 3
+# Fraction of its MaxRuntimeInSeconds past which a Stopped job is taken to have hit the limit,
+# rather than to have been stopped early, e.g. because a newer commit superseded it.
+AT_LIMIT_FRACTION = 0.9
+
+
+def default_history_uri(session=None):
+    """Return the S3 uri of the runtime history in the Python SDK default bucket."""
+    return f"s3://{default_bucket(session)}/full_repo_scan/runtime-history.json"
+
+
+def percentile(values, q):
+    """Return the q-th percentile of the values using the nearest-rank method."""
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class RuntimeHistory:
+    """The most recent runtimes of each notebook, in seconds.
+
+    The history is a small JSON document mapping notebook filenames to their runtimes, oldest
+    first. It lives in S3 by default, but any local path works as well, which is handy for local
+    runs and for experiments.
+    """
+
+    def __init__(self, uri=None, session=None):
+        self.session = ensure_session(session)
+        self.uri = uri or default_history_uri(self.session)
+        self.runtimes = read_json(self.uri, self.session) or {}
+
+    def save(self):
+        write_json(self.uri, self.runtimes, self.session)
+
+    def record(self, notebook, runtime):
+        """Add a runtime for a notebook, forgetting the oldest ones past MAX_SAMPLES."""
+        samples = self.runtimes.setdefault(str(notebook), [])
+        samples.append(round(float(runtime), 1))
+        del samples[:-MAX_SAMPLES]
+
+    def record_scan(self, results, max_runtimes=None):
+        """Add the runtimes of the finished jobs in a describe-notebook-jobs result frame.
+
+        Completed jobs are recorded as they ran. Jobs Stopped at their MaxRuntimeInSeconds are
+        recorded as running for at least that long, so that the next limit is raised past it
+        instead of stopping the notebook again; jobs stopped earlier are left out.
+
+        Args:
+            results (pandas.DataFrame): A frame with "filename", "status" and "runtime" columns.
+            max_runtimes (pandas.Series): The MaxRuntimeInSeconds of each row's job, with the
+                same index as results (default: Stopped jobs are left out).
+
+        """
+        completed = results[results["status"] == "Completed"]
+        for notebook, runtime in zip(completed["filename"], completed["runtime"]):
+            self.record(notebook, runtime)
+
+        if max_runtimes is None:
+            return
+        stopped = results[results["status"] == "Stopped"]
+        limits = max_runtimes.reindex(stopped.index)
+        at_limit = limits.notna() & (stopped["runtime"] >= limits * AT_LIMIT_FRACTION)
+        for notebook, runtime, limit in zip(
+            stopped["filename"][at_limit], stopped["runtime"][at_limit], limits[at_limit]
+        ):
+            self.record(notebook, max(runtime, limit))
+
+    def samples(self, notebook):
+        samples = self.runtimes.get(str(notebook), [])
+        return samples if len(samples) >= MIN_SAMPLES else []
+
+    def expected_runtime(self, notebook):
+        """Return the mean of the recorded runtimes, or None if there isn't enough history."""
+        samples = self.samples(notebook)
+        return sum(samples) / len(samples) if samples else None
+
+    def max_runtime_for(
+        self,
+        notebook,
+        headroom=DEFAULT_HEADROOM,
+        minimum=MIN_MAX_RUNTIME,
+        maximum=DEFAULT_MAX_RUNTIME,
+    ):
+        """Return the MaxRuntimeInSeconds to use for a notebook job.
+
+        The most recent runtime counts even when it is above the 95th percentile, so that a
+        notebook that was stopped at its limit gets a longer one on its next run.
+
+        Args:
+            notebook (str): The notebook filename.
+            headroom (float): The factor applied to the 95th percentile of the recorded runtimes.
+            minimum (int): The lower bound of the result.
+            maximum (int): The upper bound of the result, also used without enough history.
+
+        Returns:
+            int: The p95 or the most recent runtime, whichever is longer, times the headroom,
+                within the bounds.
+
+        """
+        samples = self.samples(notebook)
+        if not samples:
+            return maximum
+        runtime = max(percentile(samples, 95), samples[-1])
+        return int(min(max(runtime * headroom, minimum), maximum))
+
+    def longest_first(self, notebooks):
+        """Order notebooks longest-processing-time-first.
+
+        Notebooks without enough history come first, since they may be the longest of all.
+        Otherwise the original order is kept between notebooks with the same expected runtime.
+
+        Args:
+            notebooks ([str]): The notebook filenames.
+
+        Returns:
+            [str]: The notebook filenames in submission order.
+
+        """
+
+        def key(notebook):
+            expected = self.expected_runtime(notebook)
+            return -math.inf if expected is None else -expected
+
+        return sorted(notebooks, key=key)
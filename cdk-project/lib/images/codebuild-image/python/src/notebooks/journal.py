@@ -0,0 +1,117 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Record the jobs a scan submits as it submits them, so that an interrupted scan can resume"""
+
+import json
+import os
+import time
+from urllib.parse import urlparse
+
+import botocore
+from notebooks import throttle
+from notebooks.shard import parse_shard
+from notebooks.utils import default_bucket, ensure_session
+
+
+def default_journal_uri(shard="1/1", session=None):
+    """Return the S3 uri of today's journal for a shard of the scan in the default bucket.
+
+    Reruns of the same scan on the same day find the journal of the run they resume.
+    """
+    index, count = parse_shard(shard)
+    suffix = f"-shard-{index}-of-{count}" if count > 1 else ""
+    date = time.strftime("%Y-%m-%d", time.gmtime())
+    return f"s3://{default_bucket(session)}/full_repo_scan/journal/{date}{suffix}.jsonl"
+
+
+class SubmissionJournal:
+    """An append-only journal of the notebooks a scan has submitted, one JSON object per line.
+
+    Every record is written out before record() returns: local journals are appended to, and S3
+    journals are uploaded again in full, since S3 objects cannot be appended to. A journal of a
+    few hundred notebooks stays well under a megabyte.
+    """
+
+    def __init__(self, uri, session=None, resume=False):
+        """Open a journal.
+
+        Args:
+            uri (str): An S3 uri or a local path.
+            session (boto3.Session): A boto3 session to use for S3 uris.
+            resume (bool): Keep the entries of an existing journal instead of starting over.
+
+        """
+        self.uri = uri
+        self.session = ensure_session(session)
+        self.lines = self._read().splitlines() if resume else []
+        self._write("".join(line + "\n" for line in self.lines), append=False)
+
+    def record(self, entries):
+        """Append entries to the journal.
+
+        Args:
+            entries ([dict]): JSON-serializable entries, each with at least a "notebook" and a
+                "job_name"; the job name is None for skipped notebooks.
+
+        """
+        lines = [
+            json.dumps(dict(entry, recorded_at=time.time()), sort_keys=True, default=str)
+            for entry in entries
+        ]
+        self.lines.extend(lines)
+        if self.uri.startswith("s3://"):
+            self._write("".join(line + "\n" for line in self.lines), append=False)
+        else:
+            self._write("".join(line + "\n" for line in lines), append=True)
+
+    def entries(self):
+        """Return the entries of the journal, oldest first."""
+        return [json.loads(line) for line in self.lines if line.strip()]
+
+    def submitted(self):
+        """Return the latest entry of every notebook in the journal, by notebook."""
+        return {entry["notebook"]: entry for entry in self.entries()}
+
+    def _read(self):
+        if not self.uri.startswith("s3://"):
+            if not os.path.exists(self.uri):
+                return ""
+            with open(self.uri, "r", encoding="utf-8") as f:
+                return f.read()
+
+        o = urlparse(self.uri)
+        try:
+            response = throttle.client(self.session, "s3").get_object(
+                Bucket=o.netloc, Key=o.path.lstrip("/")
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return ""
+            raise
+        return response["Body"].read().decode("utf-8")
+
+    def _write(self, body, append):
+        if not self.uri.startswith("s3://"):
+            directory = os.path.dirname(self.uri)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.uri, "a" if append else "w", encoding="utf-8") as f:
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            return
+
+        o = urlparse(self.uri)
+        throttle.client(self.session, "s3").put_object(
+            Bucket=o.netloc, Key=o.path.lstrip("/"), Body=body.encode("utf-8")
+        )
@@ -1,5 +1,5 @@
 import boto3
-from notebooks import parse
+from notebooks import parse, throttle
 
 
 def get_latest_image_digest(registry, repository):
@@ -13,7 +13,7 @@ def get_latest_image_digest(registry, repository):
         str: The latest image digest.
 
     """
-    client = boto3.client("ecr")
+    client = throttle.client(boto3.session.Session(), "ecr")
     response = client.describe_images(
         registryId=registry,
         repositoryName=repository,
@@ -22,10 +22,44 @@ import re
 import time
 from shlex import split
 from subprocess import Popen
+from urllib.parse import urlparse
 
-import boto3
 import botocore
-from notebooks.utils import default_bucket, ensure_session, get_execution_role
+from notebooks import throttle
+from notebooks.activity import record_activity
+from notebooks.utils import (
+    default_bucket,
+    ensure_session,
+    get_execution_role,
+    read_json,
+    write_json,
+)
+
+# The fields that read_output_notebook can extract from an output notebook.
+OUTPUT_NOTEBOOK_FIELDS = ("errors", "metadata", "cell_metadata", "scraps")
+# The output MIME type scrapbook uses for values glued with scrapbook.glue().
+SCRAP_MIME_TYPE = "application/scrapbook.scrap.json+json"
+DEFAULT_RANGE_SIZE = 1024 * 1024
+# The suffix of the JSON status sidecar that execute.py writes next to each output notebook.
+STATUS_SIDECAR_SUFFIX = ".status.json"
+# The suffix of the per-cell timing profile that execute.py writes next to each output notebook.
+TIMINGS_SIDECAR_SUFFIX = ".timings.csv"
+# The suffix of the resource usage profile that execute.py writes next to each output notebook.
+RESOURCES_SIDECAR_SUFFIX = ".resources.csv"
+# A batch job takes one input per notebook plus the manifest, and a job has at most 10 inputs.
+MAX_BATCH_SIZE = 9
+DEFAULT_BATCH_CONCURRENCY = 2
+BATCH_MANIFEST_NAME = "manifest.json"
+# Tags that tie the jobs of a pull request build to the pull request and the commit under test,
+# so that the webhook receiver can stop them when the pull request gets a new push. Pull request
+# numbers are only unique within a repository, so the jobs are also tagged with the CodeBuild
+# project, which is named after the repository and its base branch.
+PR_NUMBER_TAG = "pr-number"
+COMMIT_TAG = "commit"
+BUILD_ID_TAG = "codebuild-build-id"
+PROJECT_TAG = "codebuild-project"
+# The prefix of the names of the Processing jobs that run notebooks.
+JOB_NAME_PREFIX = "papermill"
 
 abbrev_image_pat = re.compile(
     r"(?P<account>\d+).dkr.ecr.(?P<region>[^.]+).amazonaws.com/(?P<image>[^:/]+)(?P<tag>:[^:]+)?"
@@ -44,7 +78,7 @@ def describe(job_name, session):
 
     """
     session = ensure_session(session)
-    client = session.client("sagemaker")
+    client = throttle.client(session, "sagemaker")
     response = client.describe_processing_job(ProcessingJobName=job_name)
     return response["ProcessingJobStatus"], response.get("ExitMessage")
 
@@ -106,7 +140,7 @@ def upload_notebook(notebook, session=None):
       The resulting object name in S3 in URI format.
     """
     session = ensure_session(session)
-    s3 = session.client("s3")
+    s3 = throttle.client(session, "s3")
     bucket = default_bucket(session)
     prefix = f"papermill_input/{time.strftime('%Y-%m-%d-%H-%M-%S', time.gmtime())}"
 
@@ -141,7 +175,7 @@ def upload_fileobj(notebook_fileobj, session=None):
     session = ensure_session(session)
     snotebook = f"notebook-{time.strftime('%Y-%m-%d-%H-%M-%S', time.gmtime())}.ipynb"
 
-    s3 = session.client("s3")
+    s3 = throttle.client(session, "s3")
     key = "papermill_input/" + snotebook
     bucket = default_bucket(session)
     s3path = f"s3://{bucket}/{key}"
@@ -155,6 +189,37 @@ def get_output_prefix():
     return f"s3://{default_bucket()}/papermill_output"
 
 
+def _expand_role(role, session):
+    """Return the role ARN for a role name, or the default execution role if none is given."""
+    if not role:
+        return get_execution_role(session)
+    if "/" not in role:
+        account = throttle.client(session, "sts").get_caller_identity()["Account"]
+        return f"arn:aws:iam::{account}:role/{role}"
+    return role
+
+
+def _expand_image(image, session):
+    """Return the full ECR image URI for an image name in this account and region."""
+    if "/" not in image:
+        account = throttle.client(session, "sts").get_caller_identity()["Account"]
+        region = session.region_name
+        return f"{account}.dkr.ecr.{region}.amazonaws.com/{image}:latest"
+    return image
+
+
+def _tag_list(tags):
+    return [{"Key": key, "Value": str(value)} for key, value in tags.items()]
+
+
+def _job_name(name, timestamp):
+    return (
+        (f"{JOB_NAME_PREFIX}-" + re.sub(r"[^-a-zA-Z0-9]", "-", name))[: 62 - len(timestamp)]
+        + "-"
+        + timestamp
+    )
+
+
 def execute_notebook(
     *,
     image,
@@ -165,19 +230,12 @@ def execute_notebook(
     role=None,
     instance_type,
     session,
+    max_runtime_in_seconds=7200,
+    tags=None,
 ):
     session = ensure_session(session)
-
-    if not role:
-        role = get_execution_role(session)
-    elif "/" not in role:
-        account = session.client("sts").get_caller_identity()["Account"]
-        role = f"arn:aws:iam::{account}:role/{role}"
-
-    if "/" not in image:
-        account = session.client("sts").get_caller_identity()["Account"]
-        region = session.region_name
-        image = f"{account}.dkr.ecr.{region}.amazonaws.com/{image}:latest"
+    role = _expand_role(role, session)
+    image = _expand_image(image, session)
 
     if notebook is None:
         notebook = input_path
@@ -186,11 +244,7 @@ def execute_notebook(
     nb_name, nb_ext = os.path.splitext(base)
     timestamp = time.strftime("%Y-%m-%d-%H-%M-%S", time.gmtime())
 
-    job_name = (
-        ("papermill-" + re.sub(r"[^-a-zA-Z0-9]", "-", nb_name))[: 62 - len(timestamp)]
-        + "-"
-        + timestamp
-    )
+    job_name = _job_name(nb_name, timestamp)
     input_directory = "/opt/ml/processing/input/"
     local_input = os.path.join(input_directory, os.path.basename(notebook))
     result = f"{nb_name}-{timestamp}{nb_ext}"
@@ -229,7 +283,7 @@ def execute_notebook(
                 "VolumeSizeInGB": 40,
             }
         },
-        "StoppingCondition": {"MaxRuntimeInSeconds": 7200},
+        "StoppingCondition": {"MaxRuntimeInSeconds": max_runtime_in_seconds},
         "AppSpecification": {
             "ImageUri": image,
             "ContainerArguments": [
@@ -239,21 +293,188 @@ def execute_notebook(
         "RoleArn": role,
         "Environment": {},
     }
+    if tags:
+        api_args["Tags"] = _tag_list(tags)
 
     api_args["Environment"]["PAPERMILL_INPUT"] = local_input
     api_args["Environment"]["PAPERMILL_OUTPUT"] = local_output + result
-    if os.environ.get("AWS_DEFAULT_REGION") != None:
+    if os.environ.get("AWS_DEFAULT_REGION") is not None:
         api_args["Environment"]["AWS_DEFAULT_REGION"] = os.environ["AWS_DEFAULT_REGION"]
     api_args["Environment"]["PAPERMILL_PARAMS"] = json.dumps(parameters)
     api_args["Environment"]["PAPERMILL_NOTEBOOK_NAME"] = notebook
+    sample_interval = os.environ.get("PAPERMILL_SAMPLE_INTERVAL")
+    if sample_interval is not None:
+        api_args["Environment"]["PAPERMILL_SAMPLE_INTERVAL"] = sample_interval
 
-    client = boto3.client("sagemaker")
+    client = throttle.client(session, "sagemaker")
     result = client.create_processing_job(**api_args)
+    # the notebook may start any other resource in this region, cleanup sweeps them all
+    record_activity("ProcessingJobs", JOB_NAME_PREFIX, session)
     job_arn = result["ProcessingJobArn"]
     job = re.sub("^.*/", "", job_arn)
     return job
 
 
+def execute_notebook_batch(
+    *,
+    image,
+    notebooks,
+    output_prefix,
+    parameters,
+    role=None,
+    instance_type,
+    session,
+    concurrency=DEFAULT_BATCH_CONCURRENCY,
+    max_runtime_in_seconds=7200,
+    tags=None,
+):
+    """Run several notebooks that share a kernel image in a single Processing job.
+
+    Each notebook is its own job input, and a manifest listing them is uploaded next to the
+    notebooks as one more input. execute.py runs up to `concurrency` notebooks at a time, and
+    every notebook gets its own output notebook and sidecars under the output prefix.
+
+    Args:
+        image (str): The kernel image shared by the notebooks.
+        notebooks ([(str, str)]): The notebook names and the S3 uris they were uploaded to.
+            At most MAX_BATCH_SIZE notebooks fit in a batch.
+        output_prefix (str): The S3 prefix the output notebooks are written to.
+        parameters (dict): The papermill parameters passed to every notebook.
+        role (str): The execution role name or ARN.
+        instance_type (str): The Processing instance type.
+        session (boto3.Session): The boto3 session to use.
+        concurrency (int): The number of notebooks executed at the same time.
+        max_runtime_in_seconds (int): The timeout of the whole batch.
+        tags (dict): Tags to add to the job.
+
+    Returns:
+        str: The name of the Processing job.
+
+    """
+    if not 0 < len(notebooks) <= MAX_BATCH_SIZE:
+        raise ValueError(f"A batch holds 1 to {MAX_BATCH_SIZE} notebooks, got {len(notebooks)}")
+
+    session = ensure_session(session)
+    role = _expand_role(role, session)
+    image = _expand_image(image, session)
+
+    timestamp = time.strftime("%Y-%m-%d-%H-%M-%S", time.gmtime())
+    first_name, _ = os.path.splitext(os.path.basename(notebooks[0][0]))
+    job_name = _job_name(f"batch-{first_name}", timestamp)
+    input_directory = "/opt/ml/processing/input/"
+    local_output = "/opt/ml/processing/output/"
+
+    inputs = []
+    entries = []
+    for index, (notebook, input_path) in enumerate(notebooks):
+        nb_name, nb_ext = os.path.splitext(os.path.basename(notebook))
+        local_input = os.path.join(input_directory, str(index))
+        inputs.append(
+            {
+                "InputName": f"notebook-{index}",
+                "S3Input": {
+                    "S3Uri": input_path,
+                    "LocalPath": local_input,
+                    "S3DataType": "S3Prefix",
+                    "S3InputMode": "File",
+                    "S3DataDistributionType": "FullyReplicated",
+                },
+            }
+        )
+        entries.append(
+            {
+                "notebook": notebook,
+                "input": os.path.join(local_input, os.path.basename(notebook)),
+                # Notebooks in different directories may share a filename.
+                "output": f"{local_output}{nb_name}-{timestamp}-{index}{nb_ext}",
+                "parameters": parameters,
+            }
+        )
+
+    manifest_uri = f"s3://{default_bucket(session)}/papermill_input/{job_name}"
+    write_json(f"{manifest_uri}/{BATCH_MANIFEST_NAME}", {"notebooks": entries}, session)
+    manifest_directory = os.path.join(input_directory, "manifest")
+    inputs.append(
+        {
+            "InputName": "manifest",
+            "S3Input": {
+                "S3Uri": manifest_uri,
+                "LocalPath": manifest_directory,
+                "S3DataType": "S3Prefix",
+                "S3InputMode": "File",
+                "S3DataDistributionType": "FullyReplicated",
+            },
+        }
+    )
+
+    environment = {
+        "PAPERMILL_MANIFEST": os.path.join(manifest_directory, BATCH_MANIFEST_NAME),
+        "PAPERMILL_CONCURRENCY": str(concurrency),
+        "PAPERMILL_NOTEBOOK_NAME": ",".join(notebook for notebook, _ in notebooks),
+    }
+    for name in ("AWS_DEFAULT_REGION", "PAPERMILL_SAMPLE_INTERVAL"):
+        if os.environ.get(name) is not None:
+            environment[name] = os.environ[name]
+
+    extra_args = {"Tags": _tag_list(tags)} if tags else {}
+    client = throttle.client(session, "sagemaker")
+    result = client.create_processing_job(
+        ProcessingInputs=inputs,
+        ProcessingOutputConfig={
+            "Outputs": [
+                {
+                    "OutputName": "result",
+                    "S3Output": {
+                        "S3Uri": output_prefix,
+                        "LocalPath": local_output,
+                        "S3UploadMode": "EndOfJob",
+                    },
+                },
+            ],
+        },
+        ProcessingJobName=job_name,
+        ProcessingResources={
+            "ClusterConfig": {
+                "InstanceCount": 1,
+                "InstanceType": instance_type,
+                "VolumeSizeInGB": 40,
+            }
+        },
+        StoppingCondition={"MaxRuntimeInSeconds": max_runtime_in_seconds},
+        AppSpecification={"ImageUri": image, "ContainerArguments": ["run_notebook"]},
+        RoleArn=role,
+        Environment=environment,
+        **extra_args,
+    )
+    record_activity("ProcessingJobs", JOB_NAME_PREFIX, session)
+    return re.sub("^.*/", "", result["ProcessingJobArn"])
+
+
+def is_batch(desc):
+    """Return whether a Processing job description is for a batch of notebooks."""
+    return "PAPERMILL_MANIFEST" in desc.get("Environment", {})
+
+
+def batch_outputs(desc, session=None):
+    """Return the S3 uri of each output notebook of a batch job.
+
+    Args:
+        desc (dict): The DescribeProcessingJob result of a batch job.
+        session (boto3.Session): The boto3 session to use.
+
+    Returns:
+        dict: The output notebook uri of each notebook in the batch, by notebook name.
+
+    """
+    inputs = {i["InputName"]: i["S3Input"]["S3Uri"] for i in desc["ProcessingInputs"]}
+    manifest = read_json(f"{inputs['manifest']}/{BATCH_MANIFEST_NAME}", session)
+    prefix = desc["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]
+    return {
+        entry["notebook"]: f"{prefix}/{os.path.basename(entry['output'])}"
+        for entry in (manifest or {}).get("notebooks", [])
+    }
+
+
 def wait_for_complete(job_name, progress=True, sleep_time=10, session=None):
     """Wait for a notebook execution job to complete.
 
@@ -272,7 +493,7 @@ def wait_for_complete(job_name, progress=True, sleep_time=10, session=None):
     """
 
     session = ensure_session(session)
-    client = session.client("sagemaker")
+    client = throttle.client(session, "sagemaker")
     done = False
     while not done:
         if progress:
@@ -300,14 +521,299 @@ def get_output_notebook(job_name, session=None):
         (str, str): A tuple with the notebook name and S3 uri to the output notebook.
     """
     session = ensure_session(session)
-    client = session.client("sagemaker")
+    client = throttle.client(session, "sagemaker")
     desc = client.describe_processing_job(ProcessingJobName=job_name)
+    return output_notebook_for(desc)
+
 
+def output_notebook_for(desc):
+    """Get the name and S3 uri for an output notebook from a Processing job description.
+
+    Args:
+      desc (dict): The response of a DescribeProcessingJob call for the job that executed the
+        notebook. (Required)
+
+    Returns:
+        (str, str): A tuple with the notebook name and S3 uri to the output notebook.
+    """
     prefix = desc["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]
     notebook = os.path.basename(desc["Environment"]["PAPERMILL_OUTPUT"])
     return notebook, f"{prefix}/{notebook}"
 
 
+def split_s3_uri(uri):
+    """Split an S3 uri into its bucket and key.
+
+    Args:
+      uri (str): An S3 uri of the form "s3://<bucket>/<key>". (Required)
+
+    Returns:
+        (str, str): A tuple with the bucket name and the object key.
+    """
+    o = urlparse(uri)
+    return o.netloc, o.path.lstrip("/")
+
+
+class S3RangeReader(io.RawIOBase):
+    """A read-only, forward-only file object over an S3 object.
+
+    The object is fetched in ranged GETs of at most ``chunk_size`` bytes as the consumer reads,
+    so a consumer that stops early never downloads the rest of the object.
+    """
+
+    def __init__(self, client, bucket, key, chunk_size=DEFAULT_RANGE_SIZE):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.size = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.size is not None and self.position >= self.size:
+            return 0
+        end = self.position + min(len(b), self.chunk_size) - 1
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=self.key, Range=f"bytes={self.position}-{end}"
+            )
+        except botocore.exceptions.ClientError as e:
+            # Asking for a range that starts at the end of the object (including an empty one).
+            if e.response["Error"]["Code"] == "InvalidRange":
+                self.size = self.position
+                return 0
+            raise e
+
+        content_range = response.get("ContentRange")
+        if content_range:
+            self.size = int(content_range.rsplit("/", 1)[1])
+        data = response["Body"].read()
+        b[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def _output_notebook_roots(fields):
+    """Return the JSON prefixes that have to be materialized to extract the given fields."""
+    roots = set()
+    if "metadata" in fields:
+        roots.add("metadata")
+    if "cell_metadata" in fields:
+        roots.add("cells.item.metadata")
+    if "errors" in fields:
+        roots.update(
+            f"cells.item.outputs.item.{name}"
+            for name in ("output_type", "ename", "evalue", "traceback")
+        )
+    if "scraps" in fields:
+        roots.add(f"cells.item.outputs.item.data.{SCRAP_MIME_TYPE}")
+    return roots
+
+
+def read_output_notebook(
+    uri, fields=OUTPUT_NOTEBOOK_FIELDS, chunk_size=DEFAULT_RANGE_SIZE, session=None
+):
+    """Stream an output notebook from S3 and extract only the requested fields.
+
+    The notebook is fed through an incremental JSON parser while it is being downloaded in ranged
+    GETs. Only the parts of the document needed for the requested fields are materialized; cell
+    sources and bulky outputs such as images are skipped as they stream past.
+
+    Args:
+      uri (str): The S3 uri of the output notebook. (Required)
+      fields (tuple): Any of "errors", "metadata", "cell_metadata" and "scraps".
+        (Default: all of them)
+      chunk_size (int): The size in bytes of each ranged GET. (Default: 1 MiB)
+      session (boto3.Session):
+        A boto3 session to use. Will create a default session if not supplied. (Default: None)
+
+    Returns:
+      dict: A dictionary with an entry for each requested field. For example::
+
+      {'errors': [{'cell': 7, 'ename': 'ValueError', 'evalue': 'bad input', 'traceback': [...]}],
+       'metadata': {'kernelspec': {...}, 'papermill': {'duration': 312.5, 'exception': True, ...}},
+       'cell_metadata': [{'papermill': {'duration': 0.8, 'status': 'completed', ...}}, ...],
+       'scraps': {'accuracy': {'data': 0.93, 'encoder': 'json'}}}
+    """
+    import ijson  # pylint: disable=import-error
+    from ijson.common import ObjectBuilder  # pylint: disable=import-error
+
+    unknown = set(fields) - set(OUTPUT_NOTEBOOK_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown output notebook fields: {', '.join(sorted(unknown))}")
+
+    session = ensure_session(session)
+    s3 = throttle.client(session, "s3")
+    bucket, key = split_s3_uri(uri)
+    stream = io.BufferedReader(S3RangeReader(s3, bucket, key, chunk_size), buffer_size=chunk_size)
+
+    result = {"errors": [], "metadata": {}, "cell_metadata": [], "scraps": {}}
+    roots = _output_notebook_roots(fields)
+    cell = -1
+    output = {}
+    builder, root = None, None
+
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is None and prefix in roots and event not in ("map_key", "end_map", "end_array"):
+            builder, root = ObjectBuilder(), prefix
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == root and event not in ("map_key", "start_map", "start_array"):
+                if root == "metadata":
+                    result["metadata"] = builder.value
+                elif root == "cells.item.metadata":
+                    result["cell_metadata"].append(builder.value)
+                else:
+                    output[root[len("cells.item.outputs.item.") :]] = builder.value
+                builder, root = None, None
+            continue
+
+        if prefix == "cells.item" and event == "start_map":
+            cell += 1
+        elif prefix == "cells.item.outputs.item" and event == "start_map":
+            output = {}
+        elif prefix == "cells.item.outputs.item" and event == "end_map":
+            if "errors" in fields and output.get("output_type") == "error":
+                result["errors"].append(
+                    {
+                        "cell": cell,
+                        "ename": output.get("ename"),
+                        "evalue": output.get("evalue"),
+                        "traceback": output.get("traceback", []),
+                    }
+                )
+            scrap = output.get(f"data.{SCRAP_MIME_TYPE}")
+            if scrap:
+                result["scraps"][scrap["name"]] = {
+                    "data": scrap.get("data"),
+                    "encoder": scrap.get("encoder"),
+                }
+
+    return {field: result[field] for field in fields}
+
+
+def sidecar_uri(output_uri, suffix):
+    """Get the S3 uri of a sidecar object that execute.py writes next to an output notebook.
+
+    Args:
+      output_uri (str): The S3 uri of the output notebook. (Required)
+      suffix (str): The sidecar suffix, eg. STATUS_SIDECAR_SUFFIX. (Required)
+
+    Returns:
+      str: The S3 uri of the sidecar.
+    """
+    return os.path.splitext(output_uri)[0] + suffix
+
+
+def read_sidecar(uri, session=None):
+    """Fetch a small JSON sidecar object from S3.
+
+    Args:
+      uri (str): The S3 uri of the sidecar. (Required)
+      session (boto3.Session):
+        A boto3 session to use. Will create a default session if not supplied. (Default: None)
+
+    Returns:
+      dict: The decoded sidecar, or None if the job did not write one.
+    """
+    body = _get_object_body(uri, session)
+    return json.loads(body) if body is not None else None
+
+
+def _get_object_body(uri, session=None):
+    """Return the contents of a small S3 object, or None if it doesn't exist."""
+    session = ensure_session(session)
+    s3 = throttle.client(session, "s3")
+    bucket, key = split_s3_uri(uri)
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise e
+    return response["Body"].read()
+
+
+def get_status_sidecar(output_uri, session=None):
+    """Fetch the status sidecar for an output notebook.
+
+    The status sidecar records the outcome of the run, the time spent in each phase, when each
+    container startup phase ended and how long it took to reach the first cell and, for failed
+    runs, the exception class, message, failing cell index, cell source excerpt and traceback.
+
+    Args:
+      output_uri (str): The S3 uri of the output notebook. (Required)
+      session (boto3.Session):
+        A boto3 session to use. Will create a default session if not supplied. (Default: None)
+
+    Returns:
+      dict: The status record, or None if the job did not write one. For example::
+
+      {'notebook': 'sagemaker-python-sdk/mxnet_mnist/mxnet_mnist.ipynb',
+       'status': 'Failed',
+       'phases': {'download': 4.1, 'kernel': 0.6, 'execute': 281.3},
+       'exception': {'class': 'ValueError',
+                     'message': 'bad input',
+                     'cell_index': 7,
+                     'execution_count': 5,
+                     'source': 'estimator.fit(inputs)',
+                     'traceback': ['---------', ...]},
+       'startup': {'container_start': 1617184962.3,
+                   'events': {'process_start': 0.4, 'download': 1.2, 'notebook_loaded': 1.3,
+                              'kernel_selected': 1.3},
+                   'time_to_first_cell': 4.8}}
+    """
+    return read_sidecar(sidecar_uri(output_uri, STATUS_SIDECAR_SUFFIX), session)
+
+
+def get_timings_sidecar(output_uri, session=None):
+    """Fetch the per-cell timing profile for an output notebook.
+
+    Args:
+      output_uri (str): The S3 uri of the output notebook. (Required)
+      session (boto3.Session):
+        A boto3 session to use. Will create a default session if not supplied. (Default: None)
+
+    Returns:
+      pandas.DataFrame: One row per code cell with the columns "cell_index", "execution_count",
+        "status", "start_time", "end_time", "duration" (in seconds), "sagemaker_wait" (1 if the cell
+        blocks on a SageMaker job or endpoint) and "source" (the first line of the cell), or None
+        if the job did not write a profile.
+    """
+    return _read_csv_sidecar(output_uri, TIMINGS_SIDECAR_SUFFIX, session)
+
+
+def get_resources_sidecar(output_uri, session=None):
+    """Fetch the resource usage profile for an output notebook.
+
+    Args:
+      output_uri (str): The S3 uri of the output notebook. (Required)
+      session (boto3.Session):
+        A boto3 session to use. Will create a default session if not supplied. (Default: None)
+
+    Returns:
+      pandas.DataFrame: One row per sample with the columns "elapsed" (seconds since the start of
+        the job), "cpu_count", "cpu_percent" (across all CPUs), "kernel_rss_bytes" (the kernel
+        process tree), "memory_used_bytes", "memory_total_bytes" (the whole instance) and
+        "disk_read_bytes", "disk_write_bytes", "net_recv_bytes", "net_sent_bytes" (cumulative since
+        the start of the job), or None if the job did not write a profile.
+    """
+    return _read_csv_sidecar(output_uri, RESOURCES_SIDECAR_SUFFIX, session)
+
+
+def _read_csv_sidecar(output_uri, suffix, session=None):
+    import pandas as pd  # pylint: disable=import-error
+
+    body = _get_object_body(sidecar_uri(output_uri, suffix), session)
+    if body is None:
+        return None
+    return pd.read_csv(io.BytesIO(body))
+
+
 def download_notebook(job_name, output=".", session=None):
     """Download the output notebook from a previously completed job.
 
@@ -391,7 +897,7 @@ def stop_run(job_name, session=None):
        job_name (string): The name of the job to stop
        session (boto3.Session): The boto3 session to use. Will create a default session if not supplied (default: None)."""
     session = ensure_session(session)
-    client = session.client("sagemaker")
+    client = throttle.client(session, "sagemaker")
     client.stop_processing_job(ProcessingJobName=job_name)
 
 
@@ -406,7 +912,7 @@ def describe_runs(n=0, notebook=None, rule=None, session=None):
        session (boto3.Session): The boto3 session to use. Will create a default session if not supplied (default: None).
     """
     session = ensure_session(session)
-    client = session.client("sagemaker")
+    client = throttle.client(session, "sagemaker")
     paginator = client.get_paginator("list_processing_jobs")
     page_iterator = paginator.paginate(NameContains="papermill-")
 
@@ -455,20 +961,14 @@ def describe_run(job_name, session=None):
        'Role': 'BasicExecuteNotebookRole-us-west-2'}
     """
     session = ensure_session(session)
-    client = session.client("sagemaker")
-
-    while True:
-        try:
-            desc = client.describe_processing_job(ProcessingJobName=job_name)
-            break
-        except botocore.exceptions.ClientError as e:
-            if e.response["Error"]["Code"] == "ThrottlingException":
-                time.sleep(1)
-            else:
-                raise e
+    client = throttle.client(session, "sagemaker")
+    desc = client.describe_processing_job(ProcessingJobName=job_name)
 
     status = desc["ProcessingJobStatus"]
-    if status == "Completed":
+    if status == "Completed" and is_batch(desc):
+        # A batch writes one output notebook per notebook, all under the output prefix.
+        result = desc["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]
+    elif status == "Completed":
         output_prefix = desc["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]
         notebook_name = os.path.basename(desc["Environment"]["PAPERMILL_OUTPUT"])
         result = f"{output_prefix}/{notebook_name}"
@@ -524,16 +1024,8 @@ class NewJobs:
             self.next_latest_seen_job = None
         while True:
             args = {"NextToken": next_token} if next_token else {}
-            while True:
-                try:
-                    await asyncio.sleep(0)
-                    result = self.client.list_processing_jobs(MaxResults=30, **args)
-                    break
-                except botocore.exceptions.ClientError as e:
-                    if e.response["Error"]["Code"] == "ThrottlingException":
-                        time.sleep(1)
-                    else:
-                        raise e
+            # waits for the rate limit and retries without blocking the other tasks
+            result = await self.client.list_processing_jobs.call_async(MaxResults=30, **args)
             jobs = result["ProcessingJobSummaries"]
             for job in jobs:
                 if not self.next_latest_seen_job:
@@ -557,7 +1049,7 @@ class NotebookRunTracker:
     # the end.
     def __init__(self, max_jobs=20, session=None, log=None):
         self.session = ensure_session(session)
-        self.client = self.session.client("sagemaker")
+        self.client = throttle.client(self.session, "sagemaker")
         self.log = log or logging.getLogger(__name__)
         self.max_jobs = max_jobs
 
@@ -0,0 +1,111 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Split the notebooks of a full repo scan across parallel builds"""
+
+import hashlib
+import re
+
+STRATEGIES = ("auto", "hash", "runtime")
+
+shard_pat = re.compile(r"^(?P<index>\d+)/(?P<count>\d+)$")
+
+
+def parse_shard(spec):
+    """Parse a shard specification.
+
+    Args:
+        spec (str): The shard to run, as "i/N" with 1 <= i <= N.
+
+    Returns:
+        (int, int): The 1-based shard index and the number of shards.
+
+    Raises:
+        ValueError: If the specification is malformed or out of range.
+
+    """
+    match = shard_pat.match(spec.strip())
+    if not match:
+        raise ValueError(f"Invalid shard '{spec}', expected i/N")
+    index, count = int(match.group("index")), int(match.group("count"))
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard '{spec}', i must be between 1 and N")
+    return index, count
+
+
+def hash_shard(notebook, count):
+    """Return the 1-based shard of a notebook, from a stable hash of its filename."""
+    digest = hashlib.sha256(str(notebook).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % count + 1
+
+
+def runtime_shards(notebooks, count, history):
+    """Assign notebooks to shards so that every shard gets about the same expected runtime.
+
+    Notebooks are assigned longest first to the least loaded shard. Notebooks without enough
+    history are assumed to be as long as the longest known one. Ties go to the lowest shard.
+
+    Args:
+        notebooks ([str]): The notebook filenames.
+        count (int): The number of shards.
+        history (notebooks.history.RuntimeHistory): The runtime history.
+
+    Returns:
+        dict: The 1-based shard of each notebook.
+
+    """
+    expected = {notebook: history.expected_runtime(notebook) for notebook in notebooks}
+    longest = max((runtime for runtime in expected.values() if runtime is not None), default=1)
+    estimates = {
+        notebook: longest if runtime is None else runtime for notebook, runtime in expected.items()
+    }
+
+    loads = [0.0] * count
+    shards = {}
+    for notebook in sorted(notebooks, key=lambda notebook: (-estimates[notebook], notebook)):
+        shard = loads.index(min(loads))
+        loads[shard] += estimates[notebook]
+        shards[notebook] = shard + 1
+    return shards
+
+
+def select_shard(notebooks, spec, history=None, strategy="auto"):
+    """Return the notebooks that belong to one shard, in their original order.
+
+    Every shard of a scan must see the same notebooks, and for the runtime strategy the same
+    history, so that each notebook lands in exactly one shard.
+
+    Args:
+        notebooks ([str]): The notebook filenames of the whole scan.
+        spec (str): The shard to run, as "i/N".
+        history (notebooks.history.RuntimeHistory): The runtime history, if any.
+        strategy (str): "hash", "runtime", or "auto" to balance by runtime whenever the history
+            knows at least one of the notebooks.
+
+    Returns:
+        [str]: The notebook filenames of the shard.
+
+    """
+    index, count = parse_shard(spec)
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown sharding strategy '{strategy}'")
+    if strategy == "auto":
+        known = history is not None and any(
+            history.expected_runtime(notebook) is not None for notebook in notebooks
+        )
+        strategy = "runtime" if known else "hash"
+
+    if strategy == "runtime":
+        shards = runtime_shards(notebooks, count, history)
+    else:
+        shards = {notebook: hash_shard(notebook, count) for notebook in notebooks}
+    return [notebook for notebook in notebooks if shards[notebook] == index]
@@ -0,0 +1,286 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Call AWS APIs at the highest rate they sustain, retrying throttled and transient errors.
+
+Every operation, e.g. SageMaker DescribeProcessingJob in us-west-2, has its own AIMD limiter
+shared by the whole process: its rate grows while calls succeed and is halved whenever one is
+throttled. Failed calls are retried with capped exponential backoff and full jitter, until they
+succeed, run out of attempts or would end past their deadline.
+
+Wrap a client with client() or ThrottledClient to send all its calls through call().
+"""
+
+import asyncio
+import functools
+import random
+import threading
+import time
+
+import botocore
+import botocore.config
+
+# Error codes AWS services use to say that a call was throttled.
+THROTTLING_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+}
+# Error codes of failures that are worth trying again, besides throttling.
+TRANSIENT_CODES = {
+    "InternalError",
+    "InternalFailure",
+    "InternalServerError",
+    "ServiceUnavailable",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 20.0
+# The wrapped clients make a single attempt, since call() does the retrying: botocore's own
+# retries would multiply the attempts and hide the throttling from the limiters. Its
+# max_attempts counts the retries, not the first attempt.
+NO_RETRIES = botocore.config.Config(retries={"max_attempts": 0})
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def is_throttling_error(e):
+    """Return whether an exception is a throttled AWS call."""
+    return (
+        isinstance(e, botocore.exceptions.ClientError)
+        and e.response["Error"]["Code"] in THROTTLING_CODES
+    )
+
+
+def is_retryable_error(e):
+    """Return whether an exception is an AWS call that is worth trying again."""
+    return is_throttling_error(e) or (
+        isinstance(e, botocore.exceptions.ClientError)
+        and e.response["Error"]["Code"] in TRANSIENT_CODES
+    )
+
+
+def backoff_delays(base=DEFAULT_BASE_DELAY, cap=DEFAULT_MAX_DELAY):
+    """Yield the delays before each retry: exponential, capped, with full jitter."""
+    attempt = 0
+    while True:
+        yield random.uniform(0, min(cap, base * 2**attempt))
+        attempt += 1
+
+
+class AimdLimiter:
+    """Paces calls from any number of threads or tasks at a rate that adapts to throttling.
+
+    The rate grows additively, by about `increase` calls per second every second, while calls
+    succeed, and is multiplied by `decrease` whenever one is throttled, so that it settles just
+    under the highest rate the API sustains.
+    """
+
+    def __init__(self, rate=20.0, min_rate=0.5, max_rate=200.0, increase=2.0, decrease=0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.lock = threading.Lock()
+        self.next_call = 0.0
+
+    def _reserve(self):
+        """Reserve the next call slot and return how long to wait for it."""
+        with self.lock:
+            now = time.time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + 1.0 / self.rate
+        return delay
+
+    def wait(self):
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+
+def no_retries(config=None):
+    """Return a client config that makes no retries, with the other settings of config."""
+    return config.merge(NO_RETRIES) if config else NO_RETRIES
+
+
+def limiter_for(operation):
+    """Return the process-wide limiter of an operation, created on first use."""
+    with _limiters_lock:
+        if operation not in _limiters:
+            _limiters[operation] = AimdLimiter()
+        return _limiters[operation]
+
+
+def _retry_delay(e, attempt, delays, limiter, max_attempts, deadline):
+    """Return how long to wait before trying a failed call again, or None to give up."""
+    if not is_retryable_error(e):
+        return None
+    if is_throttling_error(e):
+        limiter.throttled()
+    delay = next(delays)
+    if attempt >= max_attempts or (deadline is not None and time.time() + delay > deadline):
+        return None
+    return delay
+
+
+def call(
+    func,
+    *args,
+    operation=None,
+    limiter=None,
+    deadline=None,
+    max_attempts=DEFAULT_MAX_ATTEMPTS,
+    **kwargs,
+):
+    """Call an AWS API at its operation's rate, retrying throttled and transient errors.
+
+    Args:
+        func: The function that makes the call, e.g. a boto3 client method.
+        *args: The positional arguments of func.
+        operation (str): The key of the limiter to pace the call with (default: the name of func).
+        limiter (AimdLimiter): A limiter to use instead of the operation's.
+        deadline (float): A time.time() after which the call is not tried again.
+        max_attempts (int): The number of times to try the call.
+        **kwargs: The keyword arguments of func.
+
+    Returns:
+        The result of func.
+
+    Raises:
+        botocore.exceptions.ClientError: The last error, if the call never succeeded.
+
+    """
+    limiter = limiter or limiter_for(operation or func.__qualname__)
+    delays = backoff_delays()
+    attempt = 0
+    while True:
+        attempt += 1
+        limiter.wait()
+        try:
+            result = func(*args, **kwargs)
+        except botocore.exceptions.ClientError as e:
+            delay = _retry_delay(e, attempt, delays, limiter, max_attempts, deadline)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        limiter.succeeded()
+        return result
+
+
+async def call_async(
+    func,
+    *args,
+    operation=None,
+    limiter=None,
+    deadline=None,
+    max_attempts=DEFAULT_MAX_ATTEMPTS,
+    **kwargs,
+):
+    """Like call(), but lets other tasks run in the meantime.
+
+    func runs in the event loop's default executor, since boto3 calls block, and the waits are
+    made with asyncio.sleep().
+    """
+    limiter = limiter or limiter_for(operation or func.__qualname__)
+    loop = asyncio.get_event_loop()
+    delays = backoff_delays()
+    attempt = 0
+    while True:
+        attempt += 1
+        await limiter.wait_async()
+        try:
+            result = await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+        except botocore.exceptions.ClientError as e:
+            delay = _retry_delay(e, attempt, delays, limiter, max_attempts, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        limiter.succeeded()
+        return result
+
+
+class _Operation:
+    """A client method that goes through call(), or call_async() with .call_async(...)."""
+
+    def __init__(self, method, operation, limiter):
+        self.method = method
+        self.operation = operation
+        self.limiter = limiter
+        functools.update_wrapper(self, method)
+
+    def __call__(self, *args, **kwargs):
+        return call(self.method, *args, operation=self.operation, limiter=self.limiter, **kwargs)
+
+    async def call_async(self, *args, **kwargs):
+        return await call_async(
+            self.method, *args, operation=self.operation, limiter=self.limiter, **kwargs
+        )
+
+
+class ThrottledClient:
+    """A boto3 client whose API calls are paced and retried by call().
+
+    Each operation has its own process-wide limiter, unless a limiter is given for all of them.
+    Paginators are the wrapped client's, with each page request going through call() as well.
+    Everything else, e.g. exceptions and meta, is the wrapped client's.
+
+    The wrapped client should be created with no_retries(), so that only call() retries.
+    """
+
+    def __init__(self, client, limiter=None):
+        self.unwrapped = client
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self.unwrapped, name)
+        api_name = self.unwrapped.meta.method_to_api_mapping.get(name)
+        if api_name is None:
+            return attr
+        meta = self.unwrapped.meta
+        operation = f"{meta.service_model.service_name}.{meta.region_name}.{api_name}"
+        return _Operation(attr, operation, self.limiter)
+
+    def get_paginator(self, operation_name):
+        paginator = self.unwrapped.get_paginator(operation_name)
+        # a paginator requests each page with the client method it was made from
+        paginator._method = getattr(self, operation_name)  # pylint: disable=protected-access
+        return paginator
+
+
+def client(session, service_name, config=None, **kwargs):
+    """Return a ThrottledClient for a service, created with a boto3 session and no retries."""
+    return ThrottledClient(session.client(service_name, config=no_retries(config), **kwargs))
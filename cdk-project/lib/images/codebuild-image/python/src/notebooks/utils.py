@@ -11,10 +11,14 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import json
+import os
 import re
+from urllib.parse import urlparse
 
 import boto3
 import botocore
+from notebooks import throttle
 
 _default_bucket = None
 _default_bucket_name_override = None
@@ -31,7 +35,7 @@ def kms_key(session=None):
 
     """
     session = ensure_session(session)
-    kms = session.client("kms")
+    kms = throttle.client(session, "kms")
     response = kms.describe_key(KeyId="alias/papermill")
     return response["KeyMetadata"]["Arn"]
 
@@ -54,8 +58,8 @@ def default_bucket(session=None):
 
     default_bucket = _default_bucket_name_override
     if not default_bucket:
-        account = session.client(
-            "sts", region_name=region, endpoint_url=sts_regional_endpoint(region)
+        account = throttle.client(
+            session, "sts", region_name=region, endpoint_url=sts_regional_endpoint(region)
         ).get_caller_identity()["Account"]
         default_bucket = "sagemaker-{}-{}".format(region, account)
 
@@ -153,7 +157,7 @@ def get_execution_role(session):
     Returns:
         (str): The role ARN
     """
-    assumed_role = session.client("sts").get_caller_identity()["Arn"]
+    assumed_role = throttle.client(session, "sts").get_caller_identity()["Arn"]
     if ":user/" in assumed_role:
         user_name = assumed_role[assumed_role.rfind("/") + 1 :]
         raise ValueError(
@@ -172,7 +176,7 @@ def get_execution_role(session):
 
     # Call IAM to get the role's path
     role_name = role[role.rfind("/") + 1 :]
-    arn = session.client("iam").get_role(RoleName=role_name)["Role"]["Arn"]
+    arn = throttle.client(session, "iam").get_role(RoleName=role_name)["Role"]["Arn"]
 
     if ":role/" in arn:
         return arn
@@ -180,6 +184,84 @@ def get_execution_role(session):
     raise ValueError(message.format(arn))
 
 
+def read_json(uri, session=None):
+    """Read a JSON document from S3 or from the local filesystem.
+
+    Args:
+        uri (str): An S3 uri ("s3://<bucket>/<key>") or a local path.
+        session (boto3.Session): A boto3 session to use for S3 uris.
+
+    Returns:
+        The decoded document, or None if it does not exist.
+    """
+    if not uri.startswith("s3://"):
+        if not os.path.exists(uri):
+            return None
+        with open(uri, "r") as f:
+            return json.load(f)
+
+    session = ensure_session(session)
+    o = urlparse(uri)
+    try:
+        response = throttle.client(session, "s3").get_object(
+            Bucket=o.netloc, Key=o.path.lstrip("/")
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(response["Body"].read())
+
+
+def write_json(uri, document, session=None):
+    """Write a JSON document to S3 or to the local filesystem.
+
+    Args:
+        uri (str): An S3 uri ("s3://<bucket>/<key>") or a local path.
+        document: The JSON-serializable document to write.
+        session (boto3.Session): A boto3 session to use for S3 uris.
+    """
+    body = json.dumps(document, indent=1, sort_keys=True, default=str)
+    if not uri.startswith("s3://"):
+        directory = os.path.dirname(uri)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(uri, "w") as f:
+            f.write(body)
+        return
+
+    session = ensure_session(session)
+    o = urlparse(uri)
+    throttle.client(session, "s3").put_object(
+        Bucket=o.netloc, Key=o.path.lstrip("/"), Body=body.encode("utf-8")
+    )
+
+
+def save_csv_to_s3(df, csv_name, session=None):
+    """Write a DataFrame to a local CSV file and upload it next to the full repo scans.
+
+    Args:
+        df (pandas.DataFrame): The table to save.
+        csv_name (str): The name of the CSV file, locally and in S3.
+        session (boto3.Session): A boto3 session to use for S3.
+
+    Returns:
+        str: The S3 uri of the uploaded file.
+    """
+    session = ensure_session(session)
+
+    df.to_csv(csv_name, index=False)
+
+    s3 = throttle.client(session, "s3")
+    bucket = default_bucket(session)
+    prefix = "full_repo_scan"
+
+    s3_path = os.path.join(prefix, csv_name)
+    s3.upload_file(csv_name, bucket, s3_path)
+
+    return f"s3://{bucket}/{prefix}/{csv_name}"
+
+
 def ensure_session(session=None):
     """If session is None, create a default session and return it. Otherwise return the session passed in"""
     if session is None:
@@ -15,25 +15,84 @@
 
 from __future__ import print_function
 
+import csv
 import json
 import os
+import re
+import subprocess
 import sys
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from urllib.parse import urlparse
 from urllib.request import urlopen
-from random import randint
-from time import sleep
+from random import uniform
+from time import sleep, time
 import boto3
 import botocore
 import jupyter_client.kernelspec as kernelspec
+import nbformat
 import papermill
+from papermill.exceptions import PapermillExecutionError
 
 input_var = "PAPERMILL_INPUT"
 output_var = "PAPERMILL_OUTPUT"
 params_var = "PAPERMILL_PARAMS"
+notebook_name_var = "PAPERMILL_NOTEBOOK_NAME"
+sample_interval_var = "PAPERMILL_SAMPLE_INTERVAL"
+manifest_var = "PAPERMILL_MANIFEST"
+concurrency_var = "PAPERMILL_CONCURRENCY"
+container_start_var = "PAPERMILL_CONTAINER_START"
+base_kernel = "base-env"
+
+status_suffix = ".status.json"
+timings_suffix = ".timings.csv"
+timings_columns = [
+    "cell_index",
+    "execution_count",
+    "status",
+    "start_time",
+    "end_time",
+    "duration",
+    "sagemaker_wait",
+    "source",
+]
+resources_suffix = ".resources.csv"
+resources_columns = [
+    "elapsed",
+    "cpu_count",
+    "cpu_percent",
+    "kernel_rss_bytes",
+    "memory_used_bytes",
+    "memory_total_bytes",
+    "disk_read_bytes",
+    "disk_write_bytes",
+    "net_recv_bytes",
+    "net_sent_bytes",
+]
+default_sample_interval = 5
+# Cells that block on SageMaker jobs or endpoints: estimator.fit(), model.deploy(), tuner.wait(),
+# transformer.transform(), processor.run(), session.wait_for_job() and any call made with
+# wait=True. fit, transform, run and wait are common names, so they only count on a receiver
+# named like a SageMaker object; subprocess.run() or thread.wait() don't.
+sagemaker_wait_pat = re.compile(
+    r"\b(\w*(estimator|predictor|transformer|processor|tuner)\w*|sagemaker(\.\w+)*)"
+    r"\.(fit|transform|run|wait)\s*\(|\.(deploy|wait_for_\w+)\s*\(|\bwait\s*=\s*True",
+    re.IGNORECASE,
+)
+max_source_excerpt = 2000
+max_download_attempts = 6
+throttling_codes = {"SlowDown", "Throttling", "ThrottlingException", "RequestLimitExceeded", "503"}
+ansi_escape_pat = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
 
 
 def run_notebook():
+    phases = {}
+    startup = Startup()
+    phase_start = time()
+    output_notebook = os.environ.get(output_var)
+    sampler = ResourceSampler.start_for(output_notebook)
     try:
         notebook = os.environ[input_var]
         output_notebook = os.environ[output_var]
@@ -42,42 +101,25 @@ def run_notebook():
         notebook_dir = os.path.dirname(notebook)
         notebook_file = os.path.basename(notebook)
 
-        pause = randint(1,10)
-        print("Waiting {} seconds....".format(pause))
-        sleep(pause)
-
         # If the user specified notebook path in S3, run with that path.
         if notebook.startswith("s3://"):
             print("Downloading notebook {}".format(notebook))
             o = urlparse(notebook)
-            bucket = o.netloc
-            key = o.path[1:]
-
-            s3 = boto3.resource("s3")
-
-            try:
-                s3.Bucket(bucket).download_file(key, "/tmp/" + notebook_file)
-                notebook_dir = "/tmp"
-            except botocore.exceptions.ClientError as e:
-                if e.response["Error"]["Code"] == "404":
-                    print("The notebook {} does not exist.".format(notebook))
-                raise
+            download_file(o.netloc, o.path[1:], "/tmp/" + notebook_file)
+            notebook_dir = "/tmp"
             print("Download complete")
+        phases["download"] = time() - phase_start
+        startup.mark("download")
+        phase_start = time()
 
         os.chdir(notebook_dir)
+        nb = nbformat.read(notebook_file, as_version=4)
+        startup.mark("notebook_loaded")
 
         kernel = os.environ.get("PAPERMILL_KERNEL", None)
         if not kernel:
-            nb_kernel = kernel_for(notebook_file)
-            avail_kernels = available_kernels()
-            print("The kernel found in the notebook metadata is: ", nb_kernel)
-            print("The kernels available to execute within jupyter are kernels are: ", ','.join(avail_kernels))
-            if nb_kernel is None or nb_kernel not in avail_kernels:
-                print("No default notebook kernel found or it is not available in the execution environment, picking from available kernels")
-                kernel = avail_kernels[0]
-            else:
-                print("Using notebook provided kernel: ", nb_kernel)
-                kernel = nb_kernel
+            kernel = pick_kernel(nb.metadata.get("kernelspec", {}).get("name"))
+        startup.mark("kernel_selected")
 
         print(
             "Executing {} with output to {}{}".format(
@@ -87,9 +129,11 @@ def run_notebook():
             )
         )
         print("Notebook params = {}".format(params))
+        phases["kernel"] = time() - phase_start
+        phase_start = time()
         arg_map = dict(kernel_name=kernel) if kernel else {}
         papermill.execute_notebook(
-            input_path=notebook_file,
+            input_path=nb,
             output_path=output_notebook,
             parameters=params,
             progress_bar=False,
@@ -97,9 +141,16 @@ def run_notebook():
             cwd=notebook_dir,
             **arg_map,
         )
+        phases["execute"] = time() - phase_start
         print("Execution complete")
+        startup.first_cell(write_timings(output_notebook))
 
     except Exception as e:
+        phases.setdefault("execute", time() - phase_start)
+        startup.first_cell(write_timings(output_notebook))
+        if sampler:
+            sampler.stop()
+        write_status(output_notebook, "Failed", phases, exception=e, startup=startup)
         message = str(e)
 
         if len(message) > 1024:
@@ -124,30 +175,334 @@ def run_notebook():
         # A non-zero exit code causes the Processing job to be marked as Failed.
         sys.exit(1)
 
+    if sampler:
+        sampler.stop()
+    write_status(output_notebook, "Completed", phases, startup=startup)
     if not os.path.exists(output_notebook):
         print("No output notebook was generated")
     else:
         print("Output was written to {}".format(output_notebook))
 
 
-def available_kernels():
-    """Return the list of kernels"""
+class Startup:
+    """Timestamps of the container startup phases, relative to the container start.
+
+    The run_notebook entrypoint exports the time the container started in
+    PAPERMILL_CONTAINER_START; without it, the start of this process is used. Every phase is
+    printed when it ends and recorded in the status sidecar, along with the time to first cell.
+    """
+
+    def __init__(self):
+        self.container_start = float(os.environ.get(container_start_var) or time())
+        self.events = {"process_start": round(time() - self.container_start, 3)}
+        self.time_to_first_cell = None
+        print("Startup: process_start at +{:.2f} s".format(self.events["process_start"]))
+
+    def mark(self, phase):
+        self.events[phase] = round(time() - self.container_start, 3)
+        print("Startup: {} at +{:.2f} s".format(phase, self.events[phase]))
+
+    def first_cell(self, start_time):
+        """Record when the first code cell started, as reported by papermill"""
+        if start_time is None:
+            return
+        self.time_to_first_cell = round(start_time - self.container_start, 3)
+        print("Startup: time to first cell {:.2f} s".format(self.time_to_first_cell))
+
+    def record(self):
+        return {
+            "container_start": self.container_start,
+            "events": self.events,
+            "time_to_first_cell": self.time_to_first_cell,
+        }
+
+
+def download_file(bucket, key, path):
+    """Download an object, backing off with jitter only when S3 throttles the request"""
+    s3 = boto3.resource("s3")
+    for attempt in range(max_download_attempts):
+        try:
+            s3.Bucket(bucket).download_file(key, path)
+            return
+        except botocore.exceptions.ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "404":
+                print("The notebook s3://{}/{} does not exist.".format(bucket, key))
+                raise
+            if code not in throttling_codes or attempt == max_download_attempts - 1:
+                raise
+            pause = uniform(0, min(2**attempt, 10))
+            print("S3 throttled the download ({}), retrying in {:.1f} seconds".format(code, pause))
+            sleep(pause)
+
+
+def pick_kernel(nb_kernel):
+    """Return the notebook's kernel if it is installed, otherwise the first available kernel"""
     mgr = kernelspec.KernelSpecManager()
-    return list(mgr.find_kernel_specs().keys())
+    if nb_kernel:
+        try:
+            mgr.get_kernel_spec(nb_kernel)
+            print("Using notebook provided kernel: ", nb_kernel)
+            return nb_kernel
+        except kernelspec.NoSuchKernel:
+            pass
+    avail_kernels = list(mgr.find_kernel_specs().keys())
+    if base_kernel not in avail_kernels:
+        # Images built before base-env was registered at build time.
+        print("Registering the {} kernel".format(base_kernel))
+        subprocess.check_call(
+            [sys.executable, "-m", "ipykernel", "install", "--user", "--name", base_kernel]
+        )
+        avail_kernels = list(mgr.find_kernel_specs().keys())
+    print("The kernel found in the notebook metadata is: ", nb_kernel)
+    print("The kernels available to execute within jupyter are: ", ",".join(avail_kernels))
+    print("Notebook kernel is not available in the execution environment, using the first one")
+    return avail_kernels[0]
+
+
+def run_batch(manifest_path):
+    """Run every notebook in a batch manifest, each in its own execute.py process.
+
+    The manifest is a JSON document with a "notebooks" list, each entry giving the notebook name,
+    its local input path, its local output path and its parameters. Up to PAPERMILL_CONCURRENCY
+    notebooks run at the same time. Every notebook writes its own output notebook and sidecars,
+    and the job fails if any notebook fails.
+    """
+    with open(manifest_path, "r") as f:
+        entries = json.load(f)["notebooks"]
+    concurrency = max(int(os.environ.get(concurrency_var, 1)), 1)
+    print("Running a batch of {} notebooks, {} at a time".format(len(entries), concurrency))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        exit_codes = list(executor.map(run_batch_entry, entries))
+
+    failed = [entry["notebook"] for entry, code in zip(entries, exit_codes) if code != 0]
+    for entry, code in zip(entries, exit_codes):
+        print("{}: {}".format(entry["notebook"], "Failed" if code != 0 else "Completed"))
+
+    if failed:
+        message = "{} of {} notebooks failed: {}".format(
+            len(failed), len(entries), ", ".join(failed)
+        )
+        with open("/opt/ml/output/message", "w") as failure:
+            failure.write(message[:1023])
+        sys.exit(1)
+
 
+def run_batch_entry(entry):
+    """Run one notebook of a batch in a child process and return its exit code.
 
-def kernel_for(notebook):
-    """Read the notebook and extract the kernel name, if any"""
-    with open(notebook, "r") as f:
-        nb = json.load(f)
+    The child's output is copied to the job log line by line, prefixed with the notebook name so
+    that interleaved logs of concurrent notebooks can be told apart.
+    """
+    env = dict(os.environ)
+    env.pop(manifest_var, None)
+    env[input_var] = entry["input"]
+    env[output_var] = entry["output"]
+    env[params_var] = json.dumps(entry.get("parameters", {}))
+    env[notebook_name_var] = entry["notebook"]
 
-        md = nb.get("metadata")
-        if md:
-            ks = md.get("kernelspec")
-            if ks:
-                return ks["name"]
-    return None
+    prefix = "[{}] ".format(os.path.basename(entry["notebook"]))
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    for line in child.stdout:
+        print(prefix + line, end="")
+    return child.wait()
+
+
+def status_path(output_notebook):
+    """Return the path of the status sidecar that goes next to the output notebook"""
+    return os.path.splitext(output_notebook)[0] + status_suffix
+
+
+class ResourceSampler(threading.Thread):
+    """Periodically sample CPU, memory, disk and network usage into a CSV sidecar.
+
+    Memory is reported both for the kernel process tree (every descendant of this process) and
+    for the whole instance. Disk and network counters are bytes transferred since the sampler
+    started.
+    """
+
+    def __init__(self, path, interval, psutil):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.psutil = psutil
+        self.stopped = threading.Event()
+
+    @classmethod
+    def start_for(cls, output_notebook):
+        """Start a sampler writing next to the output notebook, if sampling is enabled"""
+        try:
+            interval = float(os.environ.get(sample_interval_var, default_sample_interval))
+        except ValueError:
+            print(
+                "{} is not a number, resource usage will not be sampled: {}".format(
+                    sample_interval_var, os.environ[sample_interval_var]
+                ),
+                file=sys.stderr,
+            )
+            return None
+        if not output_notebook or interval <= 0:
+            return None
+        try:
+            import psutil
+        except ImportError:
+            print("psutil is not installed, resource usage will not be sampled")
+            return None
+        sampler = cls(os.path.splitext(output_notebook)[0] + resources_suffix, interval, psutil)
+        sampler.start()
+        return sampler
+
+    def stop(self):
+        self.stopped.set()
+        self.join(self.interval + 5)
+
+    def run(self):
+        try:
+            self.sample_until_stopped()
+        except Exception as e:
+            print("Resource sampling stopped: {}".format(e), file=sys.stderr)
+
+    def sample_until_stopped(self):
+        psutil = self.psutil
+        me = psutil.Process()
+        start = time()
+        disk_start = psutil.disk_io_counters()
+        net_start = psutil.net_io_counters()
+        psutil.cpu_percent()
+
+        with open(self.path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(resources_columns)
+            while not self.stopped.wait(self.interval):
+                kernel_rss = 0
+                for child in me.children(recursive=True):
+                    try:
+                        kernel_rss += child.memory_info().rss
+                    except psutil.Error:
+                        pass
+                memory = psutil.virtual_memory()
+                disk = psutil.disk_io_counters()
+                net = psutil.net_io_counters()
+                writer.writerow(
+                    [
+                        round(time() - start, 1),
+                        psutil.cpu_count(),
+                        psutil.cpu_percent(),
+                        kernel_rss,
+                        memory.total - memory.available,
+                        memory.total,
+                        disk.read_bytes - disk_start.read_bytes if disk else "",
+                        disk.write_bytes - disk_start.write_bytes if disk else "",
+                        net.bytes_recv - net_start.bytes_recv,
+                        net.bytes_sent - net_start.bytes_sent,
+                    ]
+                )
+                f.flush()
+
+
+def write_timings(output_notebook):
+    """Write the per-cell timings papermill recorded in the output notebook to a CSV sidecar.
+
+    Returns the time the first code cell started, in seconds since the epoch, if it ran.
+    """
+    if not output_notebook or not os.path.exists(output_notebook):
+        return None
+    first_start = None
+    try:
+        with open(output_notebook, "r") as f:
+            nb = json.load(f)
+
+        path = os.path.splitext(output_notebook)[0] + timings_suffix
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(timings_columns)
+            for index, cell in enumerate(nb.get("cells", [])):
+                if cell.get("cell_type") != "code":
+                    continue
+                source = cell.get("source", "")
+                if isinstance(source, list):
+                    source = "".join(source)
+                pm = cell.get("metadata", {}).get("papermill", {})
+                if first_start is None and pm.get("start_time"):
+                    first_start = parse_utc(pm["start_time"])
+                lines = source.strip().splitlines()
+                writer.writerow(
+                    [
+                        index,
+                        cell.get("execution_count"),
+                        pm.get("status"),
+                        pm.get("start_time"),
+                        pm.get("end_time"),
+                        pm.get("duration"),
+                        int(bool(sagemaker_wait_pat.search(source))),
+                        lines[0][:80] if lines else "",
+                    ]
+                )
+    except Exception as e:
+        print("Unable to write the timings sidecar: {}".format(e), file=sys.stderr)
+    return first_start
+
+
+def parse_utc(timestamp):
+    """Convert a papermill cell timestamp, an ISO 8601 time in UTC, to seconds since the epoch"""
+    parsed = datetime.fromisoformat(timestamp.rstrip("Z"))
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+def describe_exception(e):
+    """Return a JSON-serializable description of the exception that stopped the notebook"""
+    if isinstance(e, PapermillExecutionError):
+        source = e.source or ""
+        return {
+            "class": e.ename,
+            "message": e.evalue,
+            "cell_index": e.cell_index,
+            "execution_count": e.exec_count,
+            "source": source[:max_source_excerpt],
+            "traceback": [ansi_escape_pat.sub("", line) for line in e.traceback],
+        }
+    return {
+        "class": type(e).__name__,
+        "message": str(e),
+        "cell_index": None,
+        "execution_count": None,
+        "source": None,
+        "traceback": traceback.format_exception(type(e), e, e.__traceback__),
+    }
+
+
+def write_status(output_notebook, status, phases, exception=None, startup=None):
+    """Write a small JSON sidecar describing the outcome of the run next to the output notebook.
+
+    Reporting tools read this instead of parsing the truncated failure message or the full output
+    notebook.
+    """
+    if not output_notebook:
+        return
+    record = {
+        "notebook": os.environ.get(notebook_name_var),
+        "status": status,
+        "phases": phases,
+        "exception": describe_exception(exception) if exception is not None else None,
+        "startup": startup.record() if startup is not None else None,
+    }
+    try:
+        with open(status_path(output_notebook), "w") as f:
+            json.dump(record, f, indent=1, default=str)
+    except Exception as e:
+        # The sidecar is best effort; it must never mask the notebook's own result.
+        print("Unable to write the status sidecar: {}".format(e), file=sys.stderr)
 
 
 if __name__ == "__main__":
-    run_notebook()
+    if os.environ.get(manifest_var):
+        run_batch(os.environ[manifest_var])
+    else:
+        run_notebook()
@@ -163,16 +163,27 @@ export class ProjectStack extends cdk.Stack {
             source: source,
         });
 
-        const buildSource = codebuild.Source.gitHub({
-            owner: p.owner || common.Constants.defaultGitHubOwner,
-            repo: p.repo,
-            reportBuildStatus: false,
-            webhook: true,
-        });
-
         for (const build of p.additionalBuildProjects) {
             const defaultAdditionalBuildImage = this.buildImage;
 
+            // pull requests that don't touch the files a build checks don't start it at all
+            const webhookFilters = build.filePathPattern
+                ? [
+                      codebuild.FilterGroup.inEventOf(
+                          codebuild.EventAction.PULL_REQUEST_CREATED,
+                          codebuild.EventAction.PULL_REQUEST_UPDATED,
+                          codebuild.EventAction.PULL_REQUEST_REOPENED,
+                      ).andFilePathIs(build.filePathPattern),
+                  ]
+                : undefined;
+            const buildSource = codebuild.Source.gitHub({
+                owner: p.owner || common.Constants.defaultGitHubOwner,
+                repo: p.repo,
+                reportBuildStatus: false,
+                webhook: true,
+                webhookFilters: webhookFilters,
+            });
+
             const buildProject = new codebuild.Project(this, build.name, {
                 projectName: build.name,
                 role: this.pullRequestBuildRole,
@@ -273,16 +284,24 @@ export class ProjectStack extends cdk.Stack {
             ); // source
         }
 
-        const buildOutputArtifact = new cp.Artifact("ARTIFACT_1");
+        // one build per shard, all running in parallel in the same stage
+        const buildOutputArtifacts = [...Array(p.releaseShards).keys()].map(
+            (i) => new cp.Artifact(`ARTIFACT_${i + 1}`),
+        );
 
         const buildStage = pipeline.addStage({ stageName: "Build" });
-        const buildAction = new cpa.CodeBuildAction({
-            actionName: "BuildAction",
-            project: buildProject,
-            input: sourceOutputArtifact,
-            outputs: [buildOutputArtifact],
+        buildOutputArtifacts.forEach((buildOutputArtifact, i) => {
+            const buildAction = new cpa.CodeBuildAction({
+                actionName: p.releaseShards > 1 ? `BuildAction${i + 1}` : "BuildAction",
+                project: buildProject,
+                input: sourceOutputArtifact,
+                outputs: [buildOutputArtifact],
+                environmentVariables: {
+                    SHARD: { value: `${i + 1}/${p.releaseShards}` },
+                },
+            });
+            buildStage.addAction(buildAction);
         });
-        buildStage.addAction(buildAction);
 
         const waitStage = pipeline.addStage({ stageName: "Wait" });
 
@@ -300,8 +319,8 @@ export class ProjectStack extends cdk.Stack {
         const deployStage = pipeline.addStage({ stageName: "Deploy" });
         const additionalInputArtifacts =
             source === undefined
-                ? [buildOutputArtifact]
-                : [sourceOutputArtifact, buildOutputArtifact];
+                ? buildOutputArtifacts
+                : [sourceOutputArtifact, ...buildOutputArtifacts];
 
         deployStage.addAction(
             new cpa.CodeBuildAction({
@@ -14,6 +14,7 @@ export const projects: Project[] = [
         deployBuildSpec: buildspecs.createRepoScanResultsBuildSpec(),
         enableAutomaticRelease: true,
         releasePipelineScheduleExpression: "cron(0 0 ? * * *)",
+        releaseShards: 3,
         additionalBuildProjects: [
             // new Build({
             //     name: "sagemaker-examples-notebook-instance",
@@ -24,11 +25,13 @@ export const projects: Project[] = [
                 name: "sagemaker-examples-code-formatting",
                 pullRequestBuildSpec: buildspecs.createCodeFormattingBuildSpec(),
                 computeType: codebuild.ComputeType.LARGE,
+                filePathPattern: "\\.ipynb$",
             }),
             new Build({
                 name: "sagemaker-examples-grammar",
                 pullRequestBuildSpec: buildspecs.createGrammarBuildSpec(),
                 computeType: codebuild.ComputeType.LARGE,
+                filePathPattern: "\\.ipynb$",
             }),
             new Build({
                 name: "sagemaker-examples-link-check",